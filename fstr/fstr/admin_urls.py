@@ -0,0 +1,12 @@
+"""
+Маршруты админ-панели для режима LEAN_STARTUP.
+
+В этом режиме admin.autodiscover() не вызывается при старте (SimpleAdminConfig),
+поэтому модули admin.py регистрируются при первом обращении к /admin/.
+"""
+
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = admin.site.get_urls()
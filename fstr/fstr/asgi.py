@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fstr.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Поток уведомлений о статусах (GET /api/submitData/events/) обслуживается до Django:
+# простаивающий подписчик не занимает поток и соединение с БД
+from pereval.events import route_events  # noqa: E402 - после настройки Django
+
+application = route_events(django_application)
+
+# Соединение с БД и кэши открываются до первого запроса (см. fstr.warmup)
+if settings.WARMUP_ON_START:
+    from fstr.warmup import warm_up
+    warm_up()
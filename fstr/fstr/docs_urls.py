@@ -0,0 +1,27 @@
+"""
+Маршруты документации API (Swagger, ReDoc, OpenAPI JSON).
+
+Вынесены из fstr.urls, чтобы в режиме LEAN_STARTUP drf_yasg импортировался
+только при первом обращении к документации.
+"""
+
+from django.conf import settings
+from django.urls import path
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+from .schema import API_INFO, schema_json
+
+# Страницы UI строятся без интроспекции (patterns=[]), а саму схему
+# Swagger и ReDoc загружают из предгенерированного schema-json (SPEC_URL)
+schema_view = get_schema_view(
+    API_INFO,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+)
+
+urlpatterns = [
+    path('swagger.json', schema_json, name='schema-json'),
+    path('swagger/', schema_view.with_ui('swagger', cache_timeout=settings.SCHEMA_CACHE_TIMEOUT), name='schema-swagger-ui'),
+    path('redoc/', schema_view.with_ui('redoc', cache_timeout=settings.SCHEMA_CACHE_TIMEOUT), name='schema-redoc'),
+]
@@ -0,0 +1,76 @@
+"""
+Предварительно сгенерированная OpenAPI-схема для Swagger UI и ReDoc.
+
+Схема собирается один раз (при сборке образа командой generate_schema или
+при первом запросе), хранится в памяти процесса и отдаётся с ETag, поэтому
+обращения к /swagger/ и /redoc/ не запускают повторную интроспекцию views.
+"""
+
+import hashlib
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition, require_GET
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+API_INFO = openapi.Info(
+    title="FSTR API",
+    default_version="v1",
+    description="API для работы с горными перевалами",
+)
+
+_lock = threading.Lock()
+_cached = None  # (content, etag)
+
+
+def build_schema():
+    """Генерирует схему по всем маршрутам API и возвращает её в виде JSON-байтов"""
+    from pereval.docs import apply_swagger_docs
+    apply_swagger_docs()
+
+    generator = OpenAPISchemaGenerator(API_INFO)
+    schema = generator.get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def write_schema(path=None):
+    """Сохраняет сгенерированную схему в файл и сбрасывает кэш в памяти"""
+    path = Path(path or settings.OPENAPI_SCHEMA_FILE)
+    content = build_schema()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    tmp_path.write_bytes(content)
+    tmp_path.replace(path)
+    reset_schema_cache()
+    return path, len(content)
+
+
+def get_schema():
+    """Возвращает пару (content, etag); схема читается из файла или генерируется один раз"""
+    global _cached
+    if _cached is None:
+        with _lock:
+            if _cached is None:
+                path = Path(settings.OPENAPI_SCHEMA_FILE)
+                content = path.read_bytes() if path.is_file() else build_schema()
+                _cached = (content, '"%s"' % hashlib.sha256(content).hexdigest()[:32])
+    return _cached
+
+
+def reset_schema_cache():
+    global _cached
+    with _lock:
+        _cached = None
+
+
+@require_GET
+@condition(etag_func=lambda request: get_schema()[1])
+def schema_json(request):
+    content, etag = get_schema()
+    response = HttpResponse(content, content_type='application/json; charset=utf-8')
+    response['Cache-Control'] = 'public, max-age=%d' % settings.SCHEMA_CACHE_TIMEOUT
+    return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -28,9 +29,16 @@ DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 allowed_hosts_str = os.getenv('ALLOWED_HOSTS', 'localhost,127.0.0.1,bbacg4nrhlert7e578rs.containers.yandexcloud.net')
 ALLOWED_HOSTS = [host.strip() for host in allowed_hosts_str.split(',')]
 
+# Облегчённый старт для serverless: админка и документация API импортируются
+# при первом обращении, а не при запуске воркера
+LEAN_STARTUP = os.getenv('LEAN_STARTUP', 'False').lower() == 'true'
+
+# Открывать соединение с БД и прогревать кэши при загрузке WSGI-приложения
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'False').lower() == 'true'
+
 # Application definition
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    'django.contrib.admin.apps.SimpleAdminConfig' if LEAN_STARTUP else 'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -42,8 +50,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pereval.middleware.AccessLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'pereval.middleware.CompressionMiddleware',
+    'pereval.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -81,6 +92,9 @@ DATABASES = {
         'PASSWORD': os.getenv('FSTR_DB_PASS', 'password'),
         'HOST': os.getenv('FSTR_DB_HOST', 'db'),
         'PORT': os.getenv('FSTR_DB_PORT', '5432'),
+        # Постоянные соединения: TLS-рукопожатие не повторяется на каждый запрос
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
         # Добавляем SSL для Yandex Cloud Managed PostgreSQL
         'OPTIONS': {
             'sslmode': os.getenv('DB_SSL_MODE', 'require'),
@@ -88,6 +102,200 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения: FSTR_DB_REPLICAS=host[:port][/dbname],...
+# Остальные параметры подключения берутся из основной БД
+DATABASE_REPLICAS = []
+for i, replica in enumerate(filter(None, map(str.strip, os.getenv('FSTR_DB_REPLICAS', '').split(','))), start=1):
+    address, _, name = replica.partition('/')
+    host, _, port = address.partition(':')
+    alias = f'replica{i}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'NAME': name or DATABASES['default']['NAME'],
+    }
+    DATABASE_REPLICAS.append(alias)
+
+# Шарды перевалов по регионам: FSTR_DB_SHARDS=host[:port][/dbname],... (см. pereval.sharding).
+# Основная БД — шард номер 0; порядок шардов менять нельзя, он закодирован в id записей.
+# FSTR_SHARD_REGIONS=45N007E=shard1,43N042E=default закрепляет регионы за шардами
+DATABASE_SHARDS = ['default']
+for i, shard in enumerate(filter(None, map(str.strip, os.getenv('FSTR_DB_SHARDS', '').split(','))), start=1):
+    address, _, name = shard.partition('/')
+    host, _, port = address.partition(':')
+    alias = f'shard{i}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'NAME': name or DATABASES['default']['NAME'],
+    }
+    DATABASE_SHARDS.append(alias)
+SHARD_REGIONS = dict(
+    item.strip().split('=', 1) for item in os.getenv('FSTR_SHARD_REGIONS', '').split(',') if item.strip()
+)
+SHARD_ID_BITS = 48
+
+DATABASE_ROUTERS = ['pereval.routers.PrimaryReplicaRouter']
+
+# Сколько секунд после записи клиент читает из основной БД
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+
+# Координаты перевала хранятся в полях PerevalAdded. При False для каждого
+# перевала дополнительно создаётся строка PerevalCoords (прежняя схема)
+INLINE_COORDS = os.getenv('INLINE_COORDS', 'False').lower() == 'true'
+
+# Архивация: записи с этими статусами старше ARCHIVE_AFTER_DAYS дней
+# переносятся в архивные таблицы командой archive_perevals
+ARCHIVE_STATUSES = [s.strip() for s in os.getenv('ARCHIVE_STATUSES', 'rejected').split(',') if s.strip()]
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '100'))
+
+# Размер страницы инкрементальной синхронизации (/api/submitData/changes/)
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', '100'))
+SYNC_MAX_PAGE_SIZE = int(os.getenv('SYNC_MAX_PAGE_SIZE', '500'))
+# Окно перечитывания перед курсором синхронизации: изменения транзакций, зафиксированных
+# позже более новых, не теряются, если транзакция короче окна
+SYNC_OVERLAP_SECONDS = int(os.getenv('SYNC_OVERLAP_SECONDS', '60'))
+
+# Максимальное число id в одном запросе /api/submitData/batch/
+MULTI_GET_MAX_IDS = int(os.getenv('MULTI_GET_MAX_IDS', '100'))
+
+# Сколько изображений можно приложить к перевалу (POST и PATCH)
+SUBMIT_MAX_IMAGES = int(os.getenv('SUBMIT_MAX_IMAGES', '20'))
+
+# Асинхронный приём: POST /api/submitData/ ставит данные в очередь и отвечает 202,
+# перевалы сохраняет команда drain_submissions пачками по INGEST_BATCH_SIZE
+ASYNC_INGEST = os.getenv('ASYNC_INGEST', 'False').lower() == 'true'
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '200'))
+
+# Фоновые задачи (команда run_jobs). POST_SUBMIT_JOBS — задачи, которые ставятся
+# в очередь после добавления перевала, например "detect_duplicates"
+POST_SUBMIT_JOBS = [s.strip() for s in os.getenv('POST_SUBMIT_JOBS', '').split(',') if s.strip()]
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', '4'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_BACKOFF_SECONDS = float(os.getenv('JOB_BACKOFF_SECONDS', '10'))
+JOB_LOCK_TIMEOUT = int(os.getenv('JOB_LOCK_TIMEOUT', '600'))
+DUPLICATE_RADIUS_DEGREES = float(os.getenv('DUPLICATE_RADIUS_DEGREES', '0.01'))
+
+# Проверка ссылок на изображения и миниатюры (задача check_images)
+IMAGE_FETCH_CONCURRENCY = int(os.getenv('IMAGE_FETCH_CONCURRENCY', '8'))
+IMAGE_FETCH_TIMEOUT = float(os.getenv('IMAGE_FETCH_TIMEOUT', '10'))
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(20 * 1024 * 1024)))
+# Загрузка с частных и локальных адресов (только для разработки: ссылки присылают пользователи)
+IMAGE_FETCH_ALLOW_PRIVATE = os.getenv('IMAGE_FETCH_ALLOW_PRIVATE', 'False').lower() == 'true'
+THUMBNAIL_DIR = os.getenv('THUMBNAIL_DIR', str(BASE_DIR / 'thumbnails'))
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', '128'))
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+
+# Снимок принятых перевалов для GET /api/submitData/<id>/ (команда build_snapshot).
+# Воркеры проверяют, не пересобран ли файл, не чаще раза в SNAPSHOT_CHECK_SECONDS
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', str(BASE_DIR / 'snapshots' / 'accepted.snap'))
+SNAPSHOT_CHECK_SECONDS = float(os.getenv('SNAPSHOT_CHECK_SECONDS', '1'))
+# Задержка пересборки снимка после изменения принятого перевала (до неё запросы читают БД)
+SNAPSHOT_REBUILD_DELAY = int(os.getenv('SNAPSHOT_REBUILD_DELAY', '60'))
+# Задержка пересчёта статистики (GET /api/stats/) после добавления или изменения перевала
+STATS_REFRESH_DELAY = int(os.getenv('STATS_REFRESH_DELAY', '300'))
+
+# Кластеры на карте: до MAP_CLUSTER_MAX_ZOOM тайлы строятся по заранее посчитанной сетке,
+# на более крупных масштабах отдаются сами перевалы (не больше MAP_TILE_MAX_POINTS на тайл).
+# При изменении MAP_CLUSTER_MAX_ZOOM сетку нужно пересчитать командой rebuild_map_grid
+MAP_CLUSTER_MAX_ZOOM = int(os.getenv('MAP_CLUSTER_MAX_ZOOM', '14'))
+# Масштабы меньше MAP_GRID_MIN_ZOOM не хранятся, а собираются при чтении из ячеек этого масштаба:
+# добавление перевала не блокирует общие для всего мира ячейки
+MAP_GRID_MIN_ZOOM = int(os.getenv('MAP_GRID_MIN_ZOOM', '5'))
+MAP_TILE_MAX_POINTS = int(os.getenv('MAP_TILE_MAX_POINTS', '500'))
+MAP_TILE_CACHE_SECONDS = int(os.getenv('MAP_TILE_CACHE_SECONDS', '60'))
+
+# Ограничение частоты запросов (token bucket) по IP и email автора.
+# Корзины хранятся в файле THROTTLE_STATE_FILE, отображённом в память, и общие
+# для всех воркеров на машине; лимиты — THROTTLE_RATE_* в формате DRF ("30/min")
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'True').lower() == 'true'
+THROTTLE_STATE_FILE = os.getenv(
+    'THROTTLE_STATE_FILE',
+    '/dev/shm/fstr-throttle' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'fstr-throttle'),
+)
+THROTTLE_SLOTS = int(os.getenv('THROTTLE_SLOTS', '65536'))
+
+# Сжатие ответов API (gzip, brotli при установленном пакете Brotli) от COMPRESSION_MIN_SIZE байт.
+# Сжатые тела кэшируются в памяти процесса (не больше COMPRESSION_CACHE_BYTES)
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'True').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_BYTES = int(os.getenv('COMPRESSION_CACHE_BYTES', str(32 * 1024 * 1024)))
+
+# Каталог перевалов (GET /api/catalog/): размер страницы и бюджет подсчёта фасетов.
+# Точный подсчёт прерывается через CATALOG_FACET_BUDGET_MS (0 — без ограничения), после чего
+# счётчики оцениваются по CATALOG_FACET_SAMPLE_PERCENT процентам страниц таблицы
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '50'))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv('CATALOG_MAX_PAGE_SIZE', '200'))
+CATALOG_FACET_BUDGET_MS = int(os.getenv('CATALOG_FACET_BUDGET_MS', '250'))
+CATALOG_FACET_SAMPLE_PERCENT = float(os.getenv('CATALOG_FACET_SAMPLE_PERCENT', '1'))
+
+# Уведомления о смене статуса (server-sent events, только под ASGI: fstr.asgi).
+# Клиент, не читающий события, отключается при переполнении очереди EVENTS_QUEUE_SIZE
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '100'))
+# Сколько потоков событий один клиент (IP) может держать открытыми в одном воркере
+EVENTS_MAX_STREAMS_PER_CLIENT = int(os.getenv('EVENTS_MAX_STREAMS_PER_CLIENT', '5'))
+
+# Объединение одинаковых одновременных GET (single-flight): между воркерами — через
+# fcntl-блокировки и файлы результатов в SINGLEFLIGHT_DIR (лучше tmpfs). Ожидающий запрос
+# вычисляет ответ сам, если вычисляющий не успел за SINGLEFLIGHT_TIMEOUT секунд
+SINGLEFLIGHT_ENABLED = os.getenv('SINGLEFLIGHT_ENABLED', 'True').lower() == 'true'
+SINGLEFLIGHT_DIR = os.getenv(
+    'SINGLEFLIGHT_DIR',
+    '/dev/shm/fstr-singleflight' if os.path.isdir('/dev/shm')
+    else os.path.join(tempfile.gettempdir(), 'fstr-singleflight'),
+)
+SINGLEFLIGHT_TIMEOUT = float(os.getenv('SINGLEFLIGHT_TIMEOUT', '5'))
+SINGLEFLIGHT_POLL_SECONDS = float(os.getenv('SINGLEFLIGHT_POLL_SECONDS', '0.005'))
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv('SINGLEFLIGHT_RESULT_TTL', '10'))
+
+# Структурированные JSON-логи (pereval.logs): записи копятся в очереди в памяти и пишутся
+# фоновым потоком пачками в LOG_STREAM (stdout, stderr или путь к файлу); при переполнении
+# очереди записи отбрасываются, запрос никогда не ждёт вывода
+LOG_ACCESS_ENABLED = os.getenv('LOG_ACCESS_ENABLED', 'True').lower() == 'true'
+LOG_STREAM = os.getenv('LOG_STREAM', 'stdout')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '200'))
+LOG_FLUSH_SECONDS = float(os.getenv('LOG_FLUSH_SECONDS', '1'))
+# Доля записываемых успешных запросов по имени маршрута (LOG_SAMPLE_RATES=submit-data-detail=0.1,...);
+# ошибки и запросы дольше LOG_SLOW_MS записываются всегда
+LOG_SAMPLE_RATES = {
+    name: float(rate) for name, rate in (
+        item.strip().split('=', 1) for item in os.getenv(
+            'LOG_SAMPLE_RATES', 'submit-data-detail=0.1,catalog=0.2,map-tile=0.01,thumbnail=0.01'
+        ).split(',') if item.strip()
+    )
+}
+LOG_SLOW_MS = float(os.getenv('LOG_SLOW_MS', '1000'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'pereval.logs.JsonFormatter'},
+    },
+    'handlers': {
+        'json': {
+            'class': 'pereval.logs.BatchingHandler',
+            'formatter': 'json',
+            'stream': LOG_STREAM,
+            'capacity': LOG_QUEUE_SIZE,
+            'batch_size': LOG_BATCH_SIZE,
+            'flush_interval': LOG_FLUSH_SECONDS,
+        },
+    },
+    'loggers': {
+        'pereval': {'handlers': ['json'], 'level': LOG_LEVEL, 'propagate': False},
+        'fstr': {'handlers': ['json'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -124,6 +332,33 @@ REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'pereval.throttling.IPThrottle',
+        'pereval.throttling.EmailThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'write_ip': os.getenv('THROTTLE_RATE_WRITE_IP', '30/min'),
+        'write_email': os.getenv('THROTTLE_RATE_WRITE_EMAIL', '10/min'),
+        'read_ip': os.getenv('THROTTLE_RATE_READ_IP', '300/min'),
+        'read_email': os.getenv('THROTTLE_RATE_READ_EMAIL', '120/min'),
+    },
+    # Число доверенных прокси перед приложением: IP клиента для лимитов берётся из X-Forwarded-For
+    # на этом расстоянии от конца. При 0 используется адрес соединения (REMOTE_ADDR), а заголовок,
+    # который клиент может подделать, игнорируется
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
+}
+
+# OpenAPI-схема генерируется заранее (python manage.py generate_schema)
+# и отдаётся из памяти с ETag вместо интроспекции на каждый запрос
+OPENAPI_SCHEMA_FILE = os.getenv('OPENAPI_SCHEMA_FILE', os.path.join(BASE_DIR, 'openapi.json'))
+SCHEMA_CACHE_TIMEOUT = int(os.getenv('SCHEMA_CACHE_TIMEOUT', '3600'))
+
+SWAGGER_SETTINGS = {
+    'SPEC_URL': 'schema-json',
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': 'schema-json',
 }
 
 # Безопасность для продакшена
@@ -161,9 +396,32 @@ if 'test' in sys.argv:
         DATABASES['default']['OPTIONS'].pop('sslmode')
         print("SSL отключен для локальной БД")
 
+    # Реплики в тестах не подключаются: TestCase изолирует транзакцией только default,
+    # и чтение с реплики не увидело бы данных теста. Логику роутера проверяют
+    # через override_settings(DATABASE_REPLICAS=...)
+    for alias in DATABASE_REPLICAS:
+        DATABASES.pop(alias)
+    DATABASE_REPLICAS = []
+
+    # Шардирование проверяют отдельные тесты: им доступна вторая локальная БД shard1,
+    # а шарды включаются через override_settings(DATABASE_SHARDS=['default', 'shard1'])
+    for alias in DATABASE_SHARDS[1:]:
+        DATABASES.pop(alias)
+    DATABASES['shard1'] = {**DATABASES['default'], 'NAME': f"{DATABASES['default']['NAME']}_shard1"}
+    DATABASE_SHARDS = ['default']
+
     # Оптимизации для ускорения тестов
     PASSWORD_HASHERS = [
         'django.contrib.auth.hashers.MD5PasswordHasher',
     ]
 
+    # Лимиты запросов проверяют отдельные тесты через override_settings
+    THROTTLE_ENABLED = False
+    # Снимок, собранный на машине разработчика, не должен подменять данные тестов
+    SNAPSHOT_FILE = os.path.join(tempfile.gettempdir(), 'fstr-test-snapshot', 'missing.snap')
+    # Результаты объединённых запросов не должны пересекаться с запущенным сервером
+    SINGLEFLIGHT_DIR = os.path.join(tempfile.gettempdir(), 'fstr-test-singleflight')
+    # Журналы проверяют отдельные тесты; вывод тестов не засоряется записями о запросах
+    LOGGING['handlers']['json']['stream'] = os.devnull
+
     print("Тесты используют локальную БД")
\ No newline at end of file
@@ -15,25 +15,29 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-from rest_framework import permissions
+from django.urls import URLResolver, path, include
+from django.urls.resolvers import RoutePattern
+
+
+def lazy_include(route, urlconf_name, namespace=None):
+    """Как include(), но модуль маршрутов импортируется при первом обращении к нему"""
+    return URLResolver(RoutePattern(route), urlconf_name, app_name=namespace, namespace=namespace)
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="FSTR API",
-        default_version="v1",
-        description="API для работы с горными перевалами",
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/', include('pereval.urls')),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-]
\ No newline at end of file
+]
+
+if settings.LEAN_STARTUP:
+    # Админка и документация подгружаются при первом запросе к ним
+    urlpatterns += [
+        lazy_include('admin/', 'fstr.admin_urls', namespace='admin'),
+        lazy_include('', 'fstr.docs_urls'),
+    ]
+else:
+    urlpatterns += [
+        path('admin/', admin.site.urls),
+        path('', include('fstr.docs_urls')),
+    ]
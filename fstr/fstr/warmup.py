@@ -0,0 +1,44 @@
+"""
+Прогрев воркера перед первым запросом.
+
+Вызывается из fstr.wsgi при WARMUP_ON_START=True: открывает соединения с БД
+(для Yandex Cloud это TLS-рукопожатие) и загружает маршруты API, чтобы эту
+работу не оплачивал первый пользовательский запрос. Соединения живут
+CONN_MAX_AGE секунд, поэтому gunicorn нельзя запускать с --preload.
+"""
+
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.utils import OperationalError
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """Открывает соединения с БД и прогревает кэши; возвращает время шагов в секундах"""
+    timings = {}
+
+    for alias in dict.fromkeys(['default', *settings.DATABASE_REPLICAS, *settings.DATABASE_SHARDS]):
+        start = time.perf_counter()
+        try:
+            connections[alias].ensure_connection()
+        except OperationalError as e:
+            logger.warning('Не удалось открыть соединение %s при прогреве: %s', alias, e)
+            continue
+        timings[f'db:{alias}'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_resolver().url_patterns
+    timings['urls'] = time.perf_counter() - start
+
+    if not settings.LEAN_STARTUP:
+        from .schema import get_schema
+        start = time.perf_counter()
+        get_schema()
+        timings['schema'] = time.perf_counter() - start
+
+    return timings
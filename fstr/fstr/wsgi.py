@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fstr.settings')
 
 application = get_wsgi_application()
+
+# Соединение с БД и кэши открываются до первого запроса (см. fstr.warmup)
+if settings.WARMUP_ON_START:
+    from fstr.warmup import warm_up
+    warm_up()
@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import PerevalUser, PerevalCoords, PerevalAdded, PerevalImage
+from django.urls import reverse
+from django.utils.html import format_html
+from .models import (
+    PerevalUser, PerevalCoords, PerevalAdded, PerevalImage, PerevalArchive, PerevalSubmission, BackgroundJob
+)
 
 
 @admin.register(PerevalUser)
@@ -21,6 +25,17 @@ class PerevalCoordsAdmin(admin.ModelAdmin):
     search_fields = ('latitude', 'longitude', 'height')
     list_filter = ('height',)
 
+    # Координаты читаются из самой записи PerevalAdded, строка PerevalCoords — лишь копия:
+    # правка здесь разошлась бы с перевалом, поэтому координаты меняются в карточке перевала
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 
 @admin.register(PerevalAdded)
 class PerevalAddedAdmin(admin.ModelAdmin):
@@ -29,6 +44,7 @@ class PerevalAddedAdmin(admin.ModelAdmin):
     search_fields = ('title', 'beauty_title', 'user__email')
     readonly_fields = ('add_time',)  # Запретим редактирование времени
     list_editable = ('status',)  # Быстрое редактирование статуса
+    date_hierarchy = 'add_time'  # Фильтр по дате читает только нужные секции таблицы
 
     def user_email(self, obj):
         return obj.user.email
@@ -38,8 +54,8 @@ class PerevalAddedAdmin(admin.ModelAdmin):
 
 @admin.register(PerevalImage)
 class PerevalImageAdmin(admin.ModelAdmin):
-    list_display = ('title', 'pereval_title', 'image_preview', 'image_url')
-    list_filter = ('pereval',)
+    list_display = ('title', 'pereval_title', 'image_preview', 'image_url', 'url_status')
+    list_filter = ('url_status', 'pereval')
     search_fields = ('title', 'pereval__title')
 
     def pereval_title(self, obj):
@@ -48,9 +64,38 @@ class PerevalImageAdmin(admin.ModelAdmin):
     pereval_title.short_description = 'Название перевала'
 
     def image_preview(self, obj):
+        # Показываем миниатюру с нашего сервера, а не оригинал по внешней ссылке
+        if obj.thumbnail:
+            return format_html(
+                '<a href="{}" target="_blank"><img src="{}" width="50" height="50" style="object-fit: cover;" /></a>',
+                obj.image_url, reverse('thumbnail', args=[obj.thumbnail])
+            )
         if obj.image_url:
-            return f'<a href="{obj.image_url}" target="_blank"><img src="{obj.image_url}" width="50" height="50" style="object-fit: cover;" /></a>'
+            return format_html('<a href="{}" target="_blank">{}</a>', obj.image_url,
+                               'Недоступно' if obj.url_status == 'broken' else 'Открыть')
         return "Нет изображения"
 
     image_preview.short_description = 'Превью'
-    image_preview.allow_tags = True
\ No newline at end of file
+
+
+@admin.register(PerevalArchive)
+class PerevalArchiveAdmin(admin.ModelAdmin):
+    list_display = ('beauty_title', 'title', 'status', 'add_time', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('title', 'beauty_title', 'user__email')
+    readonly_fields = ('id', 'add_time', 'archived_at')
+
+
+@admin.register(PerevalSubmission)
+class PerevalSubmissionAdmin(admin.ModelAdmin):
+    list_display = ('tracking_id', 'state', 'received_at', 'processed_at', 'pereval_id')
+    list_filter = ('state',)
+    search_fields = ('tracking_id',)
+    readonly_fields = ('tracking_id', 'payload', 'received_at', 'processed_at', 'pereval_id', 'error')
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'state', 'attempts', 'run_after', 'finished_at')
+    list_filter = ('state', 'name')
+    readonly_fields = ('created_at', 'locked_at', 'finished_at', 'result', 'last_error')
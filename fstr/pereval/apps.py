@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PerevalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pereval'
+
+    def ready(self):
+        # В режиме LEAN_STARTUP описание Swagger применяется только при генерации схемы
+        if not settings.LEAN_STARTUP:
+            from .docs import apply_swagger_docs
+            apply_swagger_docs()
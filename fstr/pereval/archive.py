@@ -0,0 +1,109 @@
+"""
+Перенос старых отклонённых перевалов в архивные таблицы.
+
+Записи переносятся небольшими пачками, каждая в своей короткой транзакции,
+поэтому блокировки на рабочих таблицах держатся недолго. Строки, которые
+в этот момент кто-то редактирует, пропускаются (SKIP LOCKED) и попадут
+в следующий запуск. Все чтения идут в основную БД: копия с реплики могла бы
+отстать от строк, которые затем удаляются.
+
+При шардировании (pereval.sharding) пачки выбираются в каждом шарде по
+очереди, а архив пополняется в основной БД; автор архивной записи — копия
+автора в основной БД (по email). Запись в архив фиксируется раньше удаления
+из шарда, а повторный перенос тех же id заменяет архивные строки, поэтому
+сбой между двумя фиксациями не теряет и не дублирует записи.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+from . import mapgrid
+from .models import PerevalAdded, PerevalArchive, PerevalCoords, PerevalImage, PerevalImageArchive, PerevalUser
+from .routers import use_primary
+from .sharding import is_enabled, use_shard
+
+
+def _archive_users(perevals):
+    """{id автора в шарде: id автора в основной БД}"""
+    users = {p.user_id: p.user for p in perevals}
+    mapping = {}
+    for user_id, user in users.items():
+        copy, _ = PerevalUser.objects.using('default').get_or_create(
+            email=user.email,
+            defaults={'fam': user.fam, 'name': user.name, 'otc': user.otc, 'phone': user.phone},
+        )
+        mapping[user_id] = copy.id
+    return mapping
+
+
+def archive_batch(cutoff, statuses, batch_size, shard=None):
+    """Переносит в архив одну пачку записей шарда shard; возвращает количество перенесённых"""
+    with use_primary(), use_shard(shard):
+        using = router.db_for_write(PerevalAdded)
+        with transaction.atomic(using=using):
+            ids = list(
+                PerevalAdded.objects
+                .filter(status__in=statuses, add_time__lt=cutoff)
+                .order_by('add_time')
+                .select_for_update(skip_locked=True)
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return 0
+
+            perevals = list(PerevalAdded.objects.filter(id__in=ids).select_related('user'))
+            images = list(PerevalImage.objects.filter(pereval_id__in=ids))
+            coords_ids = [p.coords_id for p in perevals if p.coords_id]
+            PerevalImage.objects.filter(pereval_id__in=ids).delete()
+            PerevalAdded.objects.filter(id__in=ids).delete()
+            PerevalCoords.objects.filter(id__in=coords_ids).delete()
+
+            # Для основной БД это точка сохранения внутри той же транзакции
+            with transaction.atomic(using='default'):
+                users = _archive_users(perevals) if using != 'default' else {}
+                now = timezone.now()
+                PerevalImageArchive.objects.using('default').filter(pereval_id__in=ids).delete()
+                PerevalArchive.objects.using('default').filter(id__in=ids).delete()
+                PerevalArchive.objects.using('default').bulk_create([
+                    PerevalArchive(
+                        id=p.id, beauty_title=p.beauty_title, title=p.title,
+                        other_titles=p.other_titles, connect=p.connect, add_time=p.add_time,
+                        level_winter=p.level_winter, level_summer=p.level_summer,
+                        level_autumn=p.level_autumn, level_spring=p.level_spring,
+                        status=p.status, user_id=users.get(p.user_id, p.user_id), archived_at=now,
+                        latitude=p.latitude, longitude=p.longitude, height=p.height,
+                    )
+                    for p in perevals
+                ])
+                PerevalImageArchive.objects.using('default').bulk_create([
+                    PerevalImageArchive(pereval_id=img.pereval_id, title=img.title, image_url=img.image_url)
+                    for img in images
+                ])
+                mapgrid.remove_points([(p.id, p.latitude, p.longitude) for p in perevals])
+            return len(ids)
+
+
+def archive_perevals(days=None, statuses=None, batch_size=None, pause=0.0, max_batches=None):
+    """Переносит в архив записи со статусами statuses старше days дней; возвращает их количество"""
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    statuses = statuses or settings.ARCHIVE_STATUSES
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=days)
+
+    total = 0
+    batches = 0
+    for shard in (settings.DATABASE_SHARDS if is_enabled() else [None]):
+        while max_batches is None or batches < max_batches:
+            moved = archive_batch(cutoff, statuses, batch_size, shard)
+            if not moved:
+                break
+            total += moved
+            batches += 1
+            if pause:
+                # Даём репликации и другим транзакциям догнать
+                time.sleep(pause)
+    return total
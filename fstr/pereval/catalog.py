@@ -0,0 +1,154 @@
+"""
+Каталог перевалов: фильтры по категориям сложности, высоте и статусу,
+счётчики по каждому измерению (фасеты) и постраничный вывод по ключу.
+
+Фильтры комбинируются через AND, значения одного фильтра — через OR:
+?status=accepted&level_summer=1А,1Б&height_min=3000. Пустое значение
+(?level_winter=) выбирает перевалы без категории.
+
+Страницы упорядочены по id по убыванию (сначала новые); курсор after —
+последний id предыдущей страницы, поэтому стоимость страницы не зависит от
+её номера. Выборку обслуживают индексы pereval_browse_idx (status, id DESC)
+с включёнными столбцами фасетов и частичный pereval_accepted_height_idx
+(height, id DESC) для принятых перевалов.
+
+Фасеты считаются одним запросом GROUPING SETS по отфильтрованной выборке
+(см. pereval.stats.grouping_sql) с statement_timeout = CATALOG_FACET_BUDGET_MS.
+Если точный подсчёт не укладывается в бюджет, счётчики оцениваются по выборке
+TABLESAMPLE SYSTEM (CATALOG_FACET_SAMPLE_PERCENT процентов страниц таблицы)
+и ответ помечается facets_exact=false; если не успевает и оценка — фасетов нет.
+"""
+
+import base64
+
+from django.conf import settings
+from django.db import OperationalError, connections, router, transaction
+
+from .models import PerevalAdded
+from .prevalidation import LEVEL_FIELDS
+from .sharding import scatter
+from .stats import grouping_sql
+
+FACETS = ['status', *LEVEL_FIELDS, 'height']
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def _values(raw):
+    return list(dict.fromkeys(part.strip() for part in raw.split(',')))
+
+
+def _integer(params, name):
+    try:
+        return int(params[name])
+    except ValueError:
+        raise InvalidFilter(f'Неверный параметр {name}')
+
+
+def parse_filters(params):
+    """Условия ORM по параметрам запроса; InvalidFilter для неверных значений"""
+    filters = {}
+    if 'status' in params:
+        statuses = _values(params['status'])
+        known = {value for value, _ in PerevalAdded.STATUS_CHOICES}
+        unknown = [value for value in statuses if value not in known]
+        if unknown:
+            raise InvalidFilter(f'Неизвестный статус: {", ".join(unknown)}')
+        filters['status__in'] = statuses
+    for name in LEVEL_FIELDS:
+        if name in params:
+            filters[f'{name}__in'] = _values(params[name])
+    if 'height_min' in params:
+        filters['height__gte'] = _integer(params, 'height_min')
+    if 'height_max' in params:
+        filters['height__lte'] = _integer(params, 'height_max')
+    return filters
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        return int(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        raise InvalidFilter('Неверный параметр after')
+
+
+def browse(filters, after, limit, serialize):
+    """
+    Страница каталога: (записи, курсор следующей страницы или None).
+    serialize(queryset) возвращает список словарей ответа с ключом id
+    """
+    queryset = PerevalAdded.objects.filter(**filters)
+    if after is not None:
+        queryset = queryset.filter(id__lt=after)
+    queryset = queryset.order_by('-id')
+
+    # В каждом шарде берётся limit + 1 записей, общая страница — слияние по id
+    pages = scatter(lambda: serialize(queryset[:limit + 1]))
+    items = sorted((item for page in pages.values() for item in page), key=lambda item: -item['id'])
+    if len(items) > limit:
+        items = items[:limit]
+        return items, encode_cursor(items[-1]['id'])
+    return items, None
+
+
+def _facet_rows(sql, params, alias, budget_ms):
+    connection = connections[alias]
+    # SET LOCAL действует до конца транзакции (или точки сохранения, если запрос прерван);
+    # после успешного запроса прежнее значение возвращается явно
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        cursor.execute("SELECT current_setting('statement_timeout')")
+        previous = cursor.fetchone()[0]
+        cursor.execute("SELECT set_config('statement_timeout', %s, true)", [str(budget_ms)])
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.execute("SELECT set_config('statement_timeout', %s, true)", [previous])
+    return rows
+
+
+def _shard_facets(filters, budget_ms, sample_percent):
+    alias = router.db_for_read(PerevalAdded)
+    queryset = PerevalAdded.objects.using(alias).filter(**filters).values('status', *LEVEL_FIELDS, 'height')
+    source, params = queryset.query.get_compiler(using=alias).as_sql()
+    sql = grouping_sql(f'({source}) q', FACETS)
+    try:
+        return _facet_rows(sql, params, alias, budget_ms), 1
+    except OperationalError:
+        pass
+
+    # Оценка: та же выборка по случайным страницам таблицы, счётчики масштабируются
+    table = connections[alias].ops.quote_name(PerevalAdded._meta.db_table)
+    sampled = sql.replace(
+        f'FROM {table}', f'FROM {table} TABLESAMPLE SYSTEM ({float(sample_percent)}) REPEATABLE (0)', 1
+    )
+    try:
+        return _facet_rows(sampled, params, alias, budget_ms), 100 / sample_percent
+    except OperationalError:
+        return None, None
+
+
+def facet_counts(filters):
+    """({'total', измерение: {значение: количество}}, точные ли счётчики) или (None, False)"""
+    budget_ms = settings.CATALOG_FACET_BUDGET_MS
+    sample_percent = settings.CATALOG_FACET_SAMPLE_PERCENT
+    facets = {'total': 0}
+    facets.update((name, {}) for name in FACETS)
+    exact = True
+    for rows, scale in scatter(lambda: _shard_facets(filters, budget_ms, sample_percent)).values():
+        if rows is None:
+            return None, False
+        exact = exact and scale == 1
+        for dimension, value, total in rows:
+            total = round(total * scale)
+            if dimension == 'total':
+                facets['total'] += total
+            else:
+                facets[dimension][value] = facets[dimension].get(value, 0) + total
+    for name in FACETS:
+        facets[name] = dict(sorted(facets[name].items()))
+    return facets, exact
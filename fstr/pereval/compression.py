@@ -0,0 +1,116 @@
+"""
+Сжатие ответов API (gzip и brotli) по заголовку Accept-Encoding.
+
+Сжимаются текстовые ответы (JSON, схема OpenAPI) не меньше
+COMPRESSION_MIN_SIZE байт. Сжатые байты хранятся в кэше процесса под хэшем
+исходного тела: популярные ответы (список перевалов автора, статистика,
+схема) с неизменным содержимым сжимаются один раз, а повторный запрос
+обходится вычислением BLAKE2b, которое на порядок дешевле сжатия.
+
+brotli — необязательная зависимость: без пакета Brotli используется только gzip.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - зависит от окружения
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/vnd.oai.openapi+json',
+}
+
+
+def available_encodings():
+    """Поддерживаемые кодировки в порядке предпочтения сервера"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encoding):
+    """Выбирает кодировку по заголовку Accept-Encoding; None — отдавать без сжатия"""
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+
+    for encoding in available_encodings():
+        if weights.get(encoding, weights.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type):
+    media_type = content_type.split(';')[0].strip().lower()
+    return media_type.startswith('text/') or media_type.endswith('+json') or media_type in COMPRESSIBLE_TYPES
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    # mtime=0: одинаковое тело всегда даёт одинаковые байты
+    return gzip.compress(data, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressedCache:
+    """LRU-кэш сжатых тел {(хэш тела, кодировка): байты} с ограничением по общему размеру"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compress(self, data, encoding):
+        key = (hashlib.blake2b(data, digest_size=16).digest(), encoding)
+        with self._lock:
+            compressed = self._items.get(key)
+            if compressed is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+
+        # Сжатие выполняется без блокировки: параллельные запросы не ждут друг друга
+        compressed = compress(data, encoding)
+        if len(compressed) <= self.max_bytes:
+            with self._lock:
+                if key not in self._items:
+                    self._items[key] = compressed
+                    self.size += len(compressed)
+                while self.size > self.max_bytes:
+                    _, evicted = self._items.popitem(last=False)
+                    self.size -= len(evicted)
+        return compressed
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = self.hits = self.misses = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CompressedCache(settings.COMPRESSION_CACHE_BYTES)
+    return _cache
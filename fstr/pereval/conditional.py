@@ -0,0 +1,47 @@
+"""
+Условные запросы: ETag / If-Match / If-None-Match и Last-Modified / If-Modified-Since.
+
+ETag записи — её version, Last-Modified — updated_at. Оба поля меняются при
+PATCH, модерации и изменении изображений (см. PerevalAdded.save и touch()).
+"""
+
+from django.http import HttpResponseNotModified
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def version_etag(version):
+    return f'"{version}"'
+
+
+def list_etag(count, last_update):
+    """ETag списка: меняется при добавлении, изменении или удалении любой записи списка"""
+    return f'"{count}-{int(last_update.timestamp() * 1_000_000)}"'
+
+
+def parse_if_match(header):
+    """Возвращает версию из заголовка If-Match или None, если заголовка нет или он равен '*'"""
+    if header is None or header.strip() == '*':
+        return None
+    value = header.strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    return int(value.strip('"'))
+
+
+def is_conditional(request):
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def set_validators(response, etag, updated_at):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(updated_at.timestamp())
+    return response
+
+
+def not_modified(request, etag, updated_at):
+    """Ответ 304, если у клиента актуальная версия, иначе None"""
+    response = get_conditional_response(request, etag=etag, last_modified=int(updated_at.timestamp()))
+    if isinstance(response, HttpResponseNotModified):
+        return set_validators(response, etag, updated_at)
+    return None
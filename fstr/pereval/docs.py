@@ -0,0 +1,617 @@
+"""
+Описание эндпоинтов API для Swagger и ReDoc.
+
+Декораторы swagger_auto_schema навешиваются на методы views отдельно от их кода,
+поэтому views не импортируют drf_yasg при старте воркера. Описание применяется
+при генерации схемы (fstr.schema.build_schema), а вне LEAN_STARTUP — сразу
+в PerevalConfig.ready().
+"""
+
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+
+from .serializers import (
+    PerevalAddedSerializer, PerevalInfoSerializer, PerevalUpdateSerializer, PerevalChangeSerializer
+)
+from .views import (
+    SubmitData, PerevalRetrieveUpdateView, PerevalChangesView, SubmissionQueueView, SubmissionStatusView,
+    PerevalStatsView, PerevalCatalogView, MapTileView, PerevalBatchView, ThrottleMetricsView
+)
+
+_applied = False
+
+
+def apply_swagger_docs():
+    """Добавляет описание Swagger к методам views (повторный вызов ничего не делает)"""
+    global _applied
+    if _applied:
+        return
+
+    SubmitData.get = swagger_auto_schema(
+        operation_description="Получить список перевалов по email пользователя",
+        manual_parameters=[
+            openapi.Parameter(
+                'user__email',
+                openapi.IN_QUERY,
+                description="Email пользователя для поиска его перевалов",
+                type=openapi.TYPE_STRING,
+                required=True,
+                example="user@example.com"
+            ),
+            openapi.Parameter(
+                'fields',
+                openapi.IN_QUERY,
+                description="Поля ответа через запятую, например id,title,status,coords (по умолчанию все)",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="title,status,coords"
+            ),
+            openapi.Parameter(
+                'expand',
+                openapi.IN_QUERY,
+                description="Вложенные объекты, добавляемые к fields: user, images",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="images"
+            ),
+            openapi.Parameter(
+                'thumbnails',
+                openapi.IN_QUERY,
+                description="1 — добавить к изображениям ссылку на миниатюру (thumbnail_url)",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="1"
+            )
+        ],
+        responses={
+            200: PerevalInfoSerializer(many=True),
+            400: openapi.Response(
+                description="Не указан параметр user__email",
+                examples={
+                    'application/json': {
+                        'error': 'Не указан параметр user__email'
+                    }
+                }
+            ),
+            404: openapi.Response(
+                description="Записи не найдены",
+                examples={
+                    'application/json': {
+                        'message': 'Записи не найдены'
+                    }
+                }
+            )
+        }
+    )(SubmitData.get)
+
+    SubmitData.post = swagger_auto_schema(
+        operation_description="Создать новую запись о перевале",
+        request_body=PerevalAddedSerializer,
+        responses={
+            201: openapi.Response(
+                description="Успешное создание перевала",
+                examples={
+                    'application/json': {
+                        'status': 200,
+                        'message': None,
+                        'id': 1
+                    }
+                }
+            ),
+            202: openapi.Response(
+                description="Данные приняты в очередь (ASYNC_INGEST=True)",
+                examples={
+                    'application/json': {
+                        'status': 202,
+                        'message': 'Данные приняты в обработку',
+                        'id': None,
+                        'tracking_id': '3f1c2b9e-8a4d-4c1e-9b7a-2d5e6f708192'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description="Неверные данные",
+                examples={
+                    'application/json': {
+                        'status': 400,
+                        'message': 'Неверные данные',
+                        'errors': {
+                            'title': ['Это поле обязательно.']
+                        },
+                        'id': None
+                    }
+                }
+            ),
+            500: openapi.Response(
+                description="Ошибка сервера",
+                examples={
+                    'application/json': {
+                        'status': 500,
+                        'message': 'Ошибка при сохранении: ...',
+                        'id': None
+                    }
+                }
+            )
+        }
+    )(SubmitData.post)
+
+    PerevalRetrieveUpdateView.get = swagger_auto_schema(
+        operation_description="Получить информацию о перевале по ID",
+        manual_parameters=[
+            openapi.Parameter(
+                'fields',
+                openapi.IN_QUERY,
+                description="Поля ответа через запятую, например id,title,status,coords (по умолчанию все)",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="title,status,coords"
+            ),
+            openapi.Parameter(
+                'expand',
+                openapi.IN_QUERY,
+                description="Вложенные объекты, добавляемые к fields: user, images",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="images"
+            ),
+            openapi.Parameter(
+                'thumbnails',
+                openapi.IN_QUERY,
+                description="1 — добавить к изображениям ссылку на миниатюру (thumbnail_url)",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="1"
+            )
+        ],
+        responses={
+            200: PerevalInfoSerializer,
+            404: openapi.Response(
+                description="Перевал не найден",
+                examples={
+                    'application/json': {
+                        'detail': 'Страница не найдена.'
+                    }
+                }
+            )
+        }
+    )(PerevalRetrieveUpdateView.get)
+
+    PerevalRetrieveUpdateView.patch = swagger_auto_schema(
+        operation_description="Редактировать перевал (только со статусом 'new')",
+        request_body=PerevalUpdateSerializer,
+        manual_parameters=[
+            openapi.Parameter(
+                'If-Match',
+                openapi.IN_HEADER,
+                description="ETag из GET /submitData/<id>/; запись обновится, только если она не менялась",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example='"1"'
+            )
+        ],
+        responses={
+            200: openapi.Response(
+                description="Успешное обновление",
+                examples={
+                    'application/json': {
+                        'state': 1
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description="Ошибка валидации или неверный статус",
+                examples={
+                    'application/json': {
+                        'state': 0,
+                        'message': 'Запись нельзя редактировать, так как её статус не "new"'
+                    }
+                }
+            ),
+            404: openapi.Response(
+                description="Перевал не найден",
+                examples={
+                    'application/json': {
+                        'detail': 'Страница не найдена.'
+                    }
+                }
+            ),
+            412: openapi.Response(
+                description="Версия из If-Match устарела",
+                examples={
+                    'application/json': {
+                        'state': 0,
+                        'message': 'Запись была изменена другим пользователем, получите её заново'
+                    }
+                }
+            ),
+            500: openapi.Response(
+                description="Ошибка сервера",
+                examples={
+                    'application/json': {
+                        'state': 0,
+                        'message': 'Ошибка при сохранении: ...'
+                    }
+                }
+            )
+        }
+    )(PerevalRetrieveUpdateView.patch)
+
+    PerevalChangesView.get = swagger_auto_schema(
+        operation_description=(
+            "Получить перевалы пользователя, изменённые после курсора since, "
+            "и id записей, перенесённых в архив. Курсор для следующего запроса — поле next"
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                'user__email',
+                openapi.IN_QUERY,
+                description="Email пользователя",
+                type=openapi.TYPE_STRING,
+                required=True,
+                example="user@example.com"
+            ),
+            openapi.Parameter(
+                'since',
+                openapi.IN_QUERY,
+                description="Курсор из поля next предыдущего ответа; без него возвращаются все записи",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description="Максимальное число записей в каждом из списков changes и deleted",
+                type=openapi.TYPE_INTEGER,
+                required=False,
+                example=100
+            )
+        ],
+        responses={
+            200: openapi.Response(
+                description="Изменения после курсора",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'changes': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                            description=PerevalChangeSerializer.__doc__
+                        ),
+                        'deleted': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_OBJECT, properties={
+                                'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                'archived_at': openapi.Schema(type=openapi.TYPE_STRING, format='date-time'),
+                            })
+                        ),
+                        'next': openapi.Schema(type=openapi.TYPE_STRING),
+                        'has_more': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                    }
+                )
+            ),
+            400: openapi.Response(
+                description="Не указан user__email или неверный курсор",
+                examples={
+                    'application/json': {
+                        'error': 'Неверный параметр since'
+                    }
+                }
+            )
+        }
+    )(PerevalChangesView.get)
+
+    SubmissionStatusView.get = swagger_auto_schema(
+        operation_description="Получить состояние заявки по tracking_id из ответа 202",
+        responses={
+            200: openapi.Response(
+                description="Состояние заявки: queued, done или failed",
+                examples={
+                    'application/json': {
+                        'tracking_id': '3f1c2b9e-8a4d-4c1e-9b7a-2d5e6f708192',
+                        'state': 'done',
+                        'id': 1,
+                        'message': None
+                    }
+                }
+            ),
+            404: openapi.Response(
+                description="Заявка не найдена",
+                examples={
+                    'application/json': {
+                        'detail': 'Страница не найдена.'
+                    }
+                }
+            )
+        }
+    )(SubmissionStatusView.get)
+
+    SubmissionQueueView.get = swagger_auto_schema(
+        operation_description="Метрики очереди асинхронного приёма",
+        responses={
+            200: openapi.Response(
+                description="Глубина очереди и скорость разбора",
+                examples={
+                    'application/json': {
+                        'depth': 12,
+                        'oldest_age_seconds': 3.5,
+                        'processed_last_window': 600,
+                        'failed_last_window': 0,
+                        'drain_rate_per_second': 10.0,
+                        'window_seconds': 60
+                    }
+                }
+            )
+        }
+    )(SubmissionQueueView.get)
+
+    PerevalStatsView.get = swagger_auto_schema(
+        operation_description=(
+            "Количество перевалов по статусу, категориям сложности, диапазонам высоты (по 500 м) "
+            "и регионам (ячейки 1°x1°). Данные пересчитываются командой refresh_stats"
+        ),
+        responses={
+            200: openapi.Response(
+                description="Статистика",
+                examples={
+                    'application/json': {
+                        'total': 3,
+                        'refreshed_at': '2025-07-01T12:00:00Z',
+                        'status': {'new': 2, 'accepted': 1},
+                        'level_winter': {'': 2, '1А': 1},
+                        'level_summer': {'1А': 3},
+                        'level_autumn': {'1А': 3},
+                        'level_spring': {'': 3},
+                        'height': {'1000-1499': 2, '2000-2499': 1},
+                        'region': {'45N007E': 3}
+                    }
+                }
+            )
+        }
+    )(PerevalStatsView.get)
+
+    PerevalCatalogView.get = swagger_auto_schema(
+        operation_description=(
+            "Каталог перевалов с фильтрами по статусу, категориям сложности и высоте. Фильтры комбинируются "
+            "через И, значения одного фильтра — через ИЛИ. Страницы упорядочены по id по убыванию; для "
+            "следующей страницы передайте next в параметре after. facets — количество перевалов по каждому "
+            "измерению среди отфильтрованных; если точный подсчёт не укладывается в бюджет времени, "
+            "счётчики оцениваются по выборке и facets_exact = false"
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                'status',
+                openapi.IN_QUERY,
+                description="Статусы через запятую: new, pending, accepted, rejected",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="accepted"
+            ),
+            openapi.Parameter(
+                'level_winter',
+                openapi.IN_QUERY,
+                description="Категории сложности (зима) через запятую; пустое значение — без категории",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="1А,1Б"
+            ),
+            openapi.Parameter(
+                'level_summer',
+                openapi.IN_QUERY,
+                description="Категории сложности (лето) через запятую; пустое значение — без категории",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="1А,1Б"
+            ),
+            openapi.Parameter(
+                'level_autumn',
+                openapi.IN_QUERY,
+                description="Категории сложности (осень) через запятую; пустое значение — без категории",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="1А,1Б"
+            ),
+            openapi.Parameter(
+                'level_spring',
+                openapi.IN_QUERY,
+                description="Категории сложности (весна) через запятую; пустое значение — без категории",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="1А,1Б"
+            ),
+            openapi.Parameter(
+                'height_min',
+                openapi.IN_QUERY,
+                description="Минимальная высота, м",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'height_max',
+                openapi.IN_QUERY,
+                description="Максимальная высота, м",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'after',
+                openapi.IN_QUERY,
+                description="Курсор next из предыдущей страницы",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description="Размер страницы (по умолчанию 50, не больше 200)",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'facets',
+                openapi.IN_QUERY,
+                description="0 — не считать фасеты",
+                type=openapi.TYPE_STRING,
+                required=False,
+                enum=['0', '1']
+            ),
+            openapi.Parameter(
+                'fields',
+                openapi.IN_QUERY,
+                description="Поля записей через запятую (по умолчанию все)",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="title,status,coords"
+            ),
+        ],
+        responses={
+            200: openapi.Response(
+                description="Страница каталога",
+                examples={
+                    'application/json': {
+                        'results': [{'id': 42, 'title': 'Пхия', 'status': 'accepted',
+                                     'coords': {'latitude': 45.3842, 'longitude': 7.1525, 'height': 1200}}],
+                        'next': 'NDI',
+                        'has_more': True,
+                        'facets': {
+                            'total': 120,
+                            'status': {'accepted': 120},
+                            'level_winter': {'': 80, '1А': 40},
+                            'level_summer': {'1А': 120},
+                            'level_autumn': {'1А': 120},
+                            'level_spring': {'': 120},
+                            'height': {'1000-1499': 70, '1500-1999': 50}
+                        },
+                        'facets_exact': True
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description="Неверные параметры",
+                examples={'application/json': {'error': 'Неизвестный статус: done'}}
+            )
+        }
+    )(PerevalCatalogView.get)
+
+    MapTileView.get = swagger_auto_schema(
+        operation_description=(
+            "Кластеры перевалов в тайле z/x/y (Web Mercator): центр кластера, количество перевалов "
+            "и id представителя. С encoding=binary тайл отдаётся в бинарном формате application/octet-stream: "
+            "заголовок '<4sBI' (FSTR, версия, число кластеров) и по 16 байт '<HHIQ' на кластер "
+            "(позиция в тайле 0..65535 по x и y, количество, id)"
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                'encoding',
+                openapi.IN_QUERY,
+                description="binary — компактный бинарный формат",
+                type=openapi.TYPE_STRING,
+                required=False,
+                enum=['json', 'binary']
+            )
+        ],
+        responses={
+            200: openapi.Response(
+                description="Кластеры тайла",
+                examples={
+                    'application/json': {
+                        'zoom': 5, 'x': 16, 'y': 11,
+                        'clusters': [{'latitude': 45.38, 'longitude': 7.15, 'count': 12, 'id': 42}]
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description="Неверные координаты тайла",
+                examples={
+                    'application/json': {
+                        'error': 'Неверные координаты тайла'
+                    }
+                }
+            )
+        }
+    )(MapTileView.get)
+
+    batch_responses = {
+        200: openapi.Response(
+            description="Найденные перевалы в порядке запроса и список отсутствующих id",
+            examples={
+                'application/json': {
+                    'perevals': [{'id': 1, 'title': 'Пхия', 'status': 'new'}],
+                    'missing': [3]
+                }
+            }
+        ),
+        400: openapi.Response(
+            description="Неверный список id или превышен MULTI_GET_MAX_IDS",
+            examples={
+                'application/json': {
+                    'error': 'Можно запросить не больше 100 записей'
+                }
+            }
+        )
+    }
+
+    PerevalBatchView.get = swagger_auto_schema(
+        operation_description="Получить несколько перевалов по списку id",
+        manual_parameters=[
+            openapi.Parameter(
+                'ids',
+                openapi.IN_QUERY,
+                description="id перевалов через запятую",
+                type=openapi.TYPE_STRING,
+                required=True,
+                example="1,2,3"
+            ),
+            openapi.Parameter(
+                'fields',
+                openapi.IN_QUERY,
+                description="Поля ответа через запятую, например id,title,status,coords (по умолчанию все)",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="title,status,coords"
+            ),
+            openapi.Parameter(
+                'expand',
+                openapi.IN_QUERY,
+                description="Вложенные объекты, добавляемые к fields: user, images",
+                type=openapi.TYPE_STRING,
+                required=False,
+                example="images"
+            )
+        ],
+        responses=batch_responses
+    )(PerevalBatchView.get)
+
+    PerevalBatchView.post = swagger_auto_schema(
+        operation_description="Получить несколько перевалов по списку id (список в теле запроса)",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['ids'],
+            properties={
+                'ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER))
+            }
+        ),
+        responses=batch_responses
+    )(PerevalBatchView.post)
+
+    ThrottleMetricsView.get = swagger_auto_schema(
+        operation_description=(
+            "Решения ограничителя частоты запросов по областям: write_* — POST и PATCH, read_* — чтение; "
+            "*_ip — по IP клиента, *_email — по email автора. Отклонённые запросы получают 429 "
+            "и заголовок Retry-After"
+        ),
+        responses={
+            200: openapi.Response(
+                description="Счётчики с момента создания файла состояния",
+                examples={
+                    'application/json': {
+                        'write_ip': {'allowed': 120, 'throttled': 3, 'rate': '30/min'},
+                        'write_email': {'allowed': 118, 'throttled': 5, 'rate': '10/min'},
+                        'read_ip': {'allowed': 4210, 'throttled': 0, 'rate': '300/min'},
+                        'read_email': {'allowed': 96, 'throttled': 0, 'rate': '120/min'}
+                    }
+                }
+            )
+        }
+    )(ThrottleMetricsView.get)
+
+    _applied = True
@@ -0,0 +1,307 @@
+"""
+Уведомления об изменении статуса перевалов (server-sent events).
+
+Вместо периодических GET /api/submitData/<id>/ клиент открывает одно
+соединение GET /api/submitData/events/?user__email=... и получает события
+по всем перевалам этого автора:
+
+    event: snapshot   — текущие статусы при подключении;
+    event: status     — смена статуса (модерация, массовые UPDATE, админка);
+    ": ping"          — комментарий раз в EVENTS_HEARTBEAT_SECONDS, чтобы прокси
+                        не закрывали простаивающее соединение.
+
+Источник событий — триггер pereval_status_notify: при изменении status он
+вызывает pg_notify('pereval_status', {id, status, version, email}), поэтому
+уведомления приходят из любого процесса, изменившего строку, и только после
+фиксации транзакции. В каждом ASGI-воркере одно соединение на шард слушает
+канал (LISTEN) через цикл событий asyncio и раздаёт события подписчикам
+процесса. Подписчик — корутина и очередь asyncio без потока и соединения с БД,
+поэтому тысячи простаивающих клиентов почти ничего не стоят.
+
+Эндпоинт обслуживает само ASGI-приложение (fstr/asgi.py), минуя Django:
+под WSGI (gunicorn fstr.wsgi) он недоступен. Поэтому лимит IPThrottle (область
+read_ip) проверяется здесь же, а один клиент (IP) держит в воркере не больше
+EVENTS_MAX_STREAMS_PER_CLIENT потоков.
+"""
+
+import asyncio
+import json
+import logging
+import math
+from collections import defaultdict
+from io import BytesIO
+from urllib.parse import parse_qs
+
+import psycopg2
+import psycopg2.extensions
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, connections
+
+from .throttling import IPThrottle
+
+logger = logging.getLogger(__name__)
+
+PATH = '/api/submitData/events/'
+CHANNEL = 'pereval_status'
+TABLE = 'pereval_perevaladded'
+
+CREATE_FUNCTION_SQL = (
+    "CREATE OR REPLACE FUNCTION pereval_notify_status() RETURNS trigger AS $$ "
+    "BEGIN "
+    f"PERFORM pg_notify('{CHANNEL}', json_build_object("
+    "'id', NEW.id, 'status', NEW.status, 'version', NEW.version, "
+    "'email', (SELECT email FROM pereval_perevaluser WHERE id = NEW.user_id))::text); "
+    "RETURN NULL; "
+    "END $$ LANGUAGE plpgsql"
+)
+CREATE_TRIGGER_SQL = (
+    f"CREATE OR REPLACE TRIGGER pereval_status_notify AFTER UPDATE OF status ON {TABLE} "
+    "FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status) EXECUTE FUNCTION pereval_notify_status()"
+)
+DROP_TRIGGER_SQL = f"DROP TRIGGER IF EXISTS pereval_status_notify ON {TABLE}"
+DROP_FUNCTION_SQL = "DROP FUNCTION IF EXISTS pereval_notify_status()"
+
+
+def create_trigger(cursor):
+    """Создаёт триггер уведомлений (например, после пересоздания таблицы перевалов)"""
+    cursor.execute(CREATE_FUNCTION_SQL)
+    cursor.execute(CREATE_TRIGGER_SQL)
+
+
+class Hub:
+    """Подписчики процесса: {email: множество очередей}; все методы вызываются в цикле событий"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, email):
+        queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        self._subscribers[email].add(queue)
+        return queue
+
+    def unsubscribe(self, email, queue):
+        queues = self._subscribers.get(email)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[email]
+
+    def publish(self, email, event):
+        for queue in list(self._subscribers.get(email, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: соединение закрывается, после переподключения
+                # он получит актуальные статусы в snapshot
+                self.unsubscribe(email, queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def count(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+
+class Listener:
+    """LISTEN на каждом шарде; уведомления читаются по готовности сокета (loop.add_reader)"""
+
+    RECONNECT_SECONDS = 5
+
+    def __init__(self, hub, aliases=None):
+        self.hub = hub
+        self.aliases = list(aliases or settings.DATABASE_SHARDS)
+        self._connections = {}
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        for alias in self.aliases:
+            self._connect(alias)
+
+    def stop(self):
+        for alias in list(self._connections):
+            self._disconnect(alias)
+        self._loop = None
+
+    def _connect(self, alias):
+        if self._loop is None:
+            return
+        try:
+            conn = psycopg2.connect(**connections[alias].get_connection_params())
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+        except psycopg2.Error:
+            logger.exception('Не удалось подписаться на уведомления в %s', alias)
+            self._loop.call_later(self.RECONNECT_SECONDS, self._connect, alias)
+            return
+        self._connections[alias] = conn
+        self._loop.add_reader(conn.fileno(), self._read, alias)
+
+    def _disconnect(self, alias):
+        conn = self._connections.pop(alias, None)
+        if conn is not None:
+            self._loop.remove_reader(conn.fileno())
+            conn.close()
+
+    def _read(self, alias):
+        conn = self._connections[alias]
+        try:
+            conn.poll()
+        except psycopg2.Error:
+            logger.warning('Соединение уведомлений с %s потеряно, переподключение', alias)
+            self._disconnect(alias)
+            self._loop.call_later(self.RECONNECT_SECONDS, self._connect, alias)
+            return
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                payload = json.loads(notify.payload)
+                email = payload.pop('email')
+            except (ValueError, KeyError):
+                continue
+            self.hub.publish(email, payload)
+
+
+hub = Hub()
+_listener = None
+# Открытые потоки воркера по клиентам (IP); меняется только в цикле событий
+_streams = defaultdict(int)
+
+
+def ensure_listener():
+    """Запускает слушателя при первом подписчике (ASGI-сервер может не поддерживать lifespan)"""
+    global _listener
+    if _listener is None:
+        _listener = Listener(hub)
+        _listener.start()
+
+
+def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def current_statuses(email):
+    """Статусы перевалов автора со всех шардов: [{id, status, version}]"""
+    from .models import PerevalAdded
+    from .sharding import scatter
+
+    # Поток событий идёт мимо обработчика запросов Django, поэтому устаревшие
+    # соединения (CONN_MAX_AGE, ошибки) закрываются здесь, как по сигналу request_started
+    close_old_connections()
+    rows = scatter(lambda: list(
+        PerevalAdded.objects.filter(user__email=email).order_by('id').values('id', 'status', 'version')
+    ))
+    return sorted((row for shard_rows in rows.values() for row in shard_rows), key=lambda row: row['id'])
+
+
+def format_event(name, data, event_id=None):
+    lines = [f'event: {name}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _respond(send, status_code, body, headers=()):
+    await send({'type': 'http.response.start', 'status': status_code,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body', 'body': json.dumps(body, ensure_ascii=False).encode()})
+
+
+async def stream_events(scope, receive, send):
+    """ASGI-обработчик GET /api/submitData/events/"""
+    if scope['method'] != 'GET':
+        await _respond(send, 405, {'error': 'Метод не поддерживается'})
+        return
+    query = parse_qs(scope.get('query_string', b'').decode())
+    email = (query.get('user__email') or [''])[0]
+    if not email:
+        await _respond(send, 400, {'error': 'Не указан параметр user__email'})
+        return
+
+    request = ASGIRequest(scope, BytesIO())
+    throttle = IPThrottle()
+    if not throttle.allow_request(request, None):
+        retry_after = str(math.ceil(throttle.wait() or 1)).encode()
+        await _respond(send, 429, {'error': 'Слишком много запросов'}, [(b'retry-after', retry_after)])
+        return
+    client = throttle.get_ident(request)
+    if client and _streams[client] >= settings.EVENTS_MAX_STREAMS_PER_CLIENT:
+        await _respond(send, 429, {'error': 'Слишком много открытых потоков'})
+        return
+
+    ensure_listener()
+    # Подписка до чтения текущих статусов: изменение между ними придёт событием
+    queue = hub.subscribe(email)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    getter = None
+    if client:
+        _streams[client] += 1
+    try:
+        snapshot = await sync_to_async(current_statuses)(email)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache, no-transform'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': format_event('snapshot', snapshot), 'more_body': True})
+
+        getter = asyncio.ensure_future(queue.get())
+        while True:
+            done, _ = await asyncio.wait(
+                {getter, disconnected}, timeout=settings.EVENTS_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                break
+            if getter in done:
+                event = getter.result()
+                if event is None:
+                    break
+                body = format_event('status', event, f"{event['id']}.{event['version']}")
+                getter = asyncio.ensure_future(queue.get())
+            else:
+                body = b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        hub.unsubscribe(email, queue)
+        if client:
+            _streams[client] -= 1
+            if not _streams[client]:
+                del _streams[client]
+        for task in (getter, disconnected):
+            if task is not None:
+                task.cancel()
+
+
+def route_events(application):
+    """Оборачивает ASGI-приложение Django: поток событий и lifespan обслуживаются здесь"""
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == PATH:
+            await stream_events(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    stop_listener()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        else:
+            await application(scope, receive, send)
+    return app
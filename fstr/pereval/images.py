@@ -0,0 +1,252 @@
+"""
+Проверка ссылок на изображения и миниатюры для админки и API.
+
+Ссылки скачиваются конкурентно, не больше IMAGE_FETCH_CONCURRENCY
+одновременно: asyncio только ограничивает число одновременных загрузок, а
+сама загрузка — блокирующий urllib в потоках (asyncio.to_thread). Миниатюры
+строятся Pillow в общем пуле процессов, чтобы декодирование больших
+фотографий не занимало воркер. Файл миниатюры называется по SHA-256
+исходного изображения и размеру, поэтому одинаковые фотографии по разным
+ссылкам хранятся один раз, а повторная проверка не пересобирает миниатюру.
+
+Ссылки присылают пользователи, поэтому загружаются только http(s)-адреса в
+интернете: имя хоста разрешается заранее, и соединение с частными, локальными,
+link-local (в том числе 169.254.169.254) и зарезервированными адресами не
+открывается. Проверка выполняется для каждого соединения, включая переходы
+по перенаправлениям; прокси из окружения не используются.
+"""
+
+import asyncio
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import re
+import socket
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+THUMBNAIL_NAME_RE = re.compile(r'^[0-9a-f]{64}-\d+\.jpg$')
+USER_AGENT = 'fstr-image-check/1.0'
+
+
+class ImageCheckError(Exception):
+    pass
+
+
+def check_address(address):
+    """Бросает ImageCheckError, если IP-адрес не публичный (IMAGE_FETCH_ALLOW_PRIVATE снимает проверку)"""
+    if settings.IMAGE_FETCH_ALLOW_PRIVATE:
+        return
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    if not ip.is_global or ip.is_multicast:
+        raise ImageCheckError(f'Адрес {ip} недоступен для загрузки')
+
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None, **kwargs):
+    """Замена socket.create_connection: соединяется только с проверенными адресами хоста"""
+    host, port = address
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ImageCheckError(f'Не удалось разрешить {host}: {e}')
+    # Имя, разрешающееся хотя бы в один внутренний адрес, отклоняется целиком
+    for *_, sockaddr in infos:
+        check_address(sockaddr[0])
+    error = None
+    for *_, sockaddr in infos:
+        try:
+            return socket.create_connection((sockaddr[0], port), timeout, source_address, **kwargs)
+        except OSError as e:
+            error = e
+    raise error
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+def _build_opener():
+    # Без ProxyHandler, FileHandler, FTPHandler и DataHandler: только прямые http(s)-соединения
+    opener = urllib.request.OpenerDirector()
+    for handler in (
+        _PublicHTTPHandler(), _PublicHTTPSHandler(), urllib.request.UnknownHandler(),
+        urllib.request.HTTPRedirectHandler(),
+        urllib.request.HTTPDefaultErrorHandler(), urllib.request.HTTPErrorProcessor(),
+    ):
+        opener.add_handler(handler)
+    return opener
+
+
+_opener = _build_opener()
+
+
+def download_image(url, timeout=None, max_bytes=None):
+    """Скачивает изображение; бросает ImageCheckError, если ссылка недоступна, внутренняя или это не картинка"""
+    timeout = timeout or settings.IMAGE_FETCH_TIMEOUT
+    max_bytes = max_bytes or settings.IMAGE_MAX_BYTES
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    try:
+        with _opener.open(request, timeout=timeout) as response:
+            content_type = response.headers.get_content_type()
+            if not content_type.startswith('image/'):
+                raise ImageCheckError(f'Не изображение: {content_type}')
+            data = response.read(max_bytes + 1)
+    except urllib.error.HTTPError as e:
+        raise ImageCheckError(f'HTTP {e.code}')
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise ImageCheckError(str(getattr(e, 'reason', e)))
+    if len(data) > max_bytes:
+        raise ImageCheckError(f'Файл больше {max_bytes} байт')
+    return data
+
+
+async def fetch_images(urls, concurrency=None):
+    """Скачивает ссылки в потоках, не больше concurrency одновременно; возвращает {url: bytes или ImageCheckError}"""
+    semaphore = asyncio.Semaphore(concurrency or settings.IMAGE_FETCH_CONCURRENCY)
+
+    async def fetch(url):
+        async with semaphore:
+            try:
+                return url, await asyncio.to_thread(download_image, url)
+            except ImageCheckError as e:
+                return url, e
+
+    return dict(await asyncio.gather(*(fetch(url) for url in set(urls))))
+
+
+def thumbnail_name(data, size):
+    return f'{hashlib.sha256(data).hexdigest()}-{size}.jpg'
+
+
+def thumbnail_path(name):
+    return Path(settings.THUMBNAIL_DIR) / name[:2] / name
+
+
+def render_thumbnail(data, size):
+    """Уменьшает изображение до size x size (с сохранением пропорций) и возвращает JPEG"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('RGB', (size, size))  # JPEG декодируется сразу в уменьшенном виде
+        image = image.convert('RGB')
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=80, optimize=True)
+        return output.getvalue()
+
+
+def _store_thumbnail(args):
+    """Выполняется в процессе пула: строит миниатюру, если её ещё нет на диске"""
+    data, size, directory = args
+    name = thumbnail_name(data, size)
+    path = Path(directory) / name[:2] / name
+    if not path.exists():
+        content = render_thumbnail(data, size)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{hashlib.sha1(content).hexdigest()[:8]}.tmp')
+        tmp_path.write_bytes(content)
+        tmp_path.replace(path)
+    return name
+
+
+def _outcome(call):
+    try:
+        return call()
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        return ImageCheckError(f'Не удалось прочитать изображение: {e}')
+
+
+_pool = {'owner': None, 'executor': None}
+_pool_lock = threading.Lock()
+
+
+def _process_pool(workers):
+    """Пул процессов миниатюр, общий для всех задач процесса (пересоздаётся после fork)"""
+    owner = (os.getpid(), workers)
+    with _pool_lock:
+        if _pool['owner'] != owner:
+            if _pool['executor'] is not None and _pool['owner'][0] == owner[0]:
+                _pool['executor'].shutdown(wait=False)
+            _pool['executor'] = ProcessPoolExecutor(max_workers=workers)
+            _pool['owner'] = owner
+        return _pool['executor']
+
+
+def _reset_pool(executor):
+    with _pool_lock:
+        if _pool['executor'] is executor:
+            _pool['owner'] = _pool['executor'] = None
+
+
+def build_thumbnails(images, size=None, workers=None):
+    """Строит миниатюры для {url: bytes}; возвращает {url: имя файла или ImageCheckError}"""
+    size = size or settings.THUMBNAIL_SIZE
+    workers = settings.THUMBNAIL_WORKERS if workers is None else workers
+    urls = list(images)
+    jobs = [(images[url], size, str(settings.THUMBNAIL_DIR)) for url in urls]
+
+    # Для одной картинки запуск пула процессов дороже самой работы
+    if workers and len(jobs) > 1:
+        pool = _process_pool(workers)
+        try:
+            futures = [pool.submit(_store_thumbnail, job) for job in jobs]
+            return dict(zip(urls, [_outcome(future.result) for future in futures]))
+        except BrokenProcessPool:
+            # Процесс пула упал (например, OOM): пул пересоздаётся при следующем вызове
+            _reset_pool(pool)
+    return dict(zip(urls, [_outcome(partial(_store_thumbnail, job)) for job in jobs]))
+
+
+def check_images(images):
+    """Проверяет ссылки изображений PerevalImage и строит миниатюры; возвращает число доступных"""
+    from .models import PerevalImage
+
+    images = list(images)
+    if not images:
+        return 0
+    downloaded = asyncio.run(fetch_images([img.image_url for img in images]))
+    thumbnails = build_thumbnails({url: data for url, data in downloaded.items() if isinstance(data, bytes)})
+
+    now = timezone.now()
+    for img in images:
+        outcome = thumbnails.get(img.image_url, downloaded[img.image_url])
+        if isinstance(outcome, str):
+            img.url_status, img.url_error, img.thumbnail = 'ok', '', outcome
+        else:
+            img.url_status, img.url_error, img.thumbnail = 'broken', str(outcome)[:255], ''
+        img.checked_at = now
+    # bulk_update не вызывает PerevalImage.save: проверка не меняет версию перевала
+    PerevalImage.objects.bulk_update(images, ['url_status', 'url_error', 'thumbnail', 'checked_at'])
+    return sum(img.url_status == 'ok' for img in images)
@@ -0,0 +1,117 @@
+"""
+Асинхронный приём перевалов (ASYNC_INGEST=True).
+
+POST /api/submitData/ только проверяет данные и кладёт их в таблицу
+PerevalSubmission (один INSERT), отвечая 202 с tracking_id. Команда
+drain_submissions разбирает очередь пачками: одна транзакция на пачку,
+каждая заявка — в своей точке сохранения, чтобы ошибка одной заявки не
+откатывала остальные. При шардировании транзакция и точки сохранения
+открываются в каждом шарде: перевал заявки пишется в шард своего региона.
+Заявки забираются через SKIP LOCKED, поэтому можно запускать несколько
+обработчиков одновременно.
+"""
+
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .jobs import enqueue_post_submit
+from .models import PerevalSubmission
+from .sharding import is_enabled
+
+
+def enqueue(payload):
+    """Ставит проверенный payload в очередь и возвращает заявку"""
+    return PerevalSubmission.objects.create(payload=payload)
+
+
+def process_submission(submission):
+    """Создаёт перевал по заявке; возвращает его id или бросает исключение"""
+    from .serializers import PerevalAddedSerializer
+
+    serializer = PerevalAddedSerializer(data=submission.payload)
+    serializer.is_valid(raise_exception=True)
+    extra = {}
+    if 'add_time' not in serializer.validated_data:
+        # Время добавления — момент приёма заявки, а не момент разбора очереди
+        extra['add_time'] = submission.received_at
+    pereval = serializer.save(**extra)
+    enqueue_post_submit(pereval.id, using=pereval._state.db)
+    return pereval.id
+
+
+@contextmanager
+def _atomic_all():
+    """Транзакция (или точка сохранения) в основной БД и во всех шардах"""
+    with ExitStack() as stack:
+        for alias in (settings.DATABASE_SHARDS if is_enabled() else ['default']):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def drain_batch(batch_size=None):
+    """Разбирает одну пачку заявок; возвращает пару (сохранено, с ошибкой)"""
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    done = failed = 0
+    with _atomic_all():
+        submissions = list(
+            PerevalSubmission.objects
+            .filter(state='queued')
+            .order_by('received_at', 'id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        now = timezone.now()
+        for submission in submissions:
+            try:
+                with _atomic_all():
+                    submission.pereval_id = process_submission(submission)
+                submission.state = 'done'
+                done += 1
+            except Exception as e:
+                submission.state = 'failed'
+                submission.error = str(e)
+                failed += 1
+            submission.processed_at = now
+        PerevalSubmission.objects.bulk_update(submissions, ['state', 'pereval_id', 'error', 'processed_at'])
+    return done, failed
+
+
+def drain(batch_size=None, max_batches=None, pause=0.0):
+    """Разбирает очередь до конца (или max_batches пачек); возвращает (сохранено, с ошибкой)"""
+    total_done = total_failed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        done, failed = drain_batch(batch_size)
+        if not done and not failed:
+            break
+        total_done += done
+        total_failed += failed
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return total_done, total_failed
+
+
+def queue_metrics(window_seconds=60):
+    """Глубина очереди, возраст самой старой заявки и скорость разбора за последние window_seconds"""
+    now = timezone.now()
+    since = now - timedelta(seconds=window_seconds)
+    stats = PerevalSubmission.objects.aggregate(
+        depth=Count('id', filter=Q(state='queued')),
+        oldest=Min('received_at', filter=Q(state='queued')),
+        processed=Count('id', filter=Q(processed_at__gte=since)),
+        failed=Count('id', filter=Q(processed_at__gte=since, state='failed')),
+    )
+    return {
+        'depth': stats['depth'],
+        'oldest_age_seconds': round((now - stats['oldest']).total_seconds(), 3) if stats['oldest'] else 0.0,
+        'processed_last_window': stats['processed'],
+        'failed_last_window': stats['failed'],
+        'drain_rate_per_second': round(stats['processed'] / window_seconds, 3),
+        'window_seconds': window_seconds,
+    }
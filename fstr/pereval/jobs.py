@@ -0,0 +1,203 @@
+"""
+Очередь фоновых задач в базе данных (без внешнего брокера).
+
+Задача регистрируется декоратором @job('имя') (см. pereval.tasks) и ставится
+в очередь функцией enqueue — это один INSERT, поэтому постановка из запроса
+почти не влияет на его время. Команда run_jobs забирает готовые задачи через
+SELECT ... FOR UPDATE SKIP LOCKED и выполняет их в пуле потоков. Упавшая
+задача повторяется с экспоненциальной задержкой до max_attempts раз; задача,
+зависшая в состоянии running дольше JOB_LOCK_TIMEOUT (воркер был убит),
+возвращается в очередь.
+"""
+
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def job(name, max_attempts=None):
+    """Регистрирует функцию как фоновую задачу; функция получает payload как именованные аргументы"""
+    def decorator(func):
+        _registry[name] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def get_job(name):
+    from . import tasks  # noqa: F401  регистрирует задачи приложения
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f'Неизвестная задача: {name}')
+
+
+def enqueue(name, delay=0, **payload):
+    """Ставит задачу в очередь одним INSERT"""
+    return enqueue_many([(name, payload)], delay=delay)[0]
+
+
+def enqueue_many(items, delay=0):
+    """Ставит в очередь несколько задач [(name, payload), ...] одним INSERT"""
+    run_after = timezone.now() + timedelta(seconds=delay)
+    return BackgroundJob.objects.bulk_create([
+        BackgroundJob(
+            name=name, payload=payload, run_after=run_after,
+            max_attempts=get_job(name)[1] or settings.JOB_MAX_ATTEMPTS,
+        )
+        for name, payload in items
+    ])
+
+
+def enqueue_post_submit(pereval_id, using=None):
+    """
+    Задачи, выполняемые после добавления перевала (settings.POST_SUBMIT_JOBS).
+    Ставятся после фиксации транзакции в БД using, где сохранён перевал; ошибка
+    постановки только пишется в лог — перевал уже сохранён, и повтор запроса
+    клиентом создал бы дубликат.
+    """
+    if not settings.POST_SUBMIT_JOBS:
+        return
+
+    def schedule():
+        try:
+            enqueue_many([(name, {'pereval_id': pereval_id}) for name in settings.POST_SUBMIT_JOBS])
+        except Exception:
+            logger.exception('Не удалось поставить задачи для перевала #%s', pereval_id)
+
+    transaction.on_commit(schedule, using=using)
+
+
+def enqueue_image_check(pereval_id, using=None):
+    """
+    После фиксации транзакции в БД using ставит проверку изображений, заменённых
+    правкой перевала, если она включена для новых перевалов (check_images в
+    settings.POST_SUBMIT_JOBS); ошибка постановки только пишется в лог.
+    """
+    if 'check_images' not in settings.POST_SUBMIT_JOBS:
+        return
+
+    def schedule():
+        try:
+            enqueue('check_images', pereval_id=pereval_id)
+        except Exception:
+            logger.exception('Не удалось поставить проверку изображений перевала #%s', pereval_id)
+
+    transaction.on_commit(schedule, using=using)
+
+
+def enqueue_snapshot_rebuild(using=None):
+    """
+    После фиксации транзакции отмечает снимок принятых перевалов устаревшим и
+    ставит его пересборку через SNAPSHOT_REBUILD_DELAY секунд, если она ещё не
+    в очереди: правки модератора подряд собираются в одну пересборку.
+    """
+    from .snapshot import mark_stale
+
+    def schedule():
+        mark_stale()
+        enqueue_once('build_snapshot', delay=settings.SNAPSHOT_REBUILD_DELAY)
+
+    transaction.on_commit(schedule, using=using)
+
+
+def enqueue_stats_refresh(using=None):
+    """
+    После фиксации транзакции ставит пересчёт статистики перевалов через
+    STATS_REFRESH_DELAY секунд, если он ещё не в очереди: новые перевалы и
+    правки подряд собираются в один REFRESH MATERIALIZED VIEW.
+    """
+    transaction.on_commit(lambda: enqueue_once('refresh_stats', delay=settings.STATS_REFRESH_DELAY), using=using)
+
+
+def enqueue_once(name, delay):
+    """Ставит задачу name через delay секунд, если такая ещё не ждёт в очереди"""
+    try:
+        if not BackgroundJob.objects.filter(name=name, state='queued').exists():
+            enqueue(name, delay=delay)
+    except Exception:
+        logger.exception('Не удалось поставить задачу %s', name)
+
+
+def backoff(attempts):
+    """Задержка перед повтором в секундах: JOB_BACKOFF_SECONDS * 2^(попытка-1), не больше часа"""
+    return min(settings.JOB_BACKOFF_SECONDS * 2 ** (attempts - 1), 3600)
+
+
+def requeue_stale():
+    """Возвращает в очередь задачи, заблокированные воркером, который не завершил их"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    return BackgroundJob.objects.filter(state='running', locked_at__lt=cutoff).update(state='queued', locked_at=None)
+
+
+def claim(limit):
+    """Забирает до limit готовых задач, помечая их running"""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            BackgroundJob.objects
+            .filter(state='queued', run_after__lte=now)
+            .order_by('run_after', 'id')
+            .select_for_update(skip_locked=True)[:limit]
+        )
+        if jobs:
+            BackgroundJob.objects.filter(id__in=[j.id for j in jobs]).update(
+                state='running', locked_at=now, attempts=F('attempts') + 1
+            )
+    for j in jobs:
+        j.state, j.locked_at, j.attempts = 'running', now, j.attempts + 1
+    return jobs
+
+
+def execute(background_job):
+    """Выполняет задачу и сохраняет результат; возвращает итоговое состояние"""
+    rows = BackgroundJob.objects.filter(pk=background_job.pk, state='running')
+    try:
+        func = get_job(background_job.name)[0]
+        result = func(**background_job.payload)
+    except Exception as e:
+        error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        logger.warning('Задача %s #%s упала (попытка %s): %s',
+                       background_job.name, background_job.pk, background_job.attempts, error)
+        if background_job.attempts < background_job.max_attempts:
+            rows.update(
+                state='queued', locked_at=None, last_error=error,
+                run_after=timezone.now() + timedelta(seconds=backoff(background_job.attempts)),
+            )
+            return 'queued'
+        rows.update(state='failed', finished_at=timezone.now(), last_error=error)
+        return 'failed'
+    rows.update(state='done', finished_at=timezone.now(), result=result)
+    return 'done'
+
+
+def _execute_in_thread(background_job):
+    # У каждого потока свои соединения с БД (основная, реплики, шарды), их нужно закрыть по завершении
+    try:
+        return execute(background_job)
+    finally:
+        connections.close_all()
+
+
+def run_pending(concurrency=None, batch_size=None):
+    """Выполняет одну пачку готовых задач; возвращает словарь {состояние: количество}"""
+    concurrency = concurrency or settings.JOB_CONCURRENCY
+    requeue_stale()
+    jobs = claim(batch_size or concurrency * 4)
+    if concurrency == 1:
+        states = [execute(j) for j in jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            states = list(pool.map(_execute_in_thread, jobs))
+    return {state: states.count(state) for state in set(states)}
@@ -0,0 +1,209 @@
+"""
+Структурированные JSON-логи: журнал запросов и журнал изменений (аудит).
+
+Запись лога попадает в очередь в памяти (BatchingHandler.emit — только
+добавление в deque), а фоновый поток раз в LOG_FLUSH_SECONDS или при
+накоплении LOG_BATCH_SIZE записей форматирует их в JSON и пишет пачкой одним
+вызовом write. Запрос никогда не ждёт вывода: если поток не успевает и очередь
+заполнена (LOG_QUEUE_SIZE), новые записи отбрасываются, а их число выводится
+отдельной записью log.dropped.
+
+Потоки:
+- pereval.access — по записи на запрос (pereval.middleware.AccessLogMiddleware): маршрут, статус,
+  длительность, время и число запросов к БД, id перевала, email автора.
+  Успешные быстрые запросы к маршрутам из LOG_SAMPLE_RATES пишутся с заданной
+  долей (поле sample_rate позволяет восстановить полные счётчики); ошибки и
+  запросы дольше LOG_SLOW_MS пишутся всегда;
+- pereval.audit — смена статуса и PATCH записи PerevalAdded, без выборки;
+  запись делается после фиксации транзакции. PATCH записывает прежние и новые
+  значения полей; адреса email и номера телефонов в них маскируются (mask_pii).
+"""
+
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+
+access_logger = logging.getLogger('pereval.access')
+audit_logger = logging.getLogger('pereval.audit')
+
+_current_request = contextvars.ContextVar('log_request', default=None)
+
+EMAIL_RE = re.compile(r'([\w.+-])[\w.+-]*@([\w-]+(?:\.[\w-]+)+)')
+PHONE_RE = re.compile(r'\+?\d[\d\s()-]{6,}\d')
+PHONE_MIN_DIGITS = 10
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись; поля из extra={'fields': {...}} добавляются в объект"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, tz=dt_timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class BatchingHandler(logging.Handler):
+    """Очередь записей в памяти и фоновый поток, который пишет их пачками"""
+
+    def __init__(self, stream='stdout', capacity=10000, batch_size=200, flush_interval=1.0):
+        super().__init__()
+        self.stream_name = stream
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._stream = None
+        self._closed = False
+
+    def _open_stream(self):
+        if self.stream_name in ('stdout', 'stderr'):
+            return getattr(sys, self.stream_name)
+        return open(self.stream_name, 'a', encoding='utf-8')
+
+    def _start(self):
+        # Поток не переживает fork (воркеры gunicorn): каждый процесс запускает свой
+        self._pid = os.getpid()
+        self._queue.clear()
+        threading.Thread(target=self._run, name='log-flusher', daemon=True).start()
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        if len(self._queue) >= self.capacity:
+            self.dropped += 1
+            return
+        self._queue.append(record)
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def _run(self):
+        pid = self._pid
+        while not self._closed and self._pid == pid:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Форматирует и пишет всё, что накопилось в очереди"""
+        with self._write_lock:
+            lines = []
+            while self._queue:
+                record = self._queue.popleft()
+                try:
+                    lines.append(self.format(record))
+                except Exception:
+                    self.handleError(record)
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(json.dumps({
+                    'time': datetime.now(dt_timezone.utc).isoformat(timespec='milliseconds'),
+                    'level': 'WARNING', 'logger': 'pereval.logs', 'event': 'log.dropped', 'count': dropped,
+                }))
+            if not lines:
+                return
+            if self._stream is None:
+                self._stream = self._open_stream()
+            try:
+                self._stream.write('\n'.join(lines) + '\n')
+                self._stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+        if self._stream is not None and self.stream_name not in ('stdout', 'stderr'):
+            self._stream.close()
+        super().close()
+
+
+@contextmanager
+def bind_request(request):
+    """Связывает записи аудита, сделанные во время обработки запроса, с этим запросом"""
+    token = _current_request.set(request)
+    try:
+        yield
+    finally:
+        _current_request.reset(token)
+
+
+def annotate(request, **fields):
+    """Добавляет поля (id перевала, email) в запись журнала запросов"""
+    log_fields = getattr(request, 'log_fields', None)
+    if log_fields is not None:
+        log_fields.update((key, value) for key, value in fields.items() if value is not None)
+
+
+def _mask_phone(match):
+    digits = re.sub(r'\D', '', match[0])
+    # Короткие последовательности цифр (диапазоны высот, годы) телефонами не считаются
+    return match[0] if len(digits) < PHONE_MIN_DIGITS else '***' + digits[-2:]
+
+
+def mask_pii(value):
+    """Маскирует адреса email (q***@mail.ru) и номера телефонов (***67) в строках, списках и словарях"""
+    if isinstance(value, str):
+        return PHONE_RE.sub(_mask_phone, EMAIL_RE.sub(lambda m: f'{m[1]}***@{m[2]}', value))
+    if isinstance(value, dict):
+        return {key: mask_pii(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [mask_pii(item) for item in value]
+    return value
+
+
+def audit(event, using=None, changes=None, **fields):
+    """
+    Запись журнала изменений после фиксации транзакции; добавляет id запроса и пользователя админки.
+    changes — {поле: {'old': прежнее значение, 'new': новое}}, персональные данные в нём маскируются.
+    """
+    if changes is not None:
+        fields['changes'] = mask_pii(changes)
+    request = _current_request.get()
+    if request is not None:
+        fields['request_id'] = request.request_id
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            fields['actor'] = mask_pii(user.get_username())
+    record = {'event': event, **fields}
+    transaction.on_commit(lambda: audit_logger.info(event, extra={'fields': record}), using=using)
+
+
+class QueryTimer:
+    """Обёртка выполнения SQL (connection.execute_wrapper): суммарное время и число запросов"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
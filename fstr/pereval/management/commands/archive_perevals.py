@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pereval.archive import archive_perevals
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые отклонённые перевалы вместе с координатами и изображениями в архивные таблицы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Возраст записи (по add_time) в днях')
+        parser.add_argument('--status', action='append', dest='statuses',
+                            help='Статус для архивации (можно указать несколько раз)')
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE,
+                            help='Размер пачки, переносимой в одной транзакции')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Пауза между пачками в секундах')
+        parser.add_argument('--max-batches', type=int, help='Ограничить количество пачек за запуск')
+
+    def handle(self, *args, **options):
+        total = archive_perevals(
+            days=options['days'],
+            statuses=options['statuses'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Перенесено в архив: {total}'))
@@ -0,0 +1,100 @@
+import multiprocessing
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from pereval.models import PerevalAdded
+from pereval.views import PerevalRetrieveUpdateView, SubmitData
+
+
+def run_clients(view, url, kwargs, clients, barrier, results):
+    """clients потоков одновременно (после barrier) выполняют один и тот же GET"""
+    factory = APIRequestFactory()
+
+    def client():
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        request = factory.get(url)
+        barrier.wait()
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = view(request, **kwargs)
+            response.render()
+        results.put((queries[0], time.perf_counter() - started, response.status_code))
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_process(view, url, kwargs, clients, barrier, results):
+    connections.close_all()  # соединения родителя нельзя использовать после fork
+    run_clients(view, url, kwargs, clients, barrier, results)
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузка «толпой»: одновременные одинаковые GET /api/submitData/<id>/ (или списка автора) '
+        'с объединением запросов и без него; считает запросы к БД и время ответа'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pk', type=int, help='id перевала (по умолчанию — последний не принятый)')
+        parser.add_argument('--email', help='Нагружать список GET /api/submitData/?user__email=')
+        parser.add_argument('--clients', type=int, default=50, help='Одновременных запросов в каждом процессе')
+        parser.add_argument('--processes', type=int, default=1, help='Процессов (объединение между воркерами)')
+
+    def handle(self, *args, **options):
+        if options['email']:
+            view = SubmitData.as_view()
+            url, kwargs = f'/api/submitData/?user__email={options["email"]}', {}
+        else:
+            # Принятые перевалы отдаются из снимка без БД, поэтому по умолчанию берётся не принятый
+            pk = options['pk'] or PerevalAdded.objects.exclude(status='accepted').order_by('-id') \
+                .values_list('id', flat=True).first()
+            if pk is None:
+                raise CommandError('Нет перевалов для нагрузки, укажите --pk')
+            view = PerevalRetrieveUpdateView.as_view()
+            url, kwargs = f'/api/submitData/{pk}/', {'pk': pk}
+
+        clients, processes = options['clients'], options['processes']
+        total = clients * processes
+        self.stdout.write(f'{url}: {processes} x {clients} одновременных запросов')
+        self.stdout.write(f'{"объединение":<12} {"время, мс":>10} {"макс. ответ, мс":>16} {"запросов к БД":>14}')
+
+        context = multiprocessing.get_context('fork')
+        for enabled in (False, True):
+            with override_settings(SINGLEFLIGHT_ENABLED=enabled, THROTTLE_ENABLED=False):
+                results = context.Queue()
+                barrier = context.Barrier(total)
+                connections.close_all()
+                started = time.perf_counter()
+                workers = [
+                    context.Process(target=run_process, args=(view, url, kwargs, clients, barrier, results))
+                    for _ in range(processes)
+                ]
+                for worker in workers:
+                    worker.start()
+                measured = [results.get() for _ in range(total)]
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - started
+
+            if any(code != 200 for _, _, code in measured):
+                raise CommandError('Часть запросов завершилась ошибкой')
+            queries = sum(count for count, _, _ in measured)
+            slowest = max(duration for _, duration, _ in measured)
+            self.stdout.write(
+                f'{"вкл" if enabled else "выкл":<12} {elapsed * 1000:>10.1f} {slowest * 1000:>16.1f} {queries:>14}'
+            )
@@ -0,0 +1,71 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+
+from pereval.compression import CompressedCache, available_encodings
+
+LEVELS = {'gzip': (1, 6, 9), 'br': (1, 5, 11)}
+WORDS = ['перевал', 'седловина', 'гребень', 'ледник', 'осыпь', 'кулуар', 'вершина', 'тропа', 'морена', 'скалы']
+
+
+def sample_listing(count, seed=0):
+    """Ответ GET /api/submitData/ со списком из count перевалов"""
+    rnd = random.Random(seed)
+    return [
+        {
+            'id': i,
+            'beauty_title': 'пер. ',
+            'title': f'{rnd.choice(WORDS).capitalize()} {i}',
+            'other_titles': ' '.join(rnd.choices(WORDS, k=2)),
+            'connect': ' '.join(rnd.choices(WORDS, k=12)),
+            'add_time': f'2025-07-{rnd.randint(1, 28):02d}T12:{rnd.randint(0, 59):02d}:00Z',
+            'status': rnd.choice(['new', 'pending', 'accepted', 'rejected']),
+            'user': {'email': 'qwerty@mail.ru', 'fam': 'Пупкин', 'name': 'Василий', 'otc': 'Иванович',
+                     'phone': '+7 555 55 55'},
+            'coords': {'latitude': round(rnd.uniform(40, 46), 4), 'longitude': round(rnd.uniform(6, 45), 4),
+                       'height': rnd.randint(800, 5000)},
+            'level': {'winter': rnd.choice(['', '1А', '2Б']), 'summer': '1А', 'autumn': '1А', 'spring': ''},
+            'images': [
+                {'title': f'Фото {j}', 'image_url': f'https://images.example.com/{i}/{rnd.getrandbits(64):016x}.jpg'}
+                for j in range(rnd.randint(1, 3))
+            ],
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def measure(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat, result
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает размер ответа и время сжатия gzip и brotli на списке перевалов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='Число перевалов в списке')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов каждого замера')
+
+    def handle(self, *args, **options):
+        body = JSONRenderer().render(sample_listing(options['count']))
+        repeat = options['repeat']
+        self.stdout.write(f'Ответ: {options["count"]} перевалов, {len(body)} байт без сжатия')
+        self.stdout.write(f'{"кодировка":<10} {"байт":>9} {"доля":>7} {"сжатие, мс":>11} {"МБ/с":>8} {"из кэша, мс":>12}')
+
+        for encoding in available_encodings():
+            setting = 'COMPRESSION_BROTLI_QUALITY' if encoding == 'br' else 'COMPRESSION_GZIP_LEVEL'
+            for level in LEVELS[encoding]:
+                with override_settings(**{setting: level}):
+                    cache = CompressedCache(64 * 1024 * 1024)
+                    cold, compressed = measure(lambda: cache.clear() or cache.get_or_compress(body, encoding), repeat)
+                    cache.get_or_compress(body, encoding)
+                    hot, _ = measure(lambda: cache.get_or_compress(body, encoding), repeat)
+                self.stdout.write(
+                    f'{f"{encoding}-{level}":<10} {len(compressed):>9} {len(compressed) / len(body):>7.1%} '
+                    f'{cold * 1000:>11.2f} {len(body) / cold / 1e6:>8.1f} {hot * 1000:>12.3f}'
+                )
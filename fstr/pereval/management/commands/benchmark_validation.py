@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pereval.prevalidation import validate_submit
+from pereval.serializers import PerevalAddedSerializer
+
+
+def make_payload(title='Пхия', latitude=45.3842):
+    return {
+        'beauty_title': 'пер. ',
+        'title': title,
+        'other_titles': 'Триев',
+        'connect': '',
+        'user': {'email': 'qwerty@mail.ru', 'fam': 'Пупкин', 'name': 'Василий', 'otc': '', 'phone': '+7 555 55 55'},
+        'coords': {'latitude': latitude, 'longitude': 7.1525, 'height': 1200},
+        'images': [{'title': 'Седловина', 'image_url': 'https://example.com/photo1.jpg'}],
+    }
+
+
+def bad_payloads():
+    """Типичные отклоняемые запросы"""
+    out_of_range = make_payload(latitude=123.4)
+    long_title = make_payload(title='П' * 500)
+    many_images = make_payload()
+    many_images['images'] = many_images['images'] * 200
+    missing_user = make_payload()
+    del missing_user['user']
+    return {
+        'координаты вне диапазона': out_of_range,
+        'длинное название': long_title,
+        '200 изображений': many_images,
+        'нет автора': missing_user,
+    }
+
+
+def per_call(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает стоимость отклонения неверного POST предварительной проверкой и сериализатором'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=2000, help='Повторов каждого замера')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        self.stdout.write(f'{"запрос":<28} {"сериализатор, мкс":>18} {"схема, мкс":>11} {"ускорение":>10}')
+        for name, payload in bad_payloads().items():
+            assert validate_submit(payload) is not None
+            full = per_call(lambda: PerevalAddedSerializer(data=payload).is_valid(), repeat)
+            fast = per_call(lambda: validate_submit(payload), repeat)
+            self.stdout.write(f'{name:<28} {full * 1e6:>18.1f} {fast * 1e6:>11.1f} {full / fast:>9.1f}x')
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pereval.snapshot import build_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Строит снимок принятых перевалов для чтения воркерами через mmap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Файл снимка (по умолчанию SNAPSHOT_FILE)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        path, count, size = build_snapshot(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимок {path}: {count} перевалов, {size} байт за {time.perf_counter() - started:.2f} с'
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from pereval.images import check_images
+from pereval.models import PerevalImage
+from pereval.sharding import scatter
+
+
+class Command(BaseCommand):
+    help = 'Проверяет ссылки на изображения и строит миниатюры для ещё не проверенных записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Количество изображений в пачке')
+        parser.add_argument('--all', action='store_true', help='Перепроверить и уже проверенные изображения')
+
+    def handle(self, *args, **options):
+        # Изображения хранятся в шардах вместе с перевалами: каждый шард проверяется отдельно
+        counts = scatter(lambda: self.check_shard(options['batch_size'], options['all']))
+        checked = sum(shard_checked for shard_checked, _ in counts.values())
+        ok = sum(shard_ok for _, shard_ok in counts.values())
+        self.stdout.write(self.style.SUCCESS(f'Проверено изображений: {checked}, доступно: {ok}'))
+
+    def check_shard(self, batch_size, recheck):
+        """Проверяет изображения текущего шарда; возвращает (проверено, доступно)"""
+        queryset = PerevalImage.objects.order_by('id')
+        if not recheck:
+            queryset = queryset.filter(checked_at__isnull=True)
+
+        checked = ok = 0
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            ok += check_images(batch)
+            checked += len(batch)
+            last_id = batch[-1].id
+        return checked, ok
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pereval.partitioning import ensure_partitions
+
+
+class Command(BaseCommand):
+    help = 'Создаёт месячные секции таблицы перевалов на будущие месяцы (запускать по расписанию)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='На сколько месяцев вперёд создать секции')
+
+    def handle(self, *args, **options):
+        try:
+            created = ensure_partitions(options['months_ahead'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        for name in created:
+            self.stdout.write(f'Создана секция {name}')
+        self.stdout.write(self.style.SUCCESS(f'Новых секций: {len(created)}'))
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pereval.ingest import drain, queue_metrics
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет перевалы из очереди асинхронного приёма (ASYNC_INGEST) пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.INGEST_BATCH_SIZE,
+                            help='Количество заявок, сохраняемых в одной транзакции')
+        parser.add_argument('--max-batches', type=int, help='Ограничить количество пачек за проход')
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза при пустой очереди в режиме --loop, в секундах')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            done, failed = drain(batch_size=options['batch_size'], max_batches=options['max_batches'])
+            elapsed = time.perf_counter() - started
+            if done or failed or not options['loop']:
+                metrics = queue_metrics()
+                rate = (done + failed) / elapsed if elapsed else 0.0
+                self.stdout.write(
+                    f'Сохранено: {done}, с ошибкой: {failed}, {rate:.1f} заявок/с; '
+                    f'в очереди: {metrics["depth"]}'
+                )
+            if not options['loop']:
+                break
+            if not done and not failed:
+                time.sleep(options['interval'])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from fstr.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Генерирует OpenAPI-схему для Swagger/ReDoc и сохраняет её в OPENAPI_SCHEMA_FILE'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help='Путь к файлу схемы (по умолчанию settings.OPENAPI_SCHEMA_FILE)',
+        )
+
+    def handle(self, *args, **options):
+        path, size = write_schema(options['output'])
+        self.stdout.write(self.style.SUCCESS(f'Схема сохранена в {path} ({size} байт)'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from pereval.partitioning import TABLE, convert_to_partitioned
+
+
+class Command(BaseCommand):
+    help = 'Преобразует таблицу перевалов в секционированную по add_time (по месяцам)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='На сколько месяцев вперёд создать секции')
+
+    def handle(self, *args, **options):
+        created = convert_to_partitioned(options['months_ahead'])
+        if not created:
+            self.stdout.write(f'Таблица {TABLE} уже секционирована')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Таблица {TABLE} секционирована, секций: {len(created)}'))
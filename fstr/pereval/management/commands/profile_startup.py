@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Скрипт запускается в отдельном интерпретаторе с -X importtime, чтобы
+# измерять холодный старт, а не уже прогретый текущий процесс
+STARTUP_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+from fstr.wsgi import application
+loaded = time.perf_counter()
+from django.test import Client
+client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+requested = time.perf_counter()
+response = client.get('/api/submitData/', {'user__email': 'startup-profile@example.com'})
+done = time.perf_counter()
+print(json.dumps({
+    'wsgi_application': loaded - start,
+    'first_request': done - requested,
+    'time_to_first_response': done - start - (requested - loaded),
+    'first_request_status': response.status_code,
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """Суммирует собственное время импорта (в микросекундах) по пакетам верхнего уровня"""
+    totals = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        package = parts[2].strip().split('.')[0]
+        totals[package] += int(parts[0])
+    return totals
+
+
+class Command(BaseCommand):
+    help = 'Измеряет время холодного старта воркера и показывает разбивку времени импорта по пакетам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lean', action='store_true', help='Запустить с LEAN_STARTUP=True')
+        parser.add_argument('--warmup', action='store_true', help='Включить прогрев (соединение с БД)')
+        parser.add_argument('--limit', type=int, default=15, help='Сколько пакетов показать')
+
+    def handle(self, *args, **options):
+        env = os.environ.copy()
+        env['DJANGO_SETTINGS_MODULE'] = os.environ.get('DJANGO_SETTINGS_MODULE', 'fstr.settings')
+        env['LEAN_STARTUP'] = 'True' if options['lean'] else 'False'
+        env['WARMUP_ON_START'] = 'True' if options['warmup'] else 'False'
+        # Журнал запросов не должен смешиваться с результатом замера в stdout
+        env['LOG_STREAM'] = 'stderr'
+
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f'Не удалось запустить приложение:\n{result.stderr[-2000:]}')
+
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        totals = parse_importtime(result.stderr)
+
+        self.stdout.write(f'Режим: {"lean" if options["lean"] else "обычный"}')
+        self.stdout.write(f'Статус первого запроса: {timings.pop("first_request_status")}')
+        for name, seconds in timings.items():
+            self.stdout.write(f'  {name:<24} {seconds * 1000:9.1f} ms')
+        self.stdout.write(f'  {"imports (total)":<24} {sum(totals.values()) / 1000:9.1f} ms')
+        self.stdout.write('Время импорта по пакетам:')
+        for package, usec in sorted(totals.items(), key=lambda item: -item[1])[:options['limit']]:
+            self.stdout.write(f'  {package:<24} {usec / 1000:9.1f} ms')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pereval.mapgrid import rebuild_grid
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сетку кластеров карты по всем перевалам'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            cells = rebuild_grid()
+        self.stdout.write(self.style.SUCCESS(f'Ячеек сетки: {cells}'))
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pereval.stats import refresh_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику перевалов (/api/stats/) без блокировки чтения'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        refresh_stats()
+        self.stdout.write(self.style.SUCCESS(f'Статистика пересчитана за {time.perf_counter() - started:.2f} с'))
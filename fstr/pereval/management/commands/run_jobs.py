@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from pereval.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в базе данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.JOB_CONCURRENCY,
+                            help='Количество потоков, выполняющих задачи')
+        parser.add_argument('--batch-size', type=int,
+                            help='Сколько задач забирать за раз (по умолчанию concurrency * 4)')
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза при пустой очереди в режиме --loop, в секундах')
+
+    def handle(self, *args, **options):
+        while True:
+            if options['loop']:
+                # Как между запросами: соединение, отжившее CONN_MAX_AGE или сломанное, переоткрывается
+                close_old_connections()
+            counts = run_pending(concurrency=options['concurrency'], batch_size=options['batch_size'])
+            if counts or not options['loop']:
+                summary = ', '.join(f'{state}: {count}' for state, count in sorted(counts.items()))
+                self.stdout.write(f'Обработано задач: {sum(counts.values())} ({summary or "очередь пуста"})')
+            if not options['loop']:
+                break
+            if not counts:
+                time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from pereval.sharding import configure_sequences
+
+
+class Command(BaseCommand):
+    help = 'Мигрирует шарды из FSTR_DB_SHARDS и сдвигает их последовательности id в диапазон шарда'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-migrate', action='store_true', help='Только настроить последовательности id')
+
+    def handle(self, *args, **options):
+        for alias in settings.DATABASE_SHARDS[1:]:
+            if not options['skip_migrate']:
+                call_command('migrate', database=alias, verbosity=0)
+            start = configure_sequences(alias)
+            self.stdout.write(f'{alias}: id начинаются с {start}')
+        self.stdout.write(self.style.SUCCESS(f'Шардов: {len(settings.DATABASE_SHARDS)}'))
@@ -0,0 +1,274 @@
+"""
+Кластеризация перевалов для карты (тайлы z/x/y в проекции Web Mercator).
+
+Для каждого масштаба z от MAP_GRID_MIN_ZOOM до MAP_CLUSTER_MAX_ZOOM перевалы
+заранее сгруппированы в ячейки сетки: тайл делится на CELLS_PER_TILE x CELLS_PER_TILE
+ячеек, и таблица MapGridCell хранит для ячейки количество перевалов, сумму
+координат (для центра кластера) и id представителя — самого нового перевала.
+Тайл читается по индексу (zoom, cell_x, cell_y) и содержит не больше
+CELLS_PER_TILE² кластеров, поэтому время ответа не зависит от числа перевалов.
+На более крупных масштабах тайл содержит сами перевалы (индекс по широте и долготе).
+
+Мелкие масштабы (меньше MAP_GRID_MIN_ZOOM) не хранятся: на них несколько ячеек
+на весь мир, и каждое добавление перевала ждало бы блокировку одних и тех же
+строк (ячейка z0 — одна на все перевалы). Их тайлы собираются при чтении из
+ячеек MAP_GRID_MIN_ZOOM одним GROUP BY — ячеек там не больше, чем непустых
+областей на карте.
+
+Ячейки обновляются при добавлении перевала, изменении его координат и
+переносе в архив (add_points / remove_points); rebuild_grid пересчитывает
+всю сетку одним запросом на масштаб и шард. Сетка хранится в основной БД и
+учитывает перевалы всех шардов (pereval.sharding).
+"""
+
+import math
+import struct
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F, Max, Sum
+
+CELL_BITS = 3
+CELLS_PER_TILE = 1 << CELL_BITS
+MAX_LATITUDE = 85.05112878
+
+# Бинарный тайл: заголовок (сигнатура, версия, число кластеров),
+# затем на кластер позиция внутри тайла (0..65535), количество и id представителя
+BINARY_MAGIC = b'FSTR'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sBI')
+BINARY_CLUSTER = struct.Struct('<HHIQ')
+
+
+def world_position(latitude, longitude):
+    """Координаты точки на карте мира в долях (0..1) по горизонтали и вертикали"""
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    x = (longitude + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(latitude))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0 - 1e-12), min(max(y, 0.0), 1.0 - 1e-12)
+
+
+def cell_bounds(zoom, cell_x, cell_y, cells=CELLS_PER_TILE):
+    """Границы ячейки (или тайла при cells=1): (мин. широта, макс. широта, мин. долгота, макс. долгота)"""
+    n = (1 << zoom) * cells
+
+    def latitude(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return latitude(cell_y + 1), latitude(cell_y), cell_x / n * 360.0 - 180.0, (cell_x + 1) / n * 360.0 - 180.0
+
+
+def stored_zooms():
+    """Масштабы, ячейки которых хранятся в MapGridCell"""
+    return range(min(settings.MAP_GRID_MIN_ZOOM, settings.MAP_CLUSTER_MAX_ZOOM), settings.MAP_CLUSTER_MAX_ZOOM + 1)
+
+
+def cells_for(latitude, longitude):
+    """Ячейки точки на всех масштабах: [(zoom, cell_x, cell_y), ...]"""
+    x, y = world_position(latitude, longitude)
+    result = []
+    for zoom in stored_zooms():
+        n = (1 << zoom) * CELLS_PER_TILE
+        result.append((zoom, int(x * n), int(y * n)))
+    return result
+
+
+def _deltas(points):
+    """Суммирует точки [(id, широта, долгота)] по ячейкам"""
+    deltas = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    for pereval_id, latitude, longitude in points:
+        if latitude is None or longitude is None:
+            continue
+        for cell in cells_for(latitude, longitude):
+            delta = deltas[cell]
+            delta[0] += 1
+            delta[1] += latitude
+            delta[2] += longitude
+            delta[3] = max(delta[3], pereval_id)
+    return deltas
+
+
+def add_points(points):
+    """Учитывает новые перевалы [(id, широта, долгота)] во всех ячейках одним INSERT ... ON CONFLICT"""
+    deltas = _deltas(points)
+    if not deltas:
+        return
+    with connection.cursor() as cursor:
+        _merge_cells(cursor, [(zoom, cx, cy, *delta) for (zoom, cx, cy), delta in deltas.items()])
+
+
+def _upsert_sql(source):
+    """INSERT ячеек из source (VALUES или SELECT) с прибавлением к существующим"""
+    from .models import MapGridCell
+
+    table = MapGridCell._meta.db_table
+    return (
+        f'INSERT INTO {table} (zoom, cell_x, cell_y, count, sum_latitude, sum_longitude, representative_id) '
+        f'{source} ON CONFLICT (zoom, cell_x, cell_y) DO UPDATE SET '
+        f'count = {table}.count + EXCLUDED.count, '
+        f'sum_latitude = {table}.sum_latitude + EXCLUDED.sum_latitude, '
+        f'sum_longitude = {table}.sum_longitude + EXCLUDED.sum_longitude, '
+        f'representative_id = GREATEST({table}.representative_id, EXCLUDED.representative_id)'
+    )
+
+
+def _merge_cells(cursor, rows):
+    """Прибавляет строки [(zoom, x, y, count, сумма широт, сумма долгот, представитель)] к сетке"""
+    if rows:
+        values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(rows))
+        cursor.execute(_upsert_sql(f'VALUES {values}'), [v for row in rows for v in row])
+
+
+def remove_points(points):
+    """Убирает перевалы [(id, широта, долгота)] из ячеек; представитель ячейки выбирается заново"""
+    from .models import MapGridCell, PerevalAdded
+    from .sharding import scatter
+
+    deltas = _deltas(points)
+    if not deltas:
+        return
+    removed_ids = [pereval_id for pereval_id, _, _ in points]
+    table = MapGridCell._meta.db_table
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(deltas))
+    params = [
+        v for (zoom, cx, cy), (count, lat, lon, _) in deltas.items() for v in (zoom, cx, cy, count, lat, lon)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} c SET count = c.count - d.count, '
+            f'sum_latitude = c.sum_latitude - d.lat, sum_longitude = c.sum_longitude - d.lon '
+            f'FROM (VALUES {values}) AS d (zoom, cell_x, cell_y, count, lat, lon) '
+            f'WHERE c.zoom = d.zoom AND c.cell_x = d.cell_x AND c.cell_y = d.cell_y',
+            params,
+        )
+        cursor.execute(f'DELETE FROM {table} WHERE count <= 0')
+
+    # Представитель меняется, только если удалён сам представитель (обычно это самый новый перевал)
+    stale = (
+        MapGridCell.objects.filter(representative_id__in=removed_ids)
+        .values_list('id', 'zoom', 'cell_x', 'cell_y')
+    )
+    for cell_id, zoom, cell_x, cell_y in stale:
+        min_lat, max_lat, min_lon, max_lon = cell_bounds(zoom, cell_x, cell_y)
+        candidates = scatter(lambda: (
+            PerevalAdded.objects
+            .filter(latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon))
+            .exclude(id__in=removed_ids)
+            .aggregate(id=Max('id'))['id']
+        ))
+        representative = max((pk for pk in candidates.values() if pk is not None), default=0)
+        MapGridCell.objects.filter(id=cell_id).update(representative_id=representative)
+
+
+def move_point(pereval_id, old, new):
+    """Перевал сменил координаты: old и new — пары (широта, долгота)"""
+    if old == new:
+        return
+    remove_points([(pereval_id, *old)])
+    add_points([(pereval_id, *new)])
+
+
+def rebuild_grid():
+    """Пересчитывает сетку целиком по pereval_perevaladded; возвращает число ячеек"""
+    from .models import MapGridCell, PerevalAdded
+
+    table = MapGridCell._meta.db_table
+    source = PerevalAdded._meta.db_table
+    lat = f'GREATEST(LEAST(latitude, {MAX_LATITUDE}), -{MAX_LATITUDE})'
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}')
+        for alias in settings.DATABASE_SHARDS:
+            for zoom in stored_zooms():
+                n = (1 << zoom) * CELLS_PER_TILE
+                select = (
+                    f'SELECT %s, LEAST(floor((longitude + 180) / 360 * %s), %s - 1), '
+                    f'LEAST(floor((0.5 - ln((1 + sin(radians({lat}))) / (1 - sin(radians({lat})))) / (4 * pi())) * %s), %s - 1), '
+                    f'count(*), sum(latitude), sum(longitude), max(id) '
+                    f'FROM {source} WHERE latitude IS NOT NULL AND longitude IS NOT NULL GROUP BY 2, 3'
+                )
+                params = [zoom, n, n, n, n]
+                if alias == 'default':
+                    cursor.execute(_upsert_sql(select), params)
+                else:
+                    # Ячейки шарда считаются в шарде и прибавляются к сетке в основной БД
+                    with connections[alias].cursor() as shard_cursor:
+                        shard_cursor.execute(select, params)
+                        _merge_cells(cursor, shard_cursor.fetchall())
+        cursor.execute(f'SELECT count(*) FROM {table}')
+        return cursor.fetchone()[0]
+
+
+def get_tile(zoom, x, y):
+    """Кластеры тайла: [{'latitude', 'longitude', 'count', 'id'}]"""
+    from .models import MapGridCell, PerevalAdded
+    from .sharding import scatter
+
+    if zoom > settings.MAP_CLUSTER_MAX_ZOOM:
+        min_lat, max_lat, min_lon, max_lon = cell_bounds(zoom, x, y, cells=1)
+        # Тайл может захватить регионы разных шардов: берутся самые новые точки всех шардов
+        pages = scatter(lambda: list(
+            PerevalAdded.objects
+            .filter(latitude__gte=min_lat, latitude__lt=max_lat, longitude__gte=min_lon, longitude__lt=max_lon)
+            .order_by('-id')
+            .values_list('id', 'latitude', 'longitude')[:settings.MAP_TILE_MAX_POINTS]
+        ))
+        points = sorted((point for page in pages.values() for point in page), reverse=True)
+        return [
+            {'latitude': lat, 'longitude': lon, 'count': 1, 'id': pk}
+            for pk, lat, lon in points[:settings.MAP_TILE_MAX_POINTS]
+        ]
+
+    base = stored_zooms()[0]
+    if zoom >= base:
+        cells = (
+            MapGridCell.objects
+            .filter(
+                zoom=zoom,
+                cell_x__range=(x * CELLS_PER_TILE, x * CELLS_PER_TILE + CELLS_PER_TILE - 1),
+                cell_y__range=(y * CELLS_PER_TILE, y * CELLS_PER_TILE + CELLS_PER_TILE - 1),
+            )
+            .order_by('cell_y', 'cell_x')
+            .values_list('count', 'sum_latitude', 'sum_longitude', 'representative_id')
+        )
+    else:
+        # Ячейка масштаба zoom объединяет 2^shift x 2^shift ячеек нижнего хранимого масштаба
+        shift = base - zoom
+        first, last = (x * CELLS_PER_TILE) << shift, ((x + 1) * CELLS_PER_TILE << shift) - 1
+        top, bottom = (y * CELLS_PER_TILE) << shift, ((y + 1) * CELLS_PER_TILE << shift) - 1
+        cells = (
+            MapGridCell.objects
+            .filter(zoom=base, cell_x__range=(first, last), cell_y__range=(top, bottom))
+            .values(group_x=F('cell_x').bitrightshift(shift), group_y=F('cell_y').bitrightshift(shift))
+            .annotate(
+                total=Sum('count'), total_latitude=Sum('sum_latitude'), total_longitude=Sum('sum_longitude'),
+                representative=Max('representative_id'),
+            )
+            .order_by('group_y', 'group_x')
+            .values_list('total', 'total_latitude', 'total_longitude', 'representative')
+        )
+    return [
+        {'latitude': sum_lat / count, 'longitude': sum_lon / count, 'count': count, 'id': representative}
+        for count, sum_lat, sum_lon, representative in cells
+    ]
+
+
+def encode_tile(zoom, x, y, clusters):
+    """Компактное бинарное представление тайла (16 байт на кластер)"""
+    n = 1 << zoom
+    parts = [BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(clusters))]
+    for cluster in clusters:
+        wx, wy = world_position(cluster['latitude'], cluster['longitude'])
+        px = min(max(int((wx * n - x) * 65536), 0), 65535)
+        py = min(max(int((wy * n - y) * 65536), 0), 65535)
+        parts.append(BINARY_CLUSTER.pack(px, py, cluster['count'], cluster['id']))
+    return b''.join(parts)
+
+
+def decode_tile(data):
+    """Обратное к encode_tile: [(позиция x, позиция y, количество, id)]"""
+    magic, version, count = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError('Неизвестный формат тайла')
+    return [BINARY_CLUSTER.unpack_from(data, BINARY_HEADER.size + i * BINARY_CLUSTER.size) for i in range(count)]
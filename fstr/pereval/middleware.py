@@ -0,0 +1,156 @@
+import random
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+
+from .compression import get_cache, is_compressible, negotiate
+from .logs import QueryTimer, access_logger, bind_request, mask_pii
+from .routers import use_primary
+
+PRIMARY_PIN_COOKIE = 'fstr_primary'
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Закрепляет запрос за основной БД, если это запись (POST, PATCH и т.д.)
+    или если клиент недавно что-то записал: после успешной записи выставляется
+    cookie на READ_YOUR_WRITES_SECONDS секунд, и пока она жива, GET-запросы
+    клиента читают из основной БД и видят собственные изменения.
+    Представления с атрибутом read_only = True (например, POST-мультиget
+    /api/submitData/batch/) ничего не пишут и клиента не закрепляют.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        is_write = request.method not in ('GET', 'HEAD', 'OPTIONS') and not self.is_read_only(request)
+
+        if not (is_write or PRIMARY_PIN_COOKIE in request.COOKIES):
+            return self.get_response(request)
+
+        with use_primary():
+            response = self.get_response(request)
+
+        if is_write and response.status_code < 400:
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE, '1',
+                max_age=settings.READ_YOUR_WRITES_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    @staticmethod
+    def is_read_only(request):
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return False
+        view = getattr(match.func, 'view_class', match.func)
+        return getattr(view, 'read_only', False)
+
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы API gzip или brotli (см. pereval.compression), если клиент
+    их принимает и тело не меньше COMPRESSION_MIN_SIZE байт. ETag сжатого
+    ответа становится слабым, как в django.middleware.gzip.GZipMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not settings.COMPRESSION_ENABLED or response.streaming or response.status_code != 200:
+            return response
+        if not is_compressible(response.get('Content-Type', '')):
+            return response
+
+        # Ответ зависит от Accept-Encoding, даже если он отдан без сжатия
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.has_header('Content-Encoding') or len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return response
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressed = get_cache().get_or_compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+def _response_id(response):
+    data = getattr(response, 'data', None)
+    return data.get('id') if isinstance(data, dict) else None
+
+
+class AccessLogMiddleware:
+    """
+    Журнал запросов в JSON (логгер pereval.access, см. pereval.logs): маршрут,
+    статус, длительность, время и число запросов к БД. Стоит первым в MIDDLEWARE,
+    чтобы длительность включала остальные middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.LOG_ACCESS_ENABLED:
+            return self.get_response(request)
+
+        # Идентификатор от балансировщика сохраняется, чтобы связать его журнал с нашим
+        request.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+        request.log_fields = {}
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack, bind_request(request):
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        duration_ms = (time.perf_counter() - started) * 1000
+        response['X-Request-ID'] = request.request_id
+
+        match = request.resolver_match
+        route = match.url_name if match is not None else None
+        rate = settings.LOG_SAMPLE_RATES.get(route, 1.0)
+        always = response.status_code >= 400 or duration_ms >= settings.LOG_SLOW_MS
+        if not always and rate < 1.0 and random.random() >= rate:
+            return response
+
+        fields = {
+            'event': 'http.request',
+            'request_id': request.request_id,
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'db_ms': round(timer.seconds * 1000, 2),
+            'db_queries': timer.count,
+            'pereval_id': match.kwargs.get('pk') if match is not None else None,
+            'email': request.GET.get('user__email'),
+            'sample_rate': 1.0 if always else rate,
+        }
+        fields.update(request.log_fields)
+        if fields['pereval_id'] is None:
+            fields['pereval_id'] = _response_id(response)
+        # В журнал запросов адрес автора попадает только в маскированном виде, как и в аудит
+        fields['email'] = mask_pii(fields['email'])
+        access_logger.info('%s %s %s', request.method, request.path, response.status_code, extra={'fields': fields})
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0002_alter_perevaluser_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['status', 'add_time'], name='pereval_status_time_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0003_perevaladded_status_time_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerevalArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('beauty_title', models.CharField(max_length=100)),
+                ('title', models.CharField(max_length=100)),
+                ('other_titles', models.CharField(blank=True, max_length=255)),
+                ('connect', models.TextField(blank=True)),
+                ('add_time', models.DateTimeField()),
+                ('level_winter', models.CharField(blank=True, max_length=3)),
+                ('level_summer', models.CharField(blank=True, max_length=3)),
+                ('level_autumn', models.CharField(blank=True, max_length=3)),
+                ('level_spring', models.CharField(blank=True, max_length=3)),
+                ('status', models.CharField(choices=[('new', 'Новая'), ('pending', 'На модерации'), ('accepted', 'Принята'), ('rejected', 'Отклонена')], max_length=10)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('height', models.IntegerField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_perevals', to='pereval.perevaluser')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PerevalImageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=100)),
+                ('image_url', models.URLField()),
+                ('pereval', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='pereval.perevalarchive')),
+            ],
+        ),
+    ]
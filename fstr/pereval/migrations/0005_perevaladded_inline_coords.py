@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0004_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevaladded',
+            name='height',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='perevaladded',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='perevaladded',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='perevaladded',
+            name='coords',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pereval', to='pereval.perevalcoords'),
+        ),
+    ]
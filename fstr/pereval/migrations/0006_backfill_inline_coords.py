@@ -0,0 +1,68 @@
+"""
+Копирует координаты из pereval_perevalcoords в поля pereval_perevaladded.
+
+Миграция неатомарная: каждая пачка из BATCH_SIZE строк обновляется отдельным
+коротким UPDATE, поэтому рабочая таблица не блокируется надолго. Индекс по
+координатам строится CONCURRENTLY (на секционированной таблице это невозможно,
+там используется обычный CREATE INDEX).
+"""
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_coords(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM pereval_perevaladded')
+        low, high = cursor.fetchone()
+        for start in range(low, high + 1, BATCH_SIZE):
+            cursor.execute(
+                'UPDATE pereval_perevaladded p '
+                'SET latitude = c.latitude, longitude = c.longitude, height = c.height '
+                'FROM pereval_perevalcoords c '
+                'WHERE c.id = p.coords_id AND p.latitude IS NULL AND p.id >= %s AND p.id < %s',
+                [start, start + BATCH_SIZE],
+            )
+
+
+def create_coords_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'pereval_perevaladded')"
+        )
+        concurrently = '' if cursor.fetchone()[0] else 'CONCURRENTLY '
+        cursor.execute(
+            f'CREATE INDEX {concurrently}IF NOT EXISTS pereval_lat_lon_idx '
+            f'ON pereval_perevaladded (latitude, longitude)'
+        )
+
+
+def drop_coords_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS pereval_lat_lon_idx')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('pereval', '0005_perevaladded_inline_coords'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_coords, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_coords_index, drop_coords_index),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='perevaladded',
+                    index=models.Index(fields=['latitude', 'longitude'], name='pereval_lat_lon_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0006_backfill_inline_coords'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevaladded',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0007_perevaladded_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevaladded',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['user', 'updated_at'], name='pereval_user_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0008_perevaladded_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='perevalarchive',
+            index=models.Index(fields=['user', 'archived_at'], name='pereval_archive_user_idx'),
+        ),
+    ]
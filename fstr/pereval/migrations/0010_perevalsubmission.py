@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:13
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0009_perevalarchive_user_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerevalSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tracking_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('payload', models.JSONField()),
+                ('state', models.CharField(choices=[('queued', 'В очереди'), ('done', 'Сохранена'), ('failed', 'Ошибка')], default='queued', max_length=10)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('pereval_id', models.BigIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['state', 'received_at'], name='pereval_submission_state_idx'), models.Index(fields=['processed_at'], name='pereval_submission_done_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0011_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevalimage',
+            name='checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='perevalimage',
+            name='thumbnail',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='perevalimage',
+            name='url_error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='perevalimage',
+            name='url_status',
+            field=models.CharField(blank=True, choices=[('', 'Не проверено'), ('ok', 'Доступно'), ('broken', 'Недоступно')], default='', max_length=10),
+        ),
+    ]
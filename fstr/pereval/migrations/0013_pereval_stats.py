@@ -0,0 +1,52 @@
+from django.db import migrations
+
+# SQL зафиксирован на момент миграции: pereval.stats может меняться
+CREATE_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS pereval_stats AS
+SELECT
+    CASE
+        WHEN GROUPING(status) = 0 THEN 'status'
+        WHEN GROUPING(level_winter) = 0 THEN 'level_winter'
+        WHEN GROUPING(level_summer) = 0 THEN 'level_summer'
+        WHEN GROUPING(level_autumn) = 0 THEN 'level_autumn'
+        WHEN GROUPING(level_spring) = 0 THEN 'level_spring'
+        WHEN GROUPING(height) = 0 THEN 'height'
+        WHEN GROUPING(region) = 0 THEN 'region'
+        ELSE 'total'
+    END AS dimension,
+    COALESCE(status, level_winter, level_summer, level_autumn, level_spring, height, region, '') AS value,
+    count(*) AS total,
+    now() AS refreshed_at
+FROM (
+    SELECT
+        status AS status,
+        level_winter AS level_winter,
+        level_summer AS level_summer,
+        level_autumn AS level_autumn,
+        level_spring AS level_spring,
+        CASE WHEN height IS NULL THEN '' ELSE
+            (floor(height / 500.0)::int * 500)::text || '-' || (floor(height / 500.0)::int * 500 + 500 - 1)::text
+        END AS height,
+        CASE WHEN latitude IS NULL THEN '' ELSE
+            lpad(abs(floor(latitude / 1)::int * 1)::text, 2, '0') ||
+            CASE WHEN latitude >= 0 THEN 'N' ELSE 'S' END ||
+            lpad(abs(floor(longitude / 1)::int * 1)::text, 3, '0') ||
+            CASE WHEN longitude >= 0 THEN 'E' ELSE 'W' END
+        END AS region
+    FROM pereval_perevaladded
+) p
+GROUP BY GROUPING SETS ((status), (level_winter), (level_summer), (level_autumn), (level_spring), (height), (region), ())
+"""
+CREATE_INDEX_SQL = "CREATE UNIQUE INDEX IF NOT EXISTS pereval_stats_key ON pereval_stats (dimension, value)"
+DROP_VIEW_SQL = "DROP MATERIALIZED VIEW IF EXISTS pereval_stats"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0012_perevalimage_check'),
+    ]
+
+    operations = [
+        migrations.RunSQL([CREATE_VIEW_SQL, CREATE_INDEX_SQL], DROP_VIEW_SQL),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:21
+
+from django.db import migrations, models
+
+
+def build_grid(apps, schema_editor):
+    # Сетка — производные данные, она строится по уже существующим перевалам
+    from pereval.mapgrid import rebuild_grid
+    rebuild_grid()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0013_pereval_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapGridCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('cell_x', models.IntegerField()),
+                ('cell_y', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('sum_latitude', models.FloatField(default=0)),
+                ('sum_longitude', models.FloatField(default=0)),
+                ('representative_id', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('zoom', 'cell_x', 'cell_y'), name='pereval_mapgrid_cell_uniq')],
+            },
+        ),
+        migrations.RunPython(build_grid, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0014_mapgridcell'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['status', '-id'], include=('level_winter', 'level_summer', 'level_autumn', 'level_spring', 'height'), name='pereval_browse_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(condition=models.Q(('status', 'accepted')), fields=['height', '-id'], name='pereval_accepted_height_idx'),
+        ),
+    ]
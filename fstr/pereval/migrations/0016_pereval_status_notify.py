@@ -0,0 +1,29 @@
+from django.db import migrations
+
+# SQL зафиксирован на момент миграции: pereval.events может меняться
+CREATE_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION pereval_notify_status() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('pereval_status', json_build_object(
+        'id', NEW.id, 'status', NEW.status, 'version', NEW.version,
+        'email', (SELECT email FROM pereval_perevaluser WHERE id = NEW.user_id))::text);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql
+"""
+CREATE_TRIGGER_SQL = """
+CREATE OR REPLACE TRIGGER pereval_status_notify AFTER UPDATE OF status ON pereval_perevaladded
+FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status) EXECUTE FUNCTION pereval_notify_status()
+"""
+DROP_TRIGGER_SQL = "DROP TRIGGER IF EXISTS pereval_status_notify ON pereval_perevaladded"
+DROP_FUNCTION_SQL = "DROP FUNCTION IF EXISTS pereval_notify_status()"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0015_perevaladded_browse_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL([CREATE_FUNCTION_SQL, CREATE_TRIGGER_SQL], [DROP_TRIGGER_SQL, DROP_FUNCTION_SQL]),
+    ]
@@ -1,6 +1,16 @@
-from django.db import models
+import uuid
+from datetime import timedelta
+
+from django.db import connections, models, router
+from django.db.models import F, Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 
+from . import mapgrid
+from .logs import audit
+from .sharding import shard_for_pk, use_shard
+
 class PerevalUser(models.Model):
     email = models.EmailField(unique=True)
     fam = models.CharField(max_length=100)
@@ -19,6 +29,52 @@ class PerevalCoords(models.Model):
     def __str__(self):
         return f"Широта: {self.latitude}, Долгота: {self.longitude}, Высота: {self.height}"
 
+class PerevalQuerySet(models.QuerySet):
+    def recent(self, days=90):
+        """Записи за последние days дней.
+
+        Условие по add_time позволяет PostgreSQL читать только нужные секции,
+        если таблица секционирована (см. pereval.partitioning).
+        """
+        return self.filter(add_time__gte=timezone.now() - timedelta(days=days))
+
+    def awaiting_moderation(self, days=90):
+        """Недавние записи, ожидающие модерации (статусы new и pending)"""
+        return self.recent(days).filter(status__in=['new', 'pending'])
+
+    def touch(self, **fields):
+        """Обновляет поля одним UPDATE, увеличивая version и updated_at"""
+        return self.update(version=F('version') + 1, updated_at=timezone.now(), **fields)
+
+    def touch_returning(self, old_fields, **fields):
+        """
+        Как touch, но возвращает прежние значения old_fields изменённых строк: [{поле: значение}].
+        Один запрос UPDATE ... FROM (SELECT ... FOR UPDATE) RETURNING: подзапрос видит строку до изменения.
+        """
+        connection = connections[self._db or router.db_for_write(self.model)]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        locked = self.select_for_update().values(meta.pk.attname, *old_fields)
+        subquery, params = locked.query.get_compiler(connection=connection).as_sql()
+        values = {'updated_at': timezone.now(), **fields}
+        assignments = ', '.join(
+            [f'{qn("version")} = t.{qn("version")} + 1']
+            + [f'{qn(meta.get_field(name).column)} = %s' for name in values]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {qn(meta.db_table)} AS t SET {assignments} FROM ({subquery}) AS old '
+                f'WHERE t.{qn(meta.pk.column)} = old.{qn(meta.pk.attname)} RETURNING old.*',
+                [*(meta.get_field(name).get_db_prep_save(value, connection) for name, value in values.items()),
+                 *params],
+            )
+            columns = [column.name for column in cursor.description]
+            return [
+                {name: row[columns.index(name)] for name in old_fields}
+                for row in cursor.fetchall()
+            ]
+
+
 class PerevalAdded(models.Model):
     STATUS_CHOICES = [
         ('new', 'Новая'),
@@ -37,17 +93,253 @@ class PerevalAdded(models.Model):
     level_autumn = models.CharField(max_length=3, blank=True)
     level_spring = models.CharField(max_length=3, blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='new')
+    # Увеличиваются при каждом изменении записи, её статуса или изображений;
+    # используются в ETag / If-Match и Last-Modified
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    # Координаты хранятся в самой записи, чтобы чтение обходилось без JOIN.
+    # Таблица PerevalCoords заполняется только при INLINE_COORDS=False
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
 
     user = models.ForeignKey(PerevalUser, on_delete=models.CASCADE, related_name='perevals')
-    coords = models.OneToOneField(PerevalCoords, on_delete=models.CASCADE, related_name='pereval')
+    coords = models.OneToOneField(
+        PerevalCoords, on_delete=models.CASCADE, related_name='pereval', null=True, blank=True
+    )
+
+    objects = PerevalQuerySet.as_manager()
+
+    # Статус на момент загрузки из БД: смена статуса пишется в журнал аудита
+    _loaded_status = None
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'add_time'], name='pereval_status_time_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='pereval_lat_lon_idx'),
+            models.Index(fields=['user', 'updated_at'], name='pereval_user_updated_idx'),
+            # Каталог (pereval.catalog): страницы по id внутри статуса; столбцы фасетов включены
+            # в индекс, чтобы счётчики считались сканированием только индекса
+            models.Index(
+                fields=['status', '-id'], name='pereval_browse_idx',
+                include=['level_winter', 'level_summer', 'level_autumn', 'level_spring', 'height'],
+            ),
+            models.Index(
+                fields=['height', '-id'], name='pereval_accepted_height_idx', condition=Q(status='accepted')
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Запись, созданная со ссылкой на PerevalCoords, получает копию координат
+        if self.latitude is None and self.coords_id:
+            self.latitude = self.coords.latitude
+            self.longitude = self.coords.longitude
+            self.height = self.coords.height
+        # Любое сохранение существующей записи (PATCH, модерация в админке) — новая версия
+        adding = self._state.adding
+        old_position = None
+        if not adding:
+            self.version = (self.version or 0) + 1
+            self.updated_at = timezone.now()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None or {'latitude', 'longitude'} & set(update_fields):
+                old_position = PerevalAdded.objects.filter(pk=self.pk).values_list('latitude', 'longitude').first()
+        super().save(*args, **kwargs)
+
+        # Кластеры карты (см. pereval.mapgrid)
+        if adding:
+            mapgrid.add_points([(self.pk, self.latitude, self.longitude)])
+        elif old_position is not None:
+            mapgrid.move_point(self.pk, old_position, (self.latitude, self.longitude))
+
+        if not adding and self._loaded_status is not None and self.status != self._loaded_status:
+            audit('pereval.status', using=self._state.db, id=self.pk,
+                  status_from=self._loaded_status, status_to=self.status, version=self.version)
+        from .jobs import enqueue_snapshot_rebuild, enqueue_stats_refresh
+        # Принятые перевалы отдаются из снимка (см. pereval.snapshot)
+        if not adding and 'accepted' in (self._loaded_status, self.status):
+            enqueue_snapshot_rebuild(using=self._state.db)
+        # Счётчики статистики (см. pereval.stats) меняются от нового перевала и от правки
+        enqueue_stats_refresh(using=self._state.db)
+        self._loaded_status = self.status
 
     def __str__(self):
         return f"{self.beauty_title} {self.title} ({self.add_time.strftime('%Y-%m-%d')})"
 
+@receiver(post_delete, sender=PerevalAdded)
+def pereval_deleted(sender, instance, using, **kwargs):
+    from .jobs import enqueue_snapshot_rebuild, enqueue_stats_refresh
+    # Удалённый принятый перевал не должен отдаваться из снимка (в том числе после удаления в админке)
+    if instance.status == 'accepted':
+        enqueue_snapshot_rebuild(using=using)
+    enqueue_stats_refresh(using=using)
+
+
 class PerevalImage(models.Model):
+    URL_STATUS_CHOICES = [
+        ('', 'Не проверено'),
+        ('ok', 'Доступно'),
+        ('broken', 'Недоступно'),
+    ]
+
     pereval = models.ForeignKey('PerevalAdded', on_delete=models.CASCADE, related_name='images')
     title = models.CharField(max_length=100)
     image_url = models.URLField()
+    # Заполняются задачей check_images (см. pereval.images)
+    url_status = models.CharField(max_length=10, choices=URL_STATUS_CHOICES, default='', blank=True)
+    url_error = models.CharField(max_length=255, blank=True)
+    thumbnail = models.CharField(max_length=100, blank=True)
+    checked_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.title} - {self.image_url}"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.touch_pereval()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.touch_pereval()
+        return result
+
+    def touch_pereval(self):
+        """Новая версия перевала; у принятого перевала заодно устаревает снимок"""
+        with use_shard(shard_for_pk(self.pereval_id)):
+            alias = router.db_for_write(PerevalAdded)
+        pereval = PerevalAdded.objects.using(alias).filter(pk=self.pereval_id)
+        pereval.touch()
+        if pereval.filter(status='accepted').exists():
+            from .jobs import enqueue_snapshot_rebuild
+            enqueue_snapshot_rebuild(using=alias)
+
+
+class PerevalArchive(models.Model):
+    """Перевал, перенесённый из рабочих таблиц архиватором (см. pereval.archive).
+
+    id совпадает с id исходной записи PerevalAdded, координаты хранятся в самой записи.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    beauty_title = models.CharField(max_length=100)
+    title = models.CharField(max_length=100)
+    other_titles = models.CharField(max_length=255, blank=True)
+    connect = models.TextField(blank=True)
+    add_time = models.DateTimeField()
+    level_winter = models.CharField(max_length=3, blank=True)
+    level_summer = models.CharField(max_length=3, blank=True)
+    level_autumn = models.CharField(max_length=3, blank=True)
+    level_spring = models.CharField(max_length=3, blank=True)
+    status = models.CharField(max_length=10, choices=PerevalAdded.STATUS_CHOICES)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    height = models.IntegerField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    user = models.ForeignKey(PerevalUser, on_delete=models.CASCADE, related_name='archived_perevals')
+
+    class Meta:
+        indexes = [
+            # Выборка удалённых из рабочих таблиц записей для синхронизации клиентов
+            models.Index(fields=['user', 'archived_at'], name='pereval_archive_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.beauty_title} {self.title} (архив)"
+
+
+class PerevalImageArchive(models.Model):
+    pereval = models.ForeignKey(PerevalArchive, on_delete=models.CASCADE, related_name='images')
+    title = models.CharField(max_length=100)
+    image_url = models.URLField()
+
+    def __str__(self):
+        return f"{self.title} - {self.image_url}"
+
+
+class PerevalSubmission(models.Model):
+    """Заявка на добавление перевала, принятая в режиме ASYNC_INGEST (см. pereval.ingest).
+
+    Запрос сохраняет только проверенный payload; записи PerevalAdded создаются
+    фоновым обработчиком пачками.
+    """
+    STATE_CHOICES = [
+        ('queued', 'В очереди'),
+        ('done', 'Сохранена'),
+        ('failed', 'Ошибка'),
+    ]
+
+    tracking_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    payload = models.JSONField()
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='queued')
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    pereval_id = models.BigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Выборка очереди и метрики (глубина, скорость разбора)
+            models.Index(fields=['state', 'received_at'], name='pereval_submission_state_idx'),
+            models.Index(fields=['processed_at'], name='pereval_submission_done_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tracking_id} ({self.state})"
+
+
+class BackgroundJob(models.Model):
+    """Фоновая задача, выполняемая командой run_jobs (см. pereval.jobs)"""
+    STATE_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Выборка готовых к запуску задач
+            models.Index(fields=['state', 'run_after'], name='pereval_job_state_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.state})"
+
+
+class MapGridCell(models.Model):
+    """Ячейка сетки кластеров карты на масштабе zoom (см. pereval.mapgrid)"""
+    zoom = models.PositiveSmallIntegerField()
+    cell_x = models.IntegerField()
+    cell_y = models.IntegerField()
+    count = models.IntegerField(default=0)
+    sum_latitude = models.FloatField(default=0)
+    sum_longitude = models.FloatField(default=0)
+    representative_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Используется и для ON CONFLICT, и для выборки ячеек тайла
+            models.UniqueConstraint(fields=['zoom', 'cell_x', 'cell_y'], name='pereval_mapgrid_cell_uniq'),
+        ]
+
+    def __str__(self):
+        return f"z{self.zoom} ({self.cell_x}, {self.cell_y}): {self.count}"
@@ -0,0 +1,167 @@
+"""
+Секционирование таблицы перевалов по add_time (PostgreSQL, PARTITION BY RANGE).
+
+Таблица pereval_perevaladded превращается в секционированную по месяцам:
+секция pereval_perevaladded_pYYYY_MM на каждый месяц и секция DEFAULT для
+записей вне созданных диапазонов. Запросы с условием на add_time
+(PerevalAdded.objects.recent(), фильтр по дате в админке) читают только
+нужные секции.
+
+Ограничения секционированной таблицы PostgreSQL:
+- первичный ключ и уникальные индексы должны включать add_time, поэтому
+  PK становится (id, add_time), а уникальность coords_id — (coords_id, add_time);
+- на неё нельзя сослаться внешним ключом по одному id, поэтому FK из
+  pereval_perevalimage удаляется; каскадное удаление выполняет Django ORM.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+from .events import create_trigger as create_status_trigger
+from .models import PerevalAdded, PerevalCoords, PerevalUser
+from .stats import create_view as create_stats_view
+
+TABLE = PerevalAdded._meta.db_table
+LEGACY_TABLE = f'{TABLE}_legacy'
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start.year:04d}_{start.month:02d}'
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s)",
+        [TABLE],
+    )
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor):
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = %s ORDER BY c.relname",
+        [TABLE],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_month_partition(cursor, start):
+    """Создаёт секцию на месяц, начинающийся в start; возвращает False, если она уже есть.
+
+    Строки этого месяца, попавшие в секцию DEFAULT, переносятся в новую секцию.
+    """
+    name = partition_name(start)
+    if name in list_partitions(cursor):
+        return False
+
+    end = add_months(start, 1)
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE add_time >= %s AND add_time < %s)',
+        [start, end],
+    )
+    has_default_rows = cursor.fetchone()[0]
+
+    if has_default_rows:
+        # PostgreSQL не даёт создать секцию, пока её строки лежат в DEFAULT
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"')
+
+    cursor.execute(
+        f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)',
+        [start, end],
+    )
+
+    if has_default_rows:
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE add_time >= %s AND add_time < %s RETURNING *) '
+            f'INSERT INTO "{TABLE}" SELECT * FROM moved',
+            [start, end],
+        )
+        cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{DEFAULT_PARTITION}" DEFAULT')
+    return True
+
+
+def ensure_partitions(months_ahead=3, start=None):
+    """Создаёт месячные секции от start (по умолчанию текущий месяц) на months_ahead месяцев вперёд"""
+    start = month_start(start or datetime.now(dt_timezone.utc))
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            raise RuntimeError(f'Таблица {TABLE} не секционирована, сначала выполните partition_perevals')
+        for offset in range(months_ahead + 1):
+            month = add_months(start, offset)
+            if create_month_partition(cursor, month):
+                created.append(partition_name(month))
+    return created
+
+
+def convert_to_partitioned(months_ahead=3):
+    """Переносит данные из обычной таблицы в секционированную.
+
+    Выполняется в одной транзакции: таблица блокируется на время копирования,
+    поэтому запускать команду нужно в окно обслуживания.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return []
+
+        # Отложенные проверки FK не дают удалить старую таблицу в той же транзакции
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'SELECT MIN(add_time) FROM "{TABLE}"')
+        first = cursor.fetchone()[0]
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY_TABLE}"')
+        cursor.execute(
+            f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY_TABLE}" INCLUDING DEFAULTS INCLUDING IDENTITY) '
+            f'PARTITION BY RANGE (add_time)'
+        )
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+
+        now = month_start(datetime.now(dt_timezone.utc))
+        month = month_start(first) if first else now
+        last = add_months(now, months_ahead)
+        created = []
+        while month <= last:
+            create_month_partition(cursor, month)
+            created.append(partition_name(month))
+            month = add_months(month, 1)
+
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{LEGACY_TABLE}"')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('\"{TABLE}\"', 'id'), "
+            f'COALESCE((SELECT MAX(id) FROM "{TABLE}"), 0) + 1, false)'
+        )
+        # CASCADE удаляет и внешний ключ pereval_perevalimage.pereval_id,
+        # и материализованное представление статистики, оно создаётся заново ниже
+        cursor.execute(f'DROP TABLE "{LEGACY_TABLE}" CASCADE')
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id, add_time)')
+        cursor.execute(f'CREATE UNIQUE INDEX "{TABLE}_coords_id_uniq" ON "{TABLE}" (coords_id, add_time)')
+        cursor.execute(f'CREATE INDEX "{TABLE}_user_id_idx" ON "{TABLE}" (user_id)')
+        # SQL индексов строит Django: сохраняются порядок столбцов, INCLUDE и условия частичных индексов
+        schema_editor = connection.schema_editor()
+        for index in PerevalAdded._meta.indexes:
+            cursor.execute(str(index.create_sql(PerevalAdded, schema_editor)))
+        for column, model in (('user_id', PerevalUser), ('coords_id', PerevalCoords)):
+            cursor.execute(
+                f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_{column}_fk" FOREIGN KEY ({column}) '
+                f'REFERENCES "{model._meta.db_table}" (id) DEFERRABLE INITIALLY DEFERRED'
+            )
+        create_stats_view(cursor)
+        create_status_trigger(cursor)
+        return created
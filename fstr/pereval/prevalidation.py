@@ -0,0 +1,190 @@
+"""
+Быстрая предварительная проверка тел POST и PATCH /api/submitData/.
+
+Схема запроса описана словарями (SUBMIT_SCHEMA, UPDATE_SCHEMA), длины строк
+берутся из полей моделей. Схема один раз компилируется в дерево функций-
+проверок, так что заведомо неверный запрос (не тот тип, пустые обязательные
+поля, слишком длинные строки, координаты вне диапазона, слишком много
+изображений) отклоняется без создания вложенных сериализаторов DRF.
+
+Проверка не строже сериализаторов: всё, что она пропускает, затем полностью
+проверяет PerevalAddedSerializer / PerevalUpdateSerializer. Ошибки имеют ту
+же структуру и те же тексты, что serializer.errors, поэтому ответ для клиента
+не зависит от того, на каком этапе отклонён запрос.
+"""
+
+from functools import lru_cache
+
+from django.conf import settings
+from rest_framework import fields as drf_fields
+from rest_framework import serializers as drf_serializers
+
+from .models import PerevalAdded, PerevalImage, PerevalUser
+
+LATITUDE_RANGE = (-90, 90)
+LONGITUDE_RANGE = (-180, 180)
+HEIGHT_RANGE = (-2147483648, 2147483647)
+
+_FIELD = drf_fields.Field.default_error_messages
+_CHAR = drf_fields.CharField.default_error_messages
+_FLOAT = drf_fields.FloatField.default_error_messages
+_INTEGER = drf_fields.IntegerField.default_error_messages
+_OBJECT = drf_serializers.Serializer.default_error_messages
+_LIST = drf_serializers.ListSerializer.default_error_messages
+MAX_STRING_LENGTH = drf_fields.FloatField.MAX_STRING_LENGTH
+
+
+def string(model, name):
+    """Строковое поле по описанию поля модели (max_length и blank)"""
+    field = model._meta.get_field(name)
+    return {'type': 'string', 'max_length': field.max_length, 'required': not field.blank}
+
+
+def number(value_range, integer=False):
+    return {'type': 'integer' if integer else 'number', 'range': value_range, 'required': True}
+
+
+def obj(fields, required=True):
+    return {'type': 'object', 'fields': fields, 'required': required}
+
+
+LEVEL_FIELDS = ['level_winter', 'level_summer', 'level_autumn', 'level_spring']
+
+USER_SCHEMA = obj({name: string(PerevalUser, name) for name in ['email', 'fam', 'name', 'otc', 'phone']})
+COORDS_SCHEMA = obj({
+    'latitude': number(LATITUDE_RANGE),
+    'longitude': number(LONGITUDE_RANGE),
+    'height': number(HEIGHT_RANGE, integer=True),
+})
+IMAGES_SCHEMA = {
+    'type': 'list',
+    'items': obj({name: string(PerevalImage, name) for name in ['title', 'image_url']}),
+    'required': True,
+}
+
+SUBMIT_SCHEMA = obj({
+    **{name: string(PerevalAdded, name) for name in ['beauty_title', 'title', 'other_titles', 'connect']},
+    **{name: string(PerevalAdded, name) for name in LEVEL_FIELDS},
+    'user': USER_SCHEMA,
+    'coords': COORDS_SCHEMA,
+    'images': IMAGES_SCHEMA,
+})
+
+# PATCH принимает level как объект {winter, summer, autumn, spring}; поля автора не меняются
+UPDATE_SCHEMA = obj({
+    **{name: field for name, field in SUBMIT_SCHEMA['fields'].items() if name != 'user'},
+    'level': obj({name[len('level_'):]: string(PerevalAdded, name) for name in LEVEL_FIELDS}),
+})
+
+
+def _compile_string(spec, partial):
+    max_length = spec['max_length']
+    allow_blank = not spec['required']
+
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return [str(_CHAR['invalid'])]
+        value = str(value).strip()
+        if not value and not allow_blank:
+            return [str(_CHAR['blank'])]
+        if max_length is not None and len(value) > max_length:
+            return [str(_CHAR['max_length']).format(max_length=max_length)]
+        return None
+    return check
+
+
+def _compile_number(spec, partial):
+    low, high = spec['range']
+    integer = spec['type'] == 'integer'
+    messages = _INTEGER if integer else _FLOAT
+
+    def check(value):
+        if isinstance(value, str):
+            if len(value) > MAX_STRING_LENGTH:
+                return [str(messages['max_string_length'])]
+            if integer:
+                return None  # строковые целые разбирает IntegerField
+        if integer:
+            if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                    or (isinstance(value, float) and not value.is_integer()):
+                return [str(messages['invalid'])]
+        try:
+            number_value = value if isinstance(value, int) and not isinstance(value, bool) else float(value)
+        except (TypeError, ValueError, OverflowError):
+            return [str(messages['invalid'])]
+        if not number_value >= low:
+            return [str(messages['min_value']).format(min_value=low)]
+        if not number_value <= high:
+            return [str(messages['max_value']).format(max_value=high)]
+        return None
+    return check
+
+
+def _compile_object(spec, partial):
+    checks = [
+        (name, compile_spec(field, partial), field['required'] and not partial)
+        for name, field in spec['fields'].items()
+    ]
+
+    def check(value):
+        if not isinstance(value, dict):
+            return {'non_field_errors': [str(_OBJECT['invalid']).format(datatype=type(value).__name__)]}
+        errors = {}
+        for name, field_check, required in checks:
+            if name not in value:
+                if required:
+                    errors[name] = [str(_FIELD['required'])]
+                continue
+            if value[name] is None:
+                errors[name] = [str(_FIELD['null'])]
+                continue
+            error = field_check(value[name])
+            if error:
+                errors[name] = error
+        return errors or None
+    return check
+
+
+def _compile_list(spec, partial):
+    item_check = compile_spec(spec['items'], partial)
+    max_items = spec.get('max_items')
+
+    def check(value):
+        if not isinstance(value, list):
+            return {'non_field_errors': [str(_LIST['not_a_list']).format(input_type=type(value).__name__)]}
+        if max_items is not None and len(value) > max_items:
+            return [str(_LIST['max_length']).format(max_length=max_items)]
+        errors = [item_check(item) or {} for item in value]
+        return errors if any(errors) else None
+    return check
+
+
+_COMPILERS = {
+    'string': _compile_string,
+    'number': _compile_number,
+    'integer': _compile_number,
+    'object': _compile_object,
+    'list': _compile_list,
+}
+
+
+def compile_spec(spec, partial=False):
+    """Превращает описание схемы в функцию value -> ошибки в формате serializer.errors или None"""
+    return _COMPILERS[spec['type']](spec, partial)
+
+
+@lru_cache(maxsize=None)
+def _validator(name, max_images):
+    schema = SUBMIT_SCHEMA if name == 'submit' else UPDATE_SCHEMA
+    schema = {**schema, 'fields': {**schema['fields'], 'images': {**IMAGES_SCHEMA, 'max_items': max_images}}}
+    return compile_spec(schema, partial=(name == 'update'))
+
+
+def validate_submit(data):
+    """Ошибки тела POST /api/submitData/ или None, если его можно передать сериализатору"""
+    return _validator('submit', settings.SUBMIT_MAX_IMAGES)(data)
+
+
+def validate_update(data):
+    """Ошибки тела PATCH /api/submitData/<id>/ (все поля необязательны) или None"""
+    return _validator('update', settings.SUBMIT_MAX_IMAGES)(data)
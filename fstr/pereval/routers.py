@@ -0,0 +1,55 @@
+"""
+Маршрутизация запросов между основной БД и репликами для чтения.
+
+Запись всегда идёт в 'default'. Чтение распределяется по репликам из
+settings.DATABASE_REPLICAS, кроме случаев, когда запрос закреплён за
+основной БД (см. pereval.middleware.ReplicaRoutingMiddleware).
+Перевалы в шардах (см. pereval.sharding) читаются и пишутся в свой шард.
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from .sharding import db_for_model
+
+_use_primary = ContextVar('use_primary', default=False)
+
+
+@contextmanager
+def use_primary():
+    """Направляет все запросы внутри блока в основную БД"""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def is_pinned_to_primary():
+    """Запрос внутри use_primary(): запись или чтение после недавней записи клиента"""
+    return _use_primary.get()
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        shard = db_for_model(model, hints)
+        if shard is not None:
+            return shard
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or _use_primary.get():
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return db_for_model(model, hints) or 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит через репликацию; шарды (shard1, shard2, ...) мигрируются как основная БД
+        return db == 'default' or db.startswith('shard')
@@ -1,5 +1,13 @@
+from django.conf import settings
+from django.db import router, transaction
+from django.urls import reverse
 from rest_framework import serializers
-from .models import PerevalUser, PerevalCoords, PerevalAdded, PerevalImage
+from . import mapgrid
+from .jobs import enqueue_image_check, enqueue_stats_refresh
+from .logs import audit
+from .models import PerevalUser, PerevalCoords, PerevalAdded, PerevalImage, PerevalArchive, PerevalImageArchive
+from .prevalidation import HEIGHT_RANGE, LATITUDE_RANGE, LONGITUDE_RANGE
+from .sharding import shard_for_coords, use_shard
 
 
 class PerevalUserSerializer(serializers.ModelSerializer):
@@ -24,27 +32,53 @@ class PerevalUserSerializer(serializers.ModelSerializer):
         return user
 
 
-class PerevalCoordsSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = PerevalCoords
-        fields = ['latitude', 'longitude', 'height']
+def validate_images_count(images):
+    """Не больше SUBMIT_MAX_IMAGES изображений у перевала"""
+    if images is not None and len(images) > settings.SUBMIT_MAX_IMAGES:
+        message = str(serializers.ListSerializer.default_error_messages['max_length'])
+        raise serializers.ValidationError(message.format(max_length=settings.SUBMIT_MAX_IMAGES))
+    return images
 
 
-class PerevalCoordsUpdateSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = PerevalCoords
-        fields = ['latitude', 'longitude', 'height']
+class PerevalCoordsSerializer(serializers.Serializer):
+    """
+    Вложенный объект coords. Координаты хранятся в полях PerevalAdded,
+    поэтому поле подключается с source='*' и не требует JOIN.
+    """
+    latitude = serializers.FloatField(min_value=LATITUDE_RANGE[0], max_value=LATITUDE_RANGE[1])
+    longitude = serializers.FloatField(min_value=LONGITUDE_RANGE[0], max_value=LONGITUDE_RANGE[1])
+    height = serializers.IntegerField(min_value=HEIGHT_RANGE[0], max_value=HEIGHT_RANGE[1])
+
+
+class PerevalCoordsUpdateSerializer(PerevalCoordsSerializer):
+    pass
 
 
 class PerevalImageSerializer(serializers.ModelSerializer):
+    thumbnail_url = serializers.SerializerMethodField()
+
     class Meta:
         model = PerevalImage
-        fields = ['title', 'image_url']
+        fields = ['title', 'image_url', 'thumbnail_url']
+
+    def get_thumbnail_url(self, obj):
+        if not obj.thumbnail:
+            return None
+        url = reverse('thumbnail', args=[obj.thumbnail])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def to_representation(self, instance):
+        # Миниатюра отдаётся только по запросу (?thumbnails=1), чтобы не менять привычный ответ
+        data = super().to_representation(instance)
+        if not self.context.get('thumbnails'):
+            data.pop('thumbnail_url')
+        return data
 
 
 class PerevalAddedSerializer(serializers.ModelSerializer):
     user = PerevalUserSerializer()
-    coords = PerevalCoordsSerializer()
+    coords = PerevalCoordsSerializer(source='*')
     images = PerevalImageSerializer(many=True)
 
     class Meta:
@@ -55,33 +89,44 @@ class PerevalAddedSerializer(serializers.ModelSerializer):
             'level_autumn', 'level_spring', 'images'
         ]
 
+    def validate_images(self, images):
+        return validate_images_count(images)
+
     def create(self, validated_data):
-        # Извлекаем вложенные данные
-        user_data = validated_data.pop('user')
-        coords_data = validated_data.pop('coords')
-        images_data = validated_data.pop('images')
+        # Перевал вместе с автором, координатами и изображениями сохраняется в шард своего региона
+        # Одна транзакция в БД шарда: при ошибке не остаётся перевала без изображений
+        with use_shard(shard_for_coords(validated_data['latitude'], validated_data['longitude'])), \
+                transaction.atomic(using=router.db_for_write(PerevalAdded)):
+            # Извлекаем вложенные данные
+            user_data = validated_data.pop('user')
+            images_data = validated_data.pop('images')
 
-        # Создаём или находим пользователя
-        user_serializer = PerevalUserSerializer(data=user_data)
-        user_serializer.is_valid(raise_exception=True)
-        user = user_serializer.save()
+            # Создаём или находим пользователя
+            user_serializer = PerevalUserSerializer(data=user_data)
+            user_serializer.is_valid(raise_exception=True)
+            user = user_serializer.save()
 
-        # Создаем координаты
-        coords = PerevalCoords.objects.create(**coords_data)
+            # Координаты (latitude, longitude, height) уже лежат в validated_data;
+            # отдельная строка PerevalCoords нужна только без INLINE_COORDS
+            if not settings.INLINE_COORDS:
+                validated_data['coords'] = PerevalCoords.objects.create(
+                    latitude=validated_data['latitude'],
+                    longitude=validated_data['longitude'],
+                    height=validated_data['height'],
+                )
 
-        # Создаем сам перевал
-        pereval = PerevalAdded.objects.create(user=user, coords=coords, **validated_data)
+            # Создаем сам перевал
+            pereval = PerevalAdded.objects.create(user=user, **validated_data)
 
-        # Создаем изображения и связываем их с перевалом
-        for image_data in images_data:
-            PerevalImage.objects.create(pereval=pereval, **image_data)
+            # Создаем изображения одним INSERT (без PerevalImage.save, чтобы не менять версию перевала)
+            PerevalImage.objects.bulk_create([PerevalImage(pereval=pereval, **image_data) for image_data in images_data])
 
-        return pereval
+            return pereval
 
 
 class PerevalInfoSerializer(serializers.ModelSerializer):
     user = PerevalUserSerializer()
-    coords = PerevalCoordsSerializer()
+    coords = PerevalCoordsSerializer(source='*')
     images = PerevalImageSerializer(many=True)
 
     class Meta:
@@ -93,9 +138,80 @@ class PerevalInfoSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'add_time', 'status']
 
+    # Вложенные объекты, которые при ?fields= добавляются только явно (в fields или ?expand=)
+    EXPANSIONS = ('user', 'images')
+    # Столбцы, которые нужны полю ответа, если они отличаются от имени поля
+    FIELD_COLUMNS = {
+        'coords': ['latitude', 'longitude', 'height'],
+        'user': ['user__email', 'user__fam', 'user__name', 'user__otc', 'user__phone'],
+        'images': [],
+    }
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def select_fields(cls, fields=None, expand=None):
+        """Разбирает ?fields= и ?expand=; возвращает список полей или None (полный ответ)"""
+        if not fields:
+            return None
+        selected = [name.strip() for name in fields.split(',') if name.strip()]
+        expanded = [name.strip() for name in (expand or '').split(',') if name.strip()]
+        unknown = (set(selected) - set(cls.Meta.fields)) | (set(expanded) - set(cls.EXPANSIONS))
+        selected += expanded
+        if unknown:
+            raise ValueError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+        return list(dict.fromkeys(['id'] + selected))
+
+    @classmethod
+    def setup_queryset(cls, queryset, fields=None, extra_columns=()):
+        """Загружает только столбцы выбранных полей; изображения — отдельным запросом, если они нужны"""
+        fields = fields or cls.Meta.fields
+        if 'user' in fields:
+            queryset = queryset.select_related('user')
+        if 'images' in fields:
+            queryset = queryset.prefetch_related('images')
+        columns = [column for name in fields for column in cls.FIELD_COLUMNS.get(name, [name])]
+        return queryset.only(*columns, *extra_columns)
+
+
+class PerevalChangeSerializer(PerevalInfoSerializer):
+    """Запись в ответе синхронизации: дополнительно содержит version и updated_at"""
+
+    class Meta(PerevalInfoSerializer.Meta):
+        fields = PerevalInfoSerializer.Meta.fields + ['version', 'updated_at']
+        read_only_fields = PerevalInfoSerializer.Meta.read_only_fields + ['version', 'updated_at']
+
+
+class PerevalImageArchiveSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PerevalImageArchive
+        fields = ['title', 'image_url']
+
+
+class PerevalArchiveSerializer(serializers.ModelSerializer):
+    """Архивная запись в том же формате, что и PerevalInfoSerializer"""
+    user = PerevalUserSerializer()
+    coords = serializers.SerializerMethodField()
+    images = PerevalImageArchiveSerializer(many=True)
+
+    class Meta:
+        model = PerevalArchive
+        fields = [
+            'id', 'beauty_title', 'title', 'other_titles', 'connect', 'add_time',
+            'status', 'user', 'coords', 'level_winter', 'level_summer',
+            'level_autumn', 'level_spring', 'images', 'archived_at'
+        ]
+
+    def get_coords(self, obj):
+        return {'latitude': obj.latitude, 'longitude': obj.longitude, 'height': obj.height}
+
 
 class PerevalUpdateSerializer(serializers.ModelSerializer):
-    coords = PerevalCoordsUpdateSerializer(required=False)
+    coords = PerevalCoordsUpdateSerializer(source='*', required=False)
     images = PerevalImageSerializer(many=True, required=False)
 
     class Meta:
@@ -106,29 +222,65 @@ class PerevalUpdateSerializer(serializers.ModelSerializer):
             'coords', 'images'
         ]
 
+    def validate_images(self, images):
+        return validate_images_count(images)
+
     def update(self, instance, validated_data):
-        # Извлекаем вложенные данные
-        coords_data = validated_data.pop('coords', None)
+        # save() обошёл бы проверку статуса и версии, аудит и пересчёт кластеров карты
+        raise NotImplementedError('Используйте update_guarded(pk, expected_version)')
+
+    def update_guarded(self, pk, expected_version=None):
+        """
+        Обновляет запись одним UPDATE ... WHERE status = 'new' [AND version = expected_version],
+        записывая только переданные поля. Возвращает количество изменённых строк:
+        0 означает, что записи нет, её статус уже не 'new' или версия устарела.
+        Имена записанных полей сохраняются в self.changed_fields; если менять нечего
+        (например, только "images": []), запись проверяется без UPDATE и версия не растёт.
+        """
+        validated_data = dict(self.validated_data)
         images_data = validated_data.pop('images', None)
+        # Пустой список изображений существующие не заменяет
+        self.changed_fields = sorted(validated_data) + (['images'] if images_data else [])
+
+        rows = PerevalAdded.objects.filter(pk=pk, status='new')
+        if expected_version is not None:
+            rows = rows.filter(version=expected_version)
+        if not self.changed_fields:
+            return rows.using(router.db_for_write(PerevalAdded)).count()
 
-        # Обновление простых полей
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
+        alias = router.db_for_write(PerevalAdded)
+        with transaction.atomic(using=alias):
+            # Прежние значения нужны журналу аудита и пересчёту кластеров карты; их возвращает сам UPDATE
+            old_fields = list(dict.fromkeys([*validated_data, 'latitude', 'longitude']))
+            old_rows = rows.touch_returning(old_fields, **validated_data)
+            if not old_rows:
+                return 0
+            updated, old = len(old_rows), old_rows[0]
+            if 'latitude' in validated_data or 'longitude' in validated_data:
+                old_position = (old['latitude'], old['longitude'])
+                new_position = (validated_data.get('latitude', old_position[0]),
+                                validated_data.get('longitude', old_position[1]))
+                mapgrid.move_point(pk, old_position, new_position)
+            changes = {name: {'old': old[name], 'new': value} for name, value in validated_data.items()}
 
-        # Обновление координат
-        if coords_data:
-            coords_serializer = PerevalCoordsUpdateSerializer(instance.coords, data=coords_data, partial=True)
-            if coords_serializer.is_valid(raise_exception=True):
-                coords_serializer.save()
+            coords_data = {k: v for k, v in validated_data.items() if k in ('latitude', 'longitude', 'height')}
+            if coords_data and not settings.INLINE_COORDS:
+                PerevalCoords.objects.filter(pereval__pk=pk).update(**coords_data)
 
-        # Обновление изображений: удалить старые и добавить новые
-        if images_data:
-            instance.images.all().delete()
-            for img in images_data:
-                PerevalImage.objects.create(pereval=instance, **img)
+            if images_data:
+                old_images = PerevalImage.objects.filter(pereval_id=pk)
+                changes['images'] = {
+                    'old': list(old_images.order_by('id').values('title', 'image_url')),
+                    'new': [{'title': img.get('title'), 'image_url': img.get('image_url')} for img in images_data],
+                }
+                old_images.delete()
+                PerevalImage.objects.bulk_create([PerevalImage(pereval_id=pk, **img) for img in images_data])
+                enqueue_image_check(pk, using=alias)
 
-        return instance
+            audit('pereval.patch', using=alias, id=pk, changes=changes, expected_version=expected_version)
+            if validated_data:
+                enqueue_stats_refresh(using=alias)
+        return updated
 
     def to_representation(self, instance):
         """Добавляем поле level в ответ для совместимости"""
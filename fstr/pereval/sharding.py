@@ -0,0 +1,128 @@
+"""
+Горизонтальное шардирование перевалов по регионам.
+
+Перевалы (PerevalAdded) вместе с координатами (PerevalCoords) и изображениями
+(PerevalImage) хранятся в одной из БД settings.DATABASE_SHARDS; шард
+выбирается по региону — ячейке REGION_DEGREES x REGION_DEGREES, в которой
+лежат координаты перевала (тот же код региона, что в pereval.stats, например
+45N007E). Регион целиком попадает в один шард: по умолчанию по хэшу кода,
+отдельные популярные регионы можно закрепить за шардом через SHARD_REGIONS.
+Автор (PerevalUser) копируется в каждый шард, где есть его перевалы.
+
+id глобальные: в шарде с номером i последовательности начинаются с
+i << SHARD_ID_BITS (см. configure_sequences), поэтому шард записи
+определяется по id без обращения к другим БД, а существующие записи
+основной БД (номер 0) сохраняют свои id. Списки по email собираются со всех
+шардов (scatter).
+
+Остальные таблицы (архив, очереди, сетка карты) хранятся в основной БД;
+архивация, синхронизация, сетка карты и статистика читают перевалы всех
+шардов. Если шард один, маршрутизация не меняется.
+"""
+
+import math
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from .stats import REGION_DEGREES
+
+SHARDED_MODELS = {'perevaluser', 'perevaladded', 'perevalcoords', 'perevalimage'}
+
+_current_shard = ContextVar('current_shard', default=None)
+
+
+def is_enabled():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def region_code(latitude, longitude):
+    """Код региона по координатам, например 45N007E"""
+    lat = math.floor(latitude / REGION_DEGREES) * REGION_DEGREES
+    lon = math.floor(longitude / REGION_DEGREES) * REGION_DEGREES
+    return f"{abs(lat):02d}{'N' if latitude >= 0 else 'S'}{abs(lon):03d}{'E' if longitude >= 0 else 'W'}"
+
+
+def shard_for_coords(latitude, longitude):
+    """Шард для нового перевала; None, если шардирование выключено"""
+    if not is_enabled():
+        return None
+    region = region_code(latitude, longitude)
+    if region in settings.SHARD_REGIONS:
+        return settings.SHARD_REGIONS[region]
+    return settings.DATABASE_SHARDS[zlib.crc32(region.encode()) % len(settings.DATABASE_SHARDS)]
+
+
+def shard_for_pk(pk):
+    """Шард записи по её id; для id вне известных шардов — основная БД (записи там не будет)"""
+    if not is_enabled():
+        return None
+    index = int(pk) >> settings.SHARD_ID_BITS
+    return settings.DATABASE_SHARDS[index] if index < len(settings.DATABASE_SHARDS) else 'default'
+
+
+def group_by_shard(ids):
+    """{шард: [id, ...]} в порядке ids"""
+    groups = {}
+    for pk in ids:
+        groups.setdefault(shard_for_pk(pk), []).append(pk)
+    return groups
+
+
+@contextmanager
+def use_shard(alias):
+    """Направляет запросы к шардированным моделям внутри блока в шард alias (None — без изменений)"""
+    if alias is None:
+        yield
+        return
+    token = _current_shard.set(alias)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def scatter(func, aliases=None):
+    """Выполняет func() в каждом шарде; возвращает {шард: результат}"""
+    if aliases is None:
+        aliases = settings.DATABASE_SHARDS if is_enabled() else [None]
+    results = {}
+    for alias in aliases:
+        with use_shard(alias):
+            results[alias] = func()
+    return results
+
+
+def db_for_model(model, hints):
+    """БД шарда для запроса к модели или None, если решает обычная маршрутизация"""
+    if model._meta.app_label != 'pereval' or model._meta.model_name not in SHARDED_MODELS:
+        return None
+    alias = _current_shard.get()
+    if alias is None:
+        # Связанные объекты читаются из того же шарда, что и исходная запись
+        instance = hints.get('instance')
+        alias = instance._state.db if instance is not None else None
+    # Основная БД — нулевой шард, для неё работают реплики и закрепление за основной БД
+    if alias in settings.DATABASE_SHARDS and alias != 'default':
+        return alias
+    return None
+
+
+def configure_sequences(alias):
+    """Сдвигает последовательности id шарда в его диапазон (идемпотентно); возвращает начало диапазона"""
+    from .models import PerevalAdded, PerevalCoords, PerevalImage
+
+    start = settings.DATABASE_SHARDS.index(alias) << settings.SHARD_ID_BITS
+    if not start:
+        return start
+    with connections[alias].cursor() as cursor:
+        for model in (PerevalAdded, PerevalCoords, PerevalImage):
+            table = model._meta.db_table
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(COALESCE(MAX(id), 0), %s)) FROM {table}",
+                [table, start],
+            )
+    return start
@@ -0,0 +1,216 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight).
+
+Когда сотни клиентов одновременно открывают одну ссылку, GET
+/api/submitData/<id>/ и GET /api/submitData/?user__email=... выполняют одни
+и те же запросы к БД и сериализацию. coalesce(key, compute) выполняет compute
+один раз, а одинаковые запросы, пришедшие во время вычисления, ждут и
+получают тот же результат.
+
+Два уровня:
+- в процессе: первый поток с данным ключом вычисляет результат, остальные
+  ждут его threading.Event и получают тот же объект;
+- между воркерами: вычисляющий процесс держит fcntl-блокировку байта слота
+  (по хэшу ключа) в файле SINGLEFLIGHT_DIR/locks. Воркер, не получивший
+  блокировку, увеличивает счётчик ожидающих слота в том же файле и ждёт,
+  пока появится результат, записанный после его прихода, или блокировка
+  освободится (тогда он вычисляет сам). Вычисляющий записывает результат в
+  JSON в SINGLEFLIGHT_DIR/<хэш> (права 0600), только если его кто-то ждёт.
+  fcntl-блокировки принадлежат процессу, поэтому слот дополнительно
+  защищён threading.Lock от потоков того же процесса с другим ключом.
+
+Запрос, пришедший после завершения вычисления, всегда вычисляет заново:
+устаревших данных объединение не отдаёт. Запросы, закреплённые за основной
+БД (read-your-writes, см. pereval.middleware), не объединяются: вычисление,
+начатое до их прихода, могло прочитать данные до их собственной записи.
+Если вычисляющий не успевает за SINGLEFLIGHT_TIMEOUT секунд, ожидающие
+вычисляют сами. Результат должен сериализоваться в JSON (как ответ API);
+воркеры получают его уже разобранным.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .routers import is_pinned_to_primary
+
+LOCK_SLOTS = 4096
+WRITTEN_AT = struct.Struct('<d')
+# Слот в файле блокировок: счётчик ожидающих; байт 0 — блокировка вычисляющего, байт 1 — счётчика
+WAITERS = struct.Struct('<I')
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+_lock_file = {'owner': None, 'fd': None, 'slots': {}}
+_waiters_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def coalesce(key, compute):
+    """Результат compute(), общий для одновременных вызовов с тем же ключом"""
+    if not settings.SINGLEFLIGHT_ENABLED or is_pinned_to_primary():
+        return compute()
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+
+    if not leader:
+        if not flight.done.wait(settings.SINGLEFLIGHT_TIMEOUT):
+            return compute()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    try:
+        flight.value = _compute_shared(key, compute)
+        return flight.value
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def _lock_fd():
+    # После fork у воркера должен быть свой дескриптор: блокировки fcntl принадлежат процессу
+    owner = (os.getpid(), settings.SINGLEFLIGHT_DIR)
+    with _flights_lock:
+        if _lock_file['owner'] != owner:
+            directory = Path(settings.SINGLEFLIGHT_DIR)
+            directory.mkdir(parents=True, exist_ok=True)
+            _lock_file['fd'] = os.open(directory / 'locks', os.O_RDWR | os.O_CREAT, 0o600)
+            _lock_file['slots'] = {}
+            _lock_file['owner'] = owner
+        return _lock_file['fd']
+
+
+def _slot_lock(slot):
+    with _flights_lock:
+        return _lock_file['slots'].setdefault(slot, threading.Lock())
+
+
+def _try_lock(fd, slot):
+    lock = _slot_lock(slot)
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot * WAITERS.size)
+        return True
+    except OSError:
+        lock.release()
+        return False
+
+
+def _unlock(fd, slot):
+    fcntl.lockf(fd, fcntl.LOCK_UN, 1, slot * WAITERS.size)
+    _slot_lock(slot).release()
+
+
+def _waiters(fd, slot):
+    raw = os.pread(fd, WAITERS.size, slot * WAITERS.size)
+    return WAITERS.unpack(raw)[0] if len(raw) == WAITERS.size else 0
+
+
+def _add_waiter(fd, slot, delta):
+    offset = slot * WAITERS.size
+    with _waiters_lock:
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, offset + 1)
+        try:
+            os.pwrite(fd, WAITERS.pack(max(_waiters(fd, slot) + delta, 0)), offset)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset + 1)
+
+
+def _read_result(path, arrived):
+    """Результат, записанный после прихода запроса, или None"""
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    if len(raw) < WRITTEN_AT.size or WRITTEN_AT.unpack_from(raw)[0] < arrived:
+        return None
+    return json.loads(raw[WRITTEN_AT.size:])
+
+
+def _write_result(path, value):
+    tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    body = json.dumps(value, cls=JSONEncoder, ensure_ascii=False).encode()
+    # Ответы API могут содержать персональные данные: файл доступен только владельцу
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(WRITTEN_AT.pack(time.time()) + body)
+    tmp_path.replace(path)
+
+
+def _sweep(directory):
+    """Удаляет результаты старше SINGLEFLIGHT_RESULT_TTL (не чаще раза в TTL)"""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < settings.SINGLEFLIGHT_RESULT_TTL:
+        return
+    _last_sweep = now
+    for path in directory.iterdir():
+        if path.name == 'locks':
+            continue
+        try:
+            if now - path.stat().st_mtime > settings.SINGLEFLIGHT_RESULT_TTL:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _compute_shared(key, compute):
+    arrived = time.time()
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=16)
+    path = Path(settings.SINGLEFLIGHT_DIR) / digest.hexdigest()
+    slot = int.from_bytes(digest.digest()[:4], 'little') % LOCK_SLOTS
+    fd = _lock_fd()
+
+    deadline = arrived + settings.SINGLEFLIGHT_TIMEOUT
+    if not _try_lock(fd, slot):
+        # Блокировку держит другой воркер: регистрируемся и ждём его результат
+        _add_waiter(fd, slot, 1)
+        try:
+            while not _try_lock(fd, slot):
+                value = _read_result(path, arrived)
+                if value is not None:
+                    return value
+                if time.time() >= deadline:
+                    return compute()
+                time.sleep(settings.SINGLEFLIGHT_POLL_SECONDS)
+        finally:
+            _add_waiter(fd, slot, -1)
+
+    try:
+        # Вычисляющий мог закончить между проверкой результата и освобождением блокировки
+        value = _read_result(path, arrived)
+        if value is not None:
+            return value
+        value = compute()
+        if _waiters(fd, slot):
+            _write_result(path, value)
+            _sweep(path.parent)
+        return value
+    finally:
+        _unlock(fd, slot)
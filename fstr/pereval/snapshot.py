@@ -0,0 +1,214 @@
+"""
+Снимок принятых перевалов (status='accepted') в файле, отображаемом в память.
+
+Принятые перевалы практически не меняются, поэтому GET /api/submitData/<id>/
+отдаёт их из снимка без обращения к PostgreSQL. Файл строит команда
+build_snapshot; все воркеры gunicorn отображают его через mmap только для
+чтения, так что данные лежат в памяти один раз (в page cache) и не копируются.
+
+Формат файла (все числа little-endian):
+    заголовок HEADER: сигнатура, версия формата, число записей, время сборки;
+    массивы по count элементов, упорядоченные по id:
+        id (int64), широта и долгота (float64), высота (int32), статус (uint8),
+        версия записи (uint32), updated_at в микросекундах (int64);
+    смещения (uint64, count + 1 элементов) в блоке JSON;
+    блок JSON — ответ PerevalInfoSerializer для каждой записи подряд.
+Поиск по id — двоичный поиск в массиве id.
+
+Новый снимок записывается во временный файл и атомарно заменяет старый
+(os.replace). Воркер проверяет файл не чаще раза в SNAPSHOT_CHECK_SECONDS и при
+замене просто переключает ссылку на новый объект; запросы, которые ещё читают
+старый снимок, дочитывают его (старый файл живёт, пока открыт).
+
+Сохранение принятого перевала (или смена статуса с/на accepted) после фиксации
+отмечает снимок устаревшим — файлом-меткой рядом со снимком — и ставит в
+очередь задачу build_snapshot. Снимок, собранный раньше метки, не
+используется: до пересборки запросы читают PostgreSQL.
+"""
+
+import bisect
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+MAGIC = b'FSTRSNAP'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIq')
+# (код типа для memoryview.cast, размер элемента)
+ARRAYS = [
+    ('id', 'q', 8),
+    ('latitude', 'd', 8),
+    ('longitude', 'd', 8),
+    ('height', 'i', 4),
+    ('status', 'B', 1),
+    ('version', 'I', 4),
+    ('updated_at', 'q', 8),
+]
+STATUS_CODES = {'new': 0, 'pending': 1, 'accepted': 2, 'rejected': 3}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _micros(value):
+    return int(value.timestamp()) * 1_000_000 + value.microsecond
+
+
+def stale_marker(path=None):
+    return Path(f'{path or settings.SNAPSHOT_FILE}.stale')
+
+
+def mark_stale():
+    """Отмечает снимок устаревшим: воркеры перестают его использовать до пересборки"""
+    try:
+        stale_marker().touch()
+        os.utime(stale_marker())
+    except FileNotFoundError:
+        pass  # Каталога нет — снимок ещё ни разу не собирался
+
+
+def build_snapshot(path=None, chunk_size=1000):
+    """Записывает снимок принятых перевалов; возвращает (путь, число записей, размер файла)"""
+    from .models import PerevalAdded
+    from .serializers import PerevalInfoSerializer
+    from .sharding import is_enabled, use_shard
+
+    path = Path(path or settings.SNAPSHOT_FILE)
+    renderer = JSONRenderer()
+    # Время сборки — момент начала чтения: более поздняя метка устаревания отменяет снимок
+    built_at = time.time_ns() // 1000
+    columns = {name: array(code) for name, code, _ in ARRAYS}
+    offsets = array('Q', [0])
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Записи читаются потоком: в памяти только числовые массивы, JSON копится во временном файле
+    with tempfile.TemporaryFile(dir=path.parent) as blobs:
+        # Диапазоны id шардов идут по возрастанию в порядке DATABASE_SHARDS (см. pereval.sharding)
+        for shard in (settings.DATABASE_SHARDS if is_enabled() else [None]):
+            with use_shard(shard):
+                queryset = PerevalInfoSerializer.setup_queryset(
+                    PerevalAdded.objects.filter(status='accepted').order_by('id'),
+                    extra_columns=('version', 'updated_at'),
+                )
+                for pereval in queryset.iterator(chunk_size=chunk_size):
+                    columns['id'].append(pereval.id)
+                    columns['latitude'].append(pereval.latitude if pereval.latitude is not None else float('nan'))
+                    columns['longitude'].append(pereval.longitude if pereval.longitude is not None else float('nan'))
+                    columns['height'].append(pereval.height or 0)
+                    columns['status'].append(STATUS_CODES[pereval.status])
+                    columns['version'].append(pereval.version)
+                    columns['updated_at'].append(_micros(pereval.updated_at))
+                    blob = renderer.render(PerevalInfoSerializer(pereval).data)
+                    blobs.write(blob)
+                    offsets.append(offsets[-1] + len(blob))
+
+        count = len(columns['id'])
+        tmp_path = path.with_suffix(f'{path.suffix}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, count, built_at))
+            for column in [*(columns[name] for name, _, _ in ARRAYS), offsets]:
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                f.write(column.tobytes())
+            blobs.seek(0)
+            shutil.copyfileobj(blobs, f)
+            f.flush()
+            os.fsync(f.fileno())
+    tmp_path.replace(path)
+    return path, count, path.stat().st_size
+
+
+class Snapshot:
+    """Открытый снимок: массивы — представления memoryview над mmap, без копирования"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if len(view) < HEADER.size:
+            raise SnapshotError('Файл снимка повреждён')
+        magic, version, self.count, self.built_micros = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise SnapshotError('Неизвестный формат снимка')
+        self.built_at = datetime.fromtimestamp(self.built_micros / 1_000_000, tz=dt_timezone.utc)
+
+        offset = HEADER.size
+        for name, code, size in ARRAYS:
+            setattr(self, name, view[offset:offset + self.count * size].cast(code))
+            offset += self.count * size
+        self.offsets = view[offset:offset + (self.count + 1) * 8].cast('Q')
+        self._blob_start = offset + (self.count + 1) * 8
+        self._view = view
+
+    def find(self, pk):
+        """Индекс записи с данным id или None"""
+        i = bisect.bisect_left(self.id, pk)
+        return i if i < self.count and self.id[i] == pk else None
+
+    def lookup(self, pk):
+        """(version, updated_at, JSON-байты) принятого перевала или None"""
+        i = self.find(pk)
+        if i is None:
+            return None
+        start, end = self._blob_start + self.offsets[i], self._blob_start + self.offsets[i + 1]
+        updated_at = datetime.fromtimestamp(self.updated_at[i] / 1_000_000, tz=dt_timezone.utc)
+        return self.version[i], updated_at, self._view[start:end]
+
+
+_current = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_snapshot():
+    """Текущий снимок процесса (None, если файла нет); подхватывает пересобранный файл"""
+    global _current, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < settings.SNAPSHOT_CHECK_SECONDS:
+        return _current
+    with _lock:
+        if now - _checked_at >= settings.SNAPSHOT_CHECK_SECONDS:
+            _checked_at = now
+            try:
+                stat = os.stat(settings.SNAPSHOT_FILE)
+            except FileNotFoundError:
+                _current = None
+            else:
+                identity = (stat.st_ino, stat.st_mtime_ns)
+                if _current is None or _current.identity != identity:
+                    try:
+                        # Присваивание ссылки атомарно: запросы видят либо старый, либо новый снимок
+                        _current = Snapshot(settings.SNAPSHOT_FILE)
+                    except (OSError, ValueError, SnapshotError):
+                        _current = None
+                if _current is not None and _is_stale(_current):
+                    _current = None
+    return _current
+
+
+def _is_stale(snapshot):
+    try:
+        marked_at = os.stat(stale_marker()).st_mtime_ns // 1000
+    except FileNotFoundError:
+        return False
+    return marked_at >= snapshot.built_micros
+
+
+def reset_snapshot():
+    global _current, _checked_at
+    with _lock:
+        _current, _checked_at = None, 0.0
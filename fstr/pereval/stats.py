@@ -0,0 +1,109 @@
+"""
+Статистика перевалов для дашбордов.
+
+Счётчики по статусу, категориям сложности, диапазонам высоты и регионам
+хранятся в материализованном представлении pereval_stats: по одной строке
+на пару (измерение, значение). Чтение — выборка нескольких десятков строк
+независимо от числа перевалов; представление пересчитывается командой
+refresh_stats или фоновой задачей refresh_stats через
+REFRESH MATERIALIZED VIEW CONCURRENTLY, которое не блокирует чтение. Задачу
+ставят изменения перевалов (pereval.jobs.enqueue_stats_refresh) с задержкой
+STATS_REFRESH_DELAY, так что поток правок даёт один пересчёт.
+
+Регион — ячейка сетки REGION_DEGREES x REGION_DEGREES по координатам
+перевала (например, 45N007E), диапазон высоты — HEIGHT_BAND метров.
+
+При шардировании (pereval.sharding) представление есть в каждом шарде и
+считает его перевалы: refresh_stats пересчитывает все, get_stats складывает
+счётчики, а refreshed_at — время последнего пересчёта.
+"""
+
+from django.conf import settings
+from django.db import connections
+
+VIEW = 'pereval_stats'
+HEIGHT_BAND = 500
+REGION_DEGREES = 1
+
+_REGION_SQL = (
+    "CASE WHEN latitude IS NULL THEN '' ELSE "
+    "lpad(abs(floor(latitude / {d})::int * {d})::text, 2, '0') || "
+    "CASE WHEN latitude >= 0 THEN 'N' ELSE 'S' END || "
+    "lpad(abs(floor(longitude / {d})::int * {d})::text, 3, '0') || "
+    "CASE WHEN longitude >= 0 THEN 'E' ELSE 'W' END END"
+).format(d=REGION_DEGREES)
+
+_HEIGHT_SQL = (
+    "CASE WHEN height IS NULL THEN '' ELSE "
+    "(floor(height / {b}.0)::int * {b})::text || '-' || (floor(height / {b}.0)::int * {b} + {b} - 1)::text END"
+).format(b=HEIGHT_BAND)
+
+_COLUMNS = {
+    'status': 'status',
+    'level_winter': 'level_winter',
+    'level_summer': 'level_summer',
+    'level_autumn': 'level_autumn',
+    'level_spring': 'level_spring',
+    'height': _HEIGHT_SQL,
+    'region': _REGION_SQL,
+}
+
+
+def grouping_sql(source, dimensions, extra_columns=''):
+    """
+    Счётчики по измерениям dimensions за один проход по source (GROUPING SETS).
+    source — таблица или подзапрос со столбцами status, level_*, height, latitude, longitude;
+    набор () даёт строку total, которая есть даже для пустой выборки
+    """
+    dimension_sql = 'CASE ' + ' '.join(
+        f"WHEN GROUPING({name}) = 0 THEN '{name}'" for name in dimensions
+    ) + " ELSE 'total' END"
+    return (
+        f"SELECT {dimension_sql} AS dimension, COALESCE({', '.join(dimensions)}, '') AS value, "
+        f"count(*) AS total{extra_columns} "
+        f"FROM (SELECT {', '.join(f'{_COLUMNS[name]} AS {name}' for name in dimensions)} FROM {source}) p "
+        f"GROUP BY GROUPING SETS ({', '.join(f'({name})' for name in dimensions)}, ())"
+    )
+
+
+# Строка total хранит и время пересчёта представления
+CREATE_VIEW_SQL = f"CREATE MATERIALIZED VIEW IF NOT EXISTS {VIEW} AS " + grouping_sql(
+    'pereval_perevaladded', list(_COLUMNS), extra_columns=', now() AS refreshed_at'
+)
+# Уникальный индекс обязателен для REFRESH ... CONCURRENTLY
+CREATE_INDEX_SQL = f"CREATE UNIQUE INDEX IF NOT EXISTS {VIEW}_key ON {VIEW} (dimension, value)"
+DROP_VIEW_SQL = f"DROP MATERIALIZED VIEW IF EXISTS {VIEW}"
+
+
+def create_view(cursor):
+    """Создаёт представление (например, после пересоздания таблицы перевалов)"""
+    cursor.execute(CREATE_VIEW_SQL)
+    cursor.execute(CREATE_INDEX_SQL)
+
+
+def refresh_stats():
+    for alias in settings.DATABASE_SHARDS:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {VIEW}')
+
+
+def get_stats():
+    """Возвращает {'total', 'refreshed_at', измерение: {значение: количество}}"""
+    rows = []
+    for alias in settings.DATABASE_SHARDS:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'SELECT dimension, value, total, refreshed_at FROM {VIEW}')
+            rows.extend(cursor.fetchall())
+
+    stats = {'total': 0, 'refreshed_at': None}
+    stats.update((name, {}) for name in _COLUMNS)
+    for dimension, value, total, refreshed_at in rows:
+        if dimension == 'total':
+            stats['total'] += total
+            if stats['refreshed_at'] is None or refreshed_at > stats['refreshed_at']:
+                stats['refreshed_at'] = refreshed_at
+        else:
+            stats[dimension][value] = stats[dimension].get(value, 0) + total
+    for name in _COLUMNS:
+        stats[name] = dict(sorted(stats[name].items()))
+    return stats
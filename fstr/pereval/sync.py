@@ -0,0 +1,133 @@
+"""
+Инкрементальная синхронизация для офлайн-клиентов.
+
+Клиент передаёт курсор из предыдущего ответа и получает только записи,
+изменённые после него (создание, PATCH, модерация, изменение изображений
+меняют updated_at), и «надгробия» для записей, перенесённых в архив.
+Выборка идёт по индексам (user, updated_at) и (user, archived_at), поэтому
+стоимость зависит от числа изменений, а не от размера истории пользователя.
+
+updated_at выставляется при UPDATE, а видимой строка становится при фиксации
+транзакции: транзакция, начатая раньше, может зафиксироваться уже после того,
+как клиент прочитал более поздние записи. Поэтому каждый запрос перечитывает
+окно SYNC_OVERLAP_SECONDS перед позицией курсора, а курсор хранит, какие
+записи (id, version) из этого окна клиент уже получил, — повторно они не
+отдаются. Теряются только транзакции, которые длятся дольше окна.
+
+При шардировании (pereval.sharding) изменения пользователя читаются со всех
+шардов по email и сливаются по (updated_at, id); архив хранится в основной БД.
+"""
+
+import base64
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+
+from .models import PerevalAdded, PerevalArchive
+from .sharding import scatter
+
+EPOCH_TIME = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _to_micros(value):
+    # Целочисленная арифметика: timestamp() с плавающей точкой теряет микросекунды
+    return (value - EPOCH_TIME) // MICROSECOND
+
+
+def _from_micros(value):
+    return EPOCH_TIME + value * MICROSECOND
+
+
+class Stream:
+    """Позиция в одном потоке (изменения или архив) и записи окна перекрытия, уже отданные клиенту"""
+
+    def __init__(self, position=0, seen=None):
+        self.position = position
+        self.seen = seen or {}  # {ключ записи: время в микросекундах}
+
+    @classmethod
+    def decode(cls, position, seen):
+        # Курсоры прежнего формата содержали пару (время, id)
+        if isinstance(position, list):
+            position = position[0]
+        return cls(int(position), {tuple(int(v) for v in item[:-1]): int(item[-1]) for item in seen})
+
+    def encode(self):
+        return self.position, [[*key, moment] for key, moment in self.seen.items()]
+
+    def read(self, fetch, field, key, limit):
+        """
+        Следующие limit записей потока; возвращает (записи, есть ли ещё) и сдвигает позицию.
+        fetch(нижняя граница, число) возвращает первые записи с field >= границы по (field, id).
+        """
+        overlap = settings.SYNC_OVERLAP_SECONDS * 1_000_000
+        rows = fetch(_from_micros(self.position - overlap), limit + len(self.seen) + 1)
+        fresh = [row for row in rows if key(row) not in self.seen]
+        page = fresh[:limit]
+        if page:
+            self.position = max(self.position, _to_micros(getattr(page[-1], field)))
+        horizon = self.position - overlap
+        seen = {item: moment for item, moment in self.seen.items() if moment >= horizon}
+        for row in page:
+            moment = _to_micros(getattr(row, field))
+            if moment >= horizon:
+                seen[key(row)] = moment
+        self.seen = seen
+        return page, len(fresh) > limit
+
+
+def encode_cursor(updated, archived):
+    (u, us), (a, as_) = updated.encode(), archived.encode()
+    raw = json.dumps({'u': u, 'us': us, 'a': a, 'as': as_}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает позиции потоков изменений и архива"""
+    if not token:
+        return Stream(), Stream()
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        return Stream.decode(data['u'], data.get('us', [])), Stream.decode(data['a'], data.get('as', []))
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        raise InvalidCursor(str(e))
+
+
+def _fetch(queryset, field):
+    def fetch(lower, count):
+        return list(queryset.filter(**{f'{field}__gte': lower}).order_by(field, 'id')[:count])
+    return fetch
+
+
+def _fetch_sharded(queryset, field):
+    """Как _fetch, но со всех шардов: первые count записей каждого шарда сливаются по (field, id)"""
+    def fetch(lower, count):
+        pages = scatter(lambda: _fetch(queryset, field)(lower, count))
+        rows = sorted((row for page in pages.values() for row in page), key=lambda row: (getattr(row, field), row.id))
+        return rows[:count]
+    return fetch
+
+
+def fetch_changes(email, token, limit):
+    """Возвращает (изменённые записи, архивные записи, следующий курсор, есть ли ещё)"""
+    updated, archived = decode_cursor(token)
+
+    changed, more_changed = updated.read(
+        _fetch_sharded(
+            PerevalAdded.objects.filter(user__email=email).select_related('user').prefetch_related('images'),
+            'updated_at',
+        ),
+        'updated_at', lambda row: (row.id, row.version), limit,
+    )
+    removed, more_removed = archived.read(
+        _fetch(PerevalArchive.objects.filter(user__email=email).only('id', 'archived_at'), 'archived_at'),
+        'archived_at', lambda row: (row.id,), limit,
+    )
+    return changed, removed, encode_cursor(updated, archived), more_changed or more_removed
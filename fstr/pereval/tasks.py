@@ -0,0 +1,62 @@
+"""
+Фоновые задачи приложения, выполняемые командой run_jobs.
+
+Задачи, перечисленные в POST_SUBMIT_JOBS, ставятся в очередь после
+добавления перевала и получают pereval_id.
+"""
+
+from django.conf import settings
+
+from .images import check_images
+from .jobs import job
+from .models import PerevalAdded, PerevalImage
+from .sharding import shard_for_pk, use_shard
+from .snapshot import build_snapshot
+from .stats import refresh_stats
+
+
+@job('detect_duplicates')
+def detect_duplicates(pereval_id):
+    """Ищет перевалы с тем же названием в радиусе DUPLICATE_RADIUS_DEGREES (индекс по широте и долготе)"""
+    with use_shard(shard_for_pk(pereval_id)):
+        return _detect_duplicates(pereval_id)
+
+
+def _detect_duplicates(pereval_id):
+    pereval = PerevalAdded.objects.filter(pk=pereval_id).only('title', 'latitude', 'longitude').first()
+    if pereval is None or pereval.latitude is None:
+        return {'duplicates': []}
+    radius = settings.DUPLICATE_RADIUS_DEGREES
+    duplicates = (
+        PerevalAdded.objects
+        .filter(
+            latitude__range=(pereval.latitude - radius, pereval.latitude + radius),
+            longitude__range=(pereval.longitude - radius, pereval.longitude + radius),
+            title__iexact=pereval.title,
+        )
+        .exclude(pk=pereval_id)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    return {'duplicates': list(duplicates)}
+
+
+@job('check_images')
+def check_pereval_images(pereval_id):
+    """Проверяет ссылки на изображения перевала и строит миниатюры"""
+    with use_shard(shard_for_pk(pereval_id)):
+        images = list(PerevalImage.objects.filter(pereval_id=pereval_id))
+        return {'checked': len(images), 'ok': check_images(images)}
+
+
+@job('refresh_stats', max_attempts=1)
+def refresh_stats_job():
+    """Пересчитывает статистику перевалов (REFRESH MATERIALIZED VIEW CONCURRENTLY)"""
+    refresh_stats()
+
+
+@job('build_snapshot', max_attempts=1)
+def build_snapshot_job():
+    """Пересобирает снимок принятых перевалов для GET /api/submitData/<id>/"""
+    path, count, size = build_snapshot()
+    return {'count': count, 'bytes': size}
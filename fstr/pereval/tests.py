@@ -1,7 +1,75 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import PerevalAdded, PerevalUser, PerevalCoords, PerevalImage
+from fstr.schema import build_schema, reset_schema_cache
+from fstr.urls import lazy_include
+from fstr.warmup import warm_up
+from .management.commands.profile_startup import parse_importtime
+from .admin import PerevalCoordsAdmin, PerevalImageAdmin
+from . import catalog, compression, events, images, singleflight
+from .archive import archive_perevals
+from .compression import get_cache as get_compression_cache, negotiate
+from .images import (
+    ImageCheckError, build_thumbnails, check_images, download_image, fetch_images, thumbnail_path
+)
+from .ingest import drain, drain_batch
+from .jobs import claim, enqueue, job, run_pending
+from .logs import BatchingHandler, JsonFormatter, bind_request, mask_pii
+from .mapgrid import decode_tile, world_position
+from .middleware import PRIMARY_PIN_COOKIE
+from .models import (
+    PerevalAdded, PerevalUser, PerevalCoords, PerevalImage, PerevalArchive, PerevalImageArchive, PerevalSubmission,
+    BackgroundJob, MapGridCell
+)
+from .partitioning import convert_to_partitioned, ensure_partitions, is_partitioned, list_partitions
+from .routers import PrimaryReplicaRouter, use_primary
+from .prevalidation import validate_submit
+from .serializers import PerevalAddedSerializer, PerevalInfoSerializer, PerevalUpdateSerializer
+from .sharding import region_code
+from .snapshot import build_snapshot, get_snapshot, reset_snapshot
+from .stats import get_stats, refresh_stats
+from .throttling import BucketStore
+
+
+def make_payload(email="qwerty@mail.ru", title="Пхия", latitude=45.3842, longitude=7.1525, height=1200):
+    """Валидные данные для POST /api/submitData/"""
+    return {
+        "beauty_title": "пер. ",
+        "title": title,
+        "other_titles": "Триев",
+        "connect": "",
+        "user": {"email": email, "fam": "Пупкин", "name": "Василий", "otc": "Иванович", "phone": "+7 555 55 55"},
+        "coords": {"latitude": latitude, "longitude": longitude, "height": height},
+        "level": {"winter": "", "summer": "1А", "autumn": "1А", "spring": ""},
+        "images": [{"title": "Седловина", "image_url": "https://example.com/photo1.jpg"}],
+    }
 
 
 class PerevalAPITestCase(TestCase):
@@ -178,6 +246,14 @@ class PerevalAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['state'], 1)
 
+    def test_update_serializer_save_is_disabled(self):
+        pereval = PerevalAdded.objects.get(pk=self.client.post('/api/submitData/', self.valid_payload, format='json').data['id'])
+        serializer = PerevalUpdateSerializer(pereval, data={'title': 'Другое'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with self.assertRaises(NotImplementedError):
+            serializer.save()
+        self.assertEqual(serializer.update_guarded(pereval.pk), 1)
+
     # Тесты модели
     def test_pereval_user_creation(self):
         user = PerevalUser.objects.create(
@@ -197,6 +273,15 @@ class PerevalAPITestCase(TestCase):
         )
         self.assertIn("Широта: 45.1234", str(coords))
 
+    def test_coords_admin_is_read_only(self):
+        request = RequestFactory().get('/admin/')
+        request.user = get_user_model()(is_superuser=True, is_staff=True, is_active=True)
+        coords_admin = PerevalCoordsAdmin(PerevalCoords, admin.site)
+        self.assertTrue(coords_admin.has_view_permission(request))
+        self.assertFalse(coords_admin.has_add_permission(request))
+        self.assertFalse(coords_admin.has_change_permission(request))
+        self.assertFalse(coords_admin.has_delete_permission(request))
+
     def test_pereval_added_creation(self):
         user = PerevalUser.objects.create(
             email="test@example.com",
@@ -392,4 +477,2005 @@ class PerevalAPITestCase(TestCase):
     def test_empty_payload(self):
         response = self.client.post('/api/submitData/', {}, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertEqual(response.data['status'], 400)
\ No newline at end of file
+        self.assertEqual(response.data['status'], 400)
+
+class SchemaCacheTestCase(TestCase):
+    def setUp(self):
+        reset_schema_cache()
+
+    def test_schema_json_served_with_etag(self):
+        response = self.client.get('/swagger.json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+        self.assertIn('/submitData/', json.loads(response.content)['paths'])
+
+    def test_schema_json_not_modified(self):
+        etag = self.client.get('/swagger.json')['ETag']
+        response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_schema_built_once(self):
+        with patch('fstr.schema.build_schema', wraps=build_schema) as build:
+            self.client.get('/swagger.json')
+            self.client.get('/swagger.json')
+        self.assertLessEqual(build.call_count, 1)
+
+    def test_generate_schema_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'openapi.json')
+            call_command('generate_schema', output=path, stdout=StringIO())
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['info']['title'], 'FSTR API')
+
+    def test_schema_contains_swagger_docs(self):
+        schema = json.loads(self.client.get('/swagger.json').content)
+        operation = schema['paths']['/submitData/']['get']
+        self.assertEqual(operation['description'], 'Получить список перевалов по email пользователя')
+
+
+class StartupTestCase(TestCase):
+    def test_lazy_include_resolves_on_demand(self):
+        resolver = lazy_include('docs/', 'fstr.docs_urls')
+        match = resolver.resolve('docs/swagger.json')
+        self.assertEqual(match.url_name, 'schema-json')
+
+    def test_warm_up_opens_connection(self):
+        timings = warm_up()
+        self.assertIn('db:default', timings)
+        self.assertIn('urls', timings)
+        self.assertIsNotNone(connection.connection)
+
+    def test_parse_importtime(self):
+        stderr = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       100 |        100 |   django.utils\n'
+            'import time:        50 |        150 | django\n'
+            'import time:        20 |         20 | yaml\n'
+        )
+        self.assertEqual(parse_importtime(stderr), {'django': 150, 'yaml': 20})
+
+    def test_profile_startup_command(self):
+        out = StringIO()
+        call_command('profile_startup', lean=True, limit=3, stdout=out)
+        self.assertIn('time_to_first_response', out.getvalue())
+        self.assertIn('Время импорта по пакетам', out.getvalue())
+
+
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.router = PrimaryReplicaRouter()
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(PerevalAdded), 'replica1')
+        self.assertEqual(self.router.db_for_write(PerevalAdded), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_pinned_reads_go_to_primary(self):
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(PerevalAdded), 'default')
+
+    def test_reads_without_replicas_go_to_primary(self):
+        self.assertEqual(self.router.db_for_read(PerevalAdded), 'default')
+
+    def test_migrations_only_on_primary(self):
+        self.assertTrue(self.router.allow_migrate('default', 'pereval'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'pereval'))
+
+    def test_successful_write_pins_client_to_primary(self):
+        payload = make_payload()
+        response = self.client.post('/api/submitData/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_failed_write_and_read_do_not_pin(self):
+        response = self.client.post('/api/submitData/', {}, format='json')
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+        response = self.client.get('/api/submitData/?user__email=qwerty@mail.ru')
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_read_only_post_does_not_pin(self):
+        pereval_id = self.client.post('/api/submitData/', make_payload(), format='json').data['id']
+        self.client.cookies.pop(PRIMARY_PIN_COOKIE)
+        response = self.client.post('/api/submitData/batch/', {'ids': [pereval_id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+
+class PartitioningTestCase(TestCase):
+    def create_pereval(self, add_time, status_value='new'):
+        user, _ = PerevalUser.objects.get_or_create(email="part@example.com", defaults={"fam": "Т", "name": "Т"})
+        coords = PerevalCoords.objects.create(latitude=45.0, longitude=7.0, height=1000)
+        pereval = PerevalAdded.objects.create(
+            beauty_title="пер.", title="Секция", user=user, coords=coords,
+            add_time=add_time, status=status_value
+        )
+        PerevalImage.objects.create(pereval=pereval, title="Фото", image_url="https://example.com/p.jpg")
+        return pereval
+
+    def test_convert_keeps_data_and_prunes_partitions(self):
+        old = self.create_pereval(datetime(2025, 1, 15, tzinfo=dt_timezone.utc))
+        self.create_pereval(timezone.now())
+
+        created = convert_to_partitioned(months_ahead=1)
+
+        self.assertIn('pereval_perevaladded_p2025_01', created)
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor))
+            self.assertIn('pereval_perevaladded_default', list_partitions(cursor))
+        self.assertEqual(PerevalAdded.objects.count(), 2)
+        self.assertEqual(PerevalAdded.objects.get(pk=old.pk).images.count(), 1)
+
+        plan = PerevalAdded.objects.awaiting_moderation(days=30).explain()
+        self.assertNotIn('p2025_01', plan)
+
+        response = APIClient().post('/api/submitData/', make_payload(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(response.data['id'], old.pk)
+
+    def test_convert_is_idempotent(self):
+        convert_to_partitioned(months_ahead=0)
+        self.assertEqual(convert_to_partitioned(months_ahead=0), [])
+
+    def test_ensure_partitions_moves_rows_from_default(self):
+        convert_to_partitioned(months_ahead=0)
+        future = self.create_pereval(datetime(2030, 5, 2, tzinfo=dt_timezone.utc))
+
+        created = ensure_partitions(months_ahead=0, start=datetime(2030, 5, 1, tzinfo=dt_timezone.utc))
+
+        self.assertEqual(created, ['pereval_perevaladded_p2030_05'])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM pereval_perevaladded_p2030_05')
+            self.assertEqual(cursor.fetchall(), [(future.pk,)])
+
+    def test_ensure_partitions_requires_partitioned_table(self):
+        with self.assertRaises(CommandError):
+            call_command('create_pereval_partitions', stdout=StringIO())
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = PerevalUser.objects.create(email="archive@example.com", fam="Архивов", name="Иван")
+
+    def create_pereval(self, status_value, days_ago):
+        coords = PerevalCoords.objects.create(latitude=45.5, longitude=7.5, height=2100)
+        pereval = PerevalAdded.objects.create(
+            beauty_title="пер.", title="Старый", user=self.user, coords=coords,
+            status=status_value, add_time=timezone.now() - timedelta(days=days_ago)
+        )
+        PerevalImage.objects.create(pereval=pereval, title="Фото", image_url="https://example.com/old.jpg")
+        return pereval
+
+    def test_archives_only_old_rejected(self):
+        old = self.create_pereval('rejected', 400)
+        recent = self.create_pereval('rejected', 10)
+        accepted = self.create_pereval('accepted', 400)
+
+        self.assertEqual(archive_perevals(days=180), 1)
+
+        self.assertFalse(PerevalAdded.objects.filter(pk=old.pk).exists())
+        self.assertFalse(PerevalCoords.objects.filter(pk=old.coords_id).exists())
+        self.assertFalse(PerevalImage.objects.filter(pereval_id=old.pk).exists())
+        self.assertEqual(PerevalAdded.objects.filter(pk__in=[recent.pk, accepted.pk]).count(), 2)
+        self.assertEqual(PerevalArchive.objects.get(pk=old.pk).images.count(), 1)
+
+    def test_archives_in_batches(self):
+        for _ in range(3):
+            self.create_pereval('rejected', 400)
+        self.assertEqual(archive_perevals(days=180, batch_size=2, max_batches=1), 2)
+        self.assertEqual(archive_perevals(days=180, batch_size=2), 1)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_archive_reads_from_primary(self):
+        # Реплики replica1 в тестах нет: обращение к ней завершилось бы ошибкой
+        old = self.create_pereval('rejected', 400)
+        self.assertEqual(archive_perevals(days=180), 1)
+        self.assertEqual(PerevalImageArchive.objects.using('default').filter(pereval_id=old.pk).count(), 1)
+
+    def test_archived_pereval_retrievable_by_id(self):
+        old = self.create_pereval('rejected', 400)
+        call_command('archive_perevals', days=180, stdout=StringIO())
+
+        response = self.client.get(f'/api/submitData/{old.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'rejected')
+        self.assertEqual(response.data['coords'], {'latitude': 45.5, 'longitude': 7.5, 'height': 2100})
+        self.assertEqual(response.data['user']['email'], 'archive@example.com')
+        self.assertEqual(len(response.data['images']), 1)
+        self.assertIsNotNone(response.data['archived_at'])
+
+
+@override_settings(INLINE_COORDS=True)
+class InlineCoordsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_create_skips_coords_table(self):
+        response = self.client.post('/api/submitData/', make_payload(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        pereval = PerevalAdded.objects.get(pk=response.data['id'])
+        self.assertIsNone(pereval.coords_id)
+        self.assertEqual((pereval.latitude, pereval.longitude, pereval.height), (45.3842, 7.1525, 1200))
+        self.assertFalse(PerevalCoords.objects.exists())
+
+    def test_coords_shape_preserved(self):
+        pereval_id = self.client.post('/api/submitData/', make_payload(), format='json').data['id']
+
+        response = self.client.patch(f'/api/submitData/{pereval_id}/', {"coords": {"height": 1800}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(f'/api/submitData/{pereval_id}/')
+        self.assertEqual(response.data['coords'], {'latitude': 45.3842, 'longitude': 7.1525, 'height': 1800})
+
+    def test_read_does_not_query_coords(self):
+        pereval_id = self.client.post('/api/submitData/', make_payload(), format='json').data['id']
+        pereval = PerevalAdded.objects.get(pk=pereval_id)
+        with self.assertNumQueries(0):
+            PerevalInfoSerializer(pereval, context={}).fields['coords'].to_representation(pereval)
+
+    def test_legacy_coords_copied_on_save(self):
+        user = PerevalUser.objects.create(email="legacy@example.com", fam="Л", name="Л")
+        coords = PerevalCoords.objects.create(latitude=44.0, longitude=8.0, height=900)
+        pereval = PerevalAdded.objects.create(beauty_title="пер.", title="Л", user=user, coords=coords)
+        self.assertEqual((pereval.latitude, pereval.longitude, pereval.height), (44.0, 8.0, 900))
+
+
+class GuardedPatchTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.pereval_id = self.client.post('/api/submitData/', make_payload(), format='json').data['id']
+        self.url = f'/api/submitData/{self.pereval_id}/'
+
+    def test_get_returns_version_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], '"1"')
+
+    def test_patch_with_matching_if_match(self):
+        response = self.client.patch(self.url, {"title": "Новое"}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(PerevalAdded.objects.get(pk=self.pereval_id).title, "Новое")
+
+    def test_stale_if_match_rejected(self):
+        self.client.patch(self.url, {"title": "Первый редактор"}, format='json')
+
+        response = self.client.patch(self.url, {"title": "Второй редактор"}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(PerevalAdded.objects.get(pk=self.pereval_id).title, "Первый редактор")
+
+    def test_invalid_if_match(self):
+        response = self.client.patch(self.url, {"title": "Новое"}, format='json', HTTP_IF_MATCH='abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_patch_does_not_read_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {"title": "Новое", "level": {"winter": "1Б"}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'pereval_perevaladded' in q['sql']]
+        self.assertEqual(selects, [])
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "pereval_perevaladded"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"connect"', updates[0])
+
+    def test_patch_replaces_images(self):
+        images = [{"title": "Новое фото", "image_url": "https://example.com/new.jpg"}]
+        self.client.patch(self.url, {"images": images}, format='json')
+        self.assertEqual(list(PerevalImage.objects.filter(pereval_id=self.pereval_id).values_list('title', flat=True)),
+                         ["Новое фото"])
+
+    def test_empty_images_patch_changes_nothing(self):
+        with self.assertNoLogs('pereval.audit', 'INFO'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {"images": []}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(PerevalAdded.objects.get(pk=self.pereval_id).version, 1)
+        self.assertEqual(PerevalImage.objects.filter(pereval_id=self.pereval_id).count(), 1)
+
+        response = self.client.patch(self.url, {"images": []}, format='json', HTTP_IF_MATCH='"7"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.pereval_id = self.client.post('/api/submitData/', make_payload(), format='json').data['id']
+        self.url = f'/api/submitData/{self.pereval_id}/'
+        self.list_url = '/api/submitData/?user__email=qwerty@mail.ru'
+
+    def test_detail_not_modified_without_serializing(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_detail_if_modified_since(self):
+        last_modified = self.client.get(self.url)['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_patch_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.patch(self.url, {"title": "Новое"}, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], "Новое")
+
+    def test_moderation_bumps_version(self):
+        pereval = PerevalAdded.objects.get(pk=self.pereval_id)
+        updated_at = pereval.updated_at
+        pereval.status = 'accepted'
+        pereval.save()
+        pereval.refresh_from_db()
+        self.assertEqual(pereval.version, 2)
+        self.assertGreater(pereval.updated_at, updated_at)
+
+    def test_image_change_bumps_version(self):
+        PerevalImage.objects.create(pereval_id=self.pereval_id, title="Ещё", image_url="https://example.com/x.jpg")
+        self.assertEqual(PerevalAdded.objects.get(pk=self.pereval_id).version, 2)
+        PerevalImage.objects.filter(pereval_id=self.pereval_id).first().delete()
+        self.assertEqual(PerevalAdded.objects.get(pk=self.pereval_id).version, 3)
+
+    def test_list_not_modified_until_new_pereval(self):
+        etag = self.client.get(self.list_url)['ETag']
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post('/api/submitData/', make_payload(title="Второй"), format='json')
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+
+class DeltaSyncTestCase(TestCase):
+    url = '/api/submitData/changes/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.ids = [
+            self.client.post('/api/submitData/', make_payload(title=f"Перевал {i}"), format='json').data['id']
+            for i in range(3)
+        ]
+
+    def sync(self, since=None, **params):
+        params.setdefault('user__email', 'qwerty@mail.ru')
+        if since:
+            params['since'] = since
+        return self.client.get(self.url, params)
+
+    def test_initial_sync_returns_everything(self):
+        response = self.sync()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['changes']], self.ids)
+        self.assertEqual(response.data['changes'][0]['version'], 1)
+        self.assertEqual(response.data['deleted'], [])
+        self.assertFalse(response.data['has_more'])
+
+    def test_incremental_sync_returns_only_changes(self):
+        cursor = self.sync().data['next']
+        self.assertEqual(self.sync(cursor).data['changes'], [])
+
+        self.client.patch(f'/api/submitData/{self.ids[1]}/', {"title": "Новое"}, format='json')
+        pereval = PerevalAdded.objects.get(pk=self.ids[2])
+        pereval.status = 'accepted'
+        pereval.save()
+
+        response = self.sync(cursor)
+        self.assertEqual([item['id'] for item in response.data['changes']], self.ids[1:])
+        self.assertEqual(response.data['changes'][0]['title'], "Новое")
+        self.assertEqual(self.sync(response.data['next']).data['changes'], [])
+
+    def test_late_commit_behind_cursor_is_not_lost(self):
+        cursor = self.sync().data['next']
+        # Транзакция выставила updated_at раньше уже прочитанных записей, но зафиксировалась позже
+        late = PerevalAdded.objects.get(pk=self.ids[0])
+        PerevalAdded.objects.filter(pk=late.pk).update(
+            version=late.version + 1, updated_at=PerevalAdded.objects.get(pk=self.ids[1]).updated_at
+        )
+
+        response = self.sync(cursor)
+        self.assertEqual([item['id'] for item in response.data['changes']], [self.ids[0]])
+        self.assertEqual(self.sync(response.data['next']).data['changes'], [])
+
+    def test_archived_pereval_reported_as_deleted(self):
+        cursor = self.sync().data['next']
+        PerevalAdded.objects.filter(pk=self.ids[0]).update(
+            status='rejected', add_time=timezone.now() - timedelta(days=400)
+        )
+        archive_perevals(days=180)
+
+        response = self.sync(cursor)
+        self.assertEqual([item['id'] for item in response.data['deleted']], [self.ids[0]])
+        self.assertEqual(self.sync(response.data['next']).data['deleted'], [])
+
+    def test_pagination(self):
+        first = self.sync(limit=2)
+        self.assertEqual(len(first.data['changes']), 2)
+        self.assertTrue(first.data['has_more'])
+
+        second = self.sync(first.data['next'], limit=2)
+        self.assertEqual([item['id'] for item in second.data['changes']], self.ids[2:])
+        self.assertFalse(second.data['has_more'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.sync('не-курсор').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.sync(limit='abc').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unknown_user_gets_empty_result(self):
+        response = self.sync(user__email='nobody@example.com')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['changes'], [])
+
+
+@override_settings(ASYNC_INGEST=True)
+class AsyncIngestTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def submit(self, **kwargs):
+        return self.client.post('/api/submitData/', make_payload(**kwargs), format='json')
+
+    def test_post_queues_without_creating_pereval(self):
+        with self.assertNumQueries(1):
+            response = self.submit()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIsNone(response.data['id'])
+        self.assertFalse(PerevalAdded.objects.exists())
+
+        status_url = f"/api/submitData/queue/{response.data['tracking_id']}/"
+        self.assertEqual(self.client.get(status_url).data['state'], 'queued')
+
+    def test_invalid_data_rejected_immediately(self):
+        payload = make_payload()
+        del payload['title']
+        response = self.client.post('/api/submitData/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PerevalSubmission.objects.exists())
+
+    def test_drain_creates_perevals_in_batches(self):
+        tracking_ids = [self.submit(title=f"Перевал {i}").data['tracking_id'] for i in range(5)]
+        received_at = PerevalSubmission.objects.get(tracking_id=tracking_ids[0]).received_at
+
+        self.assertEqual(drain(batch_size=2, max_batches=1), (2, 0))
+        self.assertEqual(drain(batch_size=2), (3, 0))
+
+        self.assertEqual(PerevalAdded.objects.count(), 5)
+        self.assertEqual(PerevalUser.objects.count(), 1)
+        response = self.client.get(f'/api/submitData/queue/{tracking_ids[0]}/')
+        self.assertEqual(response.data['state'], 'done')
+        pereval = PerevalAdded.objects.get(pk=response.data['id'])
+        self.assertEqual(pereval.title, "Перевал 0")
+        self.assertEqual(pereval.add_time, received_at)
+        self.assertEqual(pereval.images.count(), 1)
+
+    def test_failed_submission_does_not_block_batch(self):
+        self.submit(title="Хороший")
+        PerevalSubmission.objects.create(payload={'title': 'Без остальных полей'})
+
+        self.assertEqual(drain_batch(), (1, 1))
+        failed = PerevalSubmission.objects.get(state='failed')
+        self.assertIn('beauty_title', failed.error)
+        self.assertEqual(PerevalAdded.objects.count(), 1)
+
+    def test_queue_metrics(self):
+        self.submit()
+        self.submit()
+        metrics = self.client.get('/api/submitData/queue/').data
+        self.assertEqual(metrics['depth'], 2)
+
+        call_command('drain_submissions', stdout=StringIO())
+        metrics = self.client.get('/api/submitData/queue/').data
+        self.assertEqual(metrics['depth'], 0)
+        self.assertEqual(metrics['processed_last_window'], 2)
+        self.assertGreater(metrics['drain_rate_per_second'], 0)
+
+    def test_unknown_tracking_id(self):
+        response = self.client.get('/api/submitData/queue/00000000-0000-0000-0000-000000000000/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+_flaky_calls = []
+
+
+@job('test_flaky', max_attempts=2)
+def flaky_job(fail_times):
+    _flaky_calls.append(fail_times)
+    if len(_flaky_calls) <= fail_times:
+        raise RuntimeError('временная ошибка')
+    return {'calls': len(_flaky_calls)}
+
+
+class BackgroundJobTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        _flaky_calls.clear()
+
+    @override_settings(POST_SUBMIT_JOBS=['detect_duplicates'])
+    def test_post_enqueues_with_one_insert(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/submitData/', make_payload(), format='json')
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/submitData/', make_payload(), format='json')
+        # Пересчёт статистики уже в очереди после первого перевала, поэтому вставка одна
+        job_inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "pereval_backgroundjob"')]
+        self.assertEqual(len(job_inserts), 1)
+
+        self.assertEqual(run_pending(concurrency=1), {'done': 2})
+        result = BackgroundJob.objects.get(payload__pereval_id=response.data['id']).result
+        self.assertEqual(len(result['duplicates']), 1)
+
+    @override_settings(POST_SUBMIT_JOBS=['detect_duplicates'])
+    def test_enqueue_after_commit_and_failure_does_not_fail_submit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/submitData/', make_payload(), format='json')
+        # До фиксации транзакции задачи не ставятся
+        self.assertFalse(BackgroundJob.objects.exists())
+        self.assertEqual(len(callbacks), 2)
+
+        with patch('pereval.jobs.enqueue_many', side_effect=OperationalError('нет соединения')), \
+                self.assertLogs('pereval.jobs', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/submitData/', make_payload(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(PerevalAdded.objects.filter(pk=response.data['id']).exists())
+
+    def test_retry_with_backoff(self):
+        enqueue('test_flaky', fail_times=1)
+        with self.assertLogs('pereval.jobs', 'WARNING'):
+            self.assertEqual(run_pending(concurrency=1), {'queued': 1})
+        background_job = BackgroundJob.objects.get()
+        self.assertEqual(background_job.attempts, 1)
+        self.assertIn('временная ошибка', background_job.last_error)
+        self.assertGreater(background_job.run_after, timezone.now())
+
+        # До истечения задержки задача не забирается
+        self.assertEqual(run_pending(concurrency=1), {})
+        BackgroundJob.objects.update(run_after=timezone.now())
+        self.assertEqual(run_pending(concurrency=1), {'done': 1})
+        self.assertEqual(BackgroundJob.objects.get().result, {'calls': 2})
+
+    def test_fails_after_max_attempts(self):
+        enqueue('test_flaky', fail_times=5)
+        with self.assertLogs('pereval.jobs', 'WARNING'):
+            run_pending(concurrency=1)
+            BackgroundJob.objects.update(run_after=timezone.now())
+            self.assertEqual(run_pending(concurrency=1), {'failed': 1})
+        self.assertEqual(BackgroundJob.objects.get().state, 'failed')
+
+    def test_unknown_job_rejected_on_enqueue(self):
+        with self.assertRaises(LookupError):
+            enqueue('no_such_job')
+
+    def test_claim_marks_running_and_requeues_stale(self):
+        enqueue('detect_duplicates', pereval_id=0)
+        self.assertEqual(len(claim(10)), 1)
+        self.assertEqual(claim(10), [])
+
+        BackgroundJob.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        call_command('run_jobs', concurrency=1, stdout=StringIO())
+        self.assertEqual(BackgroundJob.objects.get().state, 'done')
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    """Локальная замена внешнего хостинга картинок"""
+    routes = {}
+
+    def do_GET(self):
+        if self.path not in self.routes:
+            self.send_error(404)
+            return
+        content_type, body = self.routes[self.path]
+        if content_type == 'redirect':
+            self.send_response(302)
+            self.send_header('Location', body)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_png(size=(800, 600), color=(200, 30, 30)):
+    output = BytesIO()
+    Image.new('RGB', size, color).save(output, 'PNG')
+    return output.getvalue()
+
+
+class ImageCheckTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _ImageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f'http://127.0.0.1:{cls.server.server_port}'
+        _ImageHandler.routes = {
+            '/photo.png': ('image/png', make_png()),
+            '/copy.png': ('image/png', make_png()),
+            '/page.html': ('text/html', b'<html></html>'),
+            '/broken.png': ('image/png', b'not an image'),
+            '/redirect.png': ('redirect', 'http://169.254.169.254/latest/meta-data/'),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.thumbnail_dir = tempfile.mkdtemp()
+        # Локальный сервер картинок слушает 127.0.0.1
+        self.settings_override = override_settings(
+            THUMBNAIL_DIR=self.thumbnail_dir, THUMBNAIL_WORKERS=0, IMAGE_FETCH_ALLOW_PRIVATE=True
+        )
+        self.settings_override.enable()
+        payload = make_payload()
+        payload['images'] = [
+            {"title": title, "image_url": f'{self.base}/{path}'}
+            for title, path in [("Фото", 'photo.png'), ("Копия", 'copy.png'), ("Страница", 'page.html'),
+                                ("Битое", 'broken.png'), ("Нет", 'missing.png')]
+        ]
+        self.pereval_id = self.client.post('/api/submitData/', payload, format='json').data['id']
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.thumbnail_dir)
+
+    def test_check_images_statuses(self):
+        self.assertEqual(check_images(PerevalImage.objects.filter(pereval_id=self.pereval_id)), 2)
+        images = {img.title: img for img in PerevalImage.objects.filter(pereval_id=self.pereval_id)}
+        self.assertEqual(images["Фото"].url_status, 'ok')
+        self.assertIn('text/html', images["Страница"].url_error)
+        self.assertEqual(images["Битое"].url_status, 'broken')
+        self.assertIn('404', images["Нет"].url_error)
+        # Одинаковое содержимое — один файл миниатюры
+        self.assertEqual(images["Фото"].thumbnail, images["Копия"].thumbnail)
+        self.assertEqual(PerevalAdded.objects.get(pk=self.pereval_id).version, 1)
+
+    def test_thumbnail_size_and_serving(self):
+        check_images(PerevalImage.objects.filter(pereval_id=self.pereval_id))
+        response = self.client.get(f'/api/submitData/{self.pereval_id}/', {'thumbnails': '1'})
+        url = response.data['images'][0]['thumbnail_url']
+
+        thumbnail = self.client.get(url)
+        self.assertEqual(thumbnail['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', thumbnail['Cache-Control'])
+        with Image.open(BytesIO(b''.join(thumbnail.streaming_content))) as image:
+            self.assertEqual(image.size, (128, 96))
+
+        self.assertNotIn('thumbnail_url', self.client.get(f'/api/submitData/{self.pereval_id}/').data['images'][0])
+        self.assertEqual(self.client.get('/api/thumbnails/..%2Fsecret').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_fetch_respects_concurrency(self):
+        urls = [f'{self.base}/photo.png'] * 3 + [f'{self.base}/copy.png']
+        results = asyncio.run(fetch_images(urls, concurrency=1))
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(isinstance(data, bytes) for data in results.values()))
+
+    @override_settings(IMAGE_FETCH_ALLOW_PRIVATE=False)
+    def test_internal_addresses_rejected(self):
+        for url in [f'{self.base}/photo.png', 'http://169.254.169.254/latest/meta-data/',
+                    'http://10.0.0.1/photo.png', 'http://[::1]/photo.png', 'file:///etc/passwd']:
+            with self.subTest(url=url), self.assertRaises(ImageCheckError):
+                download_image(url, timeout=1)
+
+    @override_settings(IMAGE_FETCH_ALLOW_PRIVATE=False)
+    def test_redirect_to_internal_address_rejected(self):
+        real_check = images.check_address
+
+        def allow_test_server(address):
+            if address != '127.0.0.1':
+                real_check(address)
+
+        with patch('pereval.images.check_address', side_effect=allow_test_server):
+            self.assertTrue(download_image(f'{self.base}/photo.png', timeout=1))
+            with self.assertRaisesRegex(ImageCheckError, 'Адрес 169.254.169.254'):
+                download_image(f'{self.base}/redirect.png', timeout=1)
+
+    @override_settings(IMAGE_FETCH_ALLOW_PRIVATE=False)
+    def test_host_with_any_internal_address_rejected(self):
+        with patch('pereval.images.socket.getaddrinfo', return_value=[
+            (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', 80)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 80)),
+        ]), patch('pereval.images.socket.create_connection') as create_connection:
+            with self.assertRaisesRegex(ImageCheckError, 'Адрес 127.0.0.1'):
+                download_image('http://mixed.example.com/photo.png', timeout=1)
+        create_connection.assert_not_called()
+
+    def test_process_pool(self):
+        thumbnails = build_thumbnails({'a': make_png(), 'b': make_png(color=(0, 0, 255)), 'c': b'bad'}, workers=2)
+        self.assertTrue(os.path.exists(thumbnail_path(thumbnails['a'])))
+        self.assertNotEqual(thumbnails['a'], thumbnails['b'])
+        self.assertIsInstance(thumbnails['c'], ImageCheckError)
+
+    @override_settings(POST_SUBMIT_JOBS=['check_images'])
+    def test_patched_images_are_checked(self):
+        images = [{"title": "Новое", "image_url": f'{self.base}/photo.png'}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/submitData/{self.pereval_id}/', {'images': images}, format='json')
+        self.assertEqual(response.data['state'], 1)
+        self.assertEqual(BackgroundJob.objects.get(name='check_images').payload, {'pereval_id': self.pereval_id})
+
+        self.assertEqual(run_pending(concurrency=1), {'done': 1})
+        self.assertEqual(PerevalImage.objects.get(pereval_id=self.pereval_id).url_status, 'ok')
+
+    def test_job_and_admin_preview(self):
+        enqueue('check_images', pereval_id=self.pereval_id)
+        self.assertEqual(run_pending(concurrency=1), {'done': 1})
+        self.assertEqual(BackgroundJob.objects.get().result, {'checked': 5, 'ok': 2})
+
+        image = PerevalImage.objects.get(pereval_id=self.pereval_id, title="Фото")
+        preview = PerevalImageAdmin(PerevalImage, admin.site).image_preview(image)
+        self.assertIn('/api/thumbnails/', preview)
+
+
+class StatsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.post('/api/submitData/', make_payload(height=1200), format='json')
+        self.client.post('/api/submitData/', make_payload(height=1499, latitude=-0.5, longitude=-70.2), format='json')
+        pereval_id = self.client.post('/api/submitData/', make_payload(height=2100), format='json').data['id']
+        PerevalAdded.objects.filter(pk=pereval_id).update(status='accepted', level_winter='2Б')
+
+    def test_stats_after_refresh(self):
+        self.assertEqual(self.client.get('/api/stats/').data['total'], 0)
+
+        call_command('refresh_stats', stdout=StringIO())
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/stats/').data
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['status'], {'accepted': 1, 'new': 2})
+        self.assertEqual(data['level_winter'], {'': 2, '2Б': 1})
+        self.assertEqual(data['height'], {'1000-1499': 2, '2000-2499': 1})
+        self.assertEqual(data['region'], {'45N007E': 2, '01S071W': 1})
+
+    def test_changes_schedule_one_refresh(self):
+        refresh_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            pereval_id = self.client.post('/api/submitData/', make_payload(height=3100), format='json').data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/submitData/{pereval_id}/', {'coords': {'height': 700}}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            pereval = PerevalAdded.objects.get(pk=pereval_id)
+            pereval.status = 'accepted'
+            pereval.save()
+        self.assertEqual(BackgroundJob.objects.filter(name='refresh_stats', state='queued').count(), 1)
+        self.assertEqual(get_stats()['total'], 3)
+
+        BackgroundJob.objects.filter(name='refresh_stats').update(run_after=timezone.now())
+        self.assertEqual(run_pending(concurrency=1), {'done': 1})
+        data = get_stats()
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(data['status'], {'accepted': 2, 'new': 2})
+        self.assertEqual(data['height'], {'500-999': 1, '1000-1499': 2, '2000-2499': 1})
+
+    def test_not_modified_until_refresh(self):
+        refresh_stats()
+        etag = self.client.get('/api/stats/')['ETag']
+        self.assertEqual(self.client.get('/api/stats/', HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+    def test_view_survives_partitioning(self):
+        convert_to_partitioned(months_ahead=0)
+        refresh_stats()
+        self.assertEqual(get_stats()['total'], 3)
+
+
+class MapTileTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ids = [
+            self.client.post('/api/submitData/', make_payload(latitude=lat, longitude=lon), format='json').data['id']
+            for lat, lon in [(45.3842, 7.1525), (45.3850, 7.1530), (43.35, 42.45)]
+        ]
+
+    def grid_snapshot(self):
+        return sorted(
+            (c.zoom, c.cell_x, c.cell_y, c.count, round(c.sum_latitude, 6), round(c.sum_longitude, 6),
+             c.representative_id)
+            for c in MapGridCell.objects.all()
+        )
+
+    def test_world_tile_clusters(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/map/tiles/3/4/2/')
+        clusters = response.data['clusters']
+        self.assertEqual(sorted(c['count'] for c in clusters), [1, 2])
+        alps = next(c for c in clusters if c['count'] == 2)
+        self.assertEqual(alps['id'], self.ids[1])
+        self.assertAlmostEqual(alps['latitude'], 45.3846)
+
+    def test_points_beyond_cluster_zoom(self):
+        x, y = (int(v * (1 << 17)) for v in world_position(45.3842, 7.1525))
+        with override_settings(MAP_CLUSTER_MAX_ZOOM=16):
+            clusters = self.client.get(f'/api/map/tiles/17/{x}/{y}/').data['clusters']
+        self.assertEqual([(c['id'], c['count']) for c in clusters], [(self.ids[0], 1)])
+
+    def test_incremental_updates_match_rebuild(self):
+        self.client.patch(f'/api/submitData/{self.ids[0]}/',
+                          {"coords": {"latitude": 43.36, "longitude": 42.44, "height": 1500}}, format='json')
+        PerevalAdded.objects.filter(pk=self.ids[1]).update(
+            status='rejected', add_time=timezone.now() - timedelta(days=400)
+        )
+        archive_perevals(days=180)
+
+        incremental = self.grid_snapshot()
+        call_command('rebuild_map_grid', stdout=StringIO())
+        self.assertEqual(incremental, self.grid_snapshot())
+        self.assertEqual([c['count'] for c in self.client.get('/api/map/tiles/0/0/0/').data['clusters']], [2])
+
+    def test_low_zooms_are_not_stored(self):
+        self.assertFalse(MapGridCell.objects.filter(zoom__lt=settings.MAP_GRID_MIN_ZOOM).exists())
+        with self.assertNumQueries(1):
+            clusters = self.client.get('/api/map/tiles/0/0/0/').data['clusters']
+        self.assertEqual([(c['count'], c['id']) for c in clusters], [(3, self.ids[2])])
+
+        # Собранный при чтении тайл совпадает с тайлом по хранимой сетке
+        with override_settings(MAP_GRID_MIN_ZOOM=0):
+            call_command('rebuild_map_grid', stdout=StringIO())
+            stored = self.client.get('/api/map/tiles/2/2/1/').data['clusters']
+        call_command('rebuild_map_grid', stdout=StringIO())
+        self.assertEqual(self.client.get('/api/map/tiles/2/2/1/').data['clusters'], stored)
+
+    def test_binary_encoding(self):
+        response = self.client.get('/api/map/tiles/3/4/2/', {'encoding': 'binary'})
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        clusters = decode_tile(response.content)
+        self.assertEqual(len(response.content), 9 + 16 * len(clusters))
+        self.assertEqual(sorted(count for _, _, count, _ in clusters), [1, 2])
+
+    def test_invalid_tile(self):
+        self.assertEqual(self.client.get('/api/map/tiles/1/2/0/').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MultiGetTestCase(TestCase):
+    url = '/api/submitData/batch/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.ids = [
+            self.client.post('/api/submitData/', make_payload(title=f"Перевал {i}"), format='json').data['id']
+            for i in range(3)
+        ]
+
+    def test_get_preserves_order_and_reports_missing(self):
+        ids = [self.ids[2], 999999, self.ids[0], self.ids[2]]
+        # Перевалы, их изображения и проверка архива для отсутствующего id
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['perevals']], [self.ids[2], self.ids[0]])
+        self.assertEqual(response.data['missing'], [999999])
+        self.assertEqual(response.data['perevals'][0]['title'], "Перевал 2")
+
+    def test_post_body_and_fixed_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {'ids': self.ids}, format='json')
+        self.assertEqual(len(response.data['perevals']), 3)
+        self.assertEqual(response.data['missing'], [])
+
+    def test_includes_archived(self):
+        PerevalAdded.objects.filter(pk=self.ids[0]).update(
+            status='rejected', add_time=timezone.now() - timedelta(days=400)
+        )
+        archive_perevals(days=180)
+        response = self.client.get(self.url, {'ids': f'{self.ids[0]},{self.ids[1]}'})
+        self.assertEqual([item['id'] for item in response.data['perevals']], self.ids[:2])
+        self.assertIn('archived_at', response.data['perevals'][0])
+
+    @override_settings(MULTI_GET_MAX_IDS=2)
+    def test_limits_and_invalid_input(self):
+        self.assertEqual(self.client.get(self.url, {'ids': '1,2,3'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'ids': '1,abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(self.url, {'ids': '1'}, format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+class SparseFieldsTestCase(TestCase):
+    list_url = '/api/submitData/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.ids = [
+            self.client.post('/api/submitData/', make_payload(title=f"Перевал {i}"), format='json').data['id']
+            for i in range(3)
+        ]
+
+    def get_list(self, **params):
+        return self.client.get(self.list_url, {'user__email': 'qwerty@mail.ru', **params})
+
+    def test_compact_listing_reads_only_requested_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_list(fields='title,status,coords')
+        self.assertEqual(list(response.data[0]), ['id', 'title', 'status', 'coords'])
+        self.assertEqual(response.data[0]['coords'], {'latitude': 45.3842, 'longitude': 7.1525, 'height': 1200})
+
+        sql = queries.captured_queries[-1]['sql']
+        self.assertNotIn('"connect"', sql)
+        self.assertNotIn('"pereval_perevaluser"."fam"', sql)
+        self.assertFalse(any('pereval_perevalimage' in q['sql'] for q in queries.captured_queries))
+
+    def test_expand_adds_nested_objects(self):
+        response = self.get_list(fields='title', expand='images,user')
+        self.assertEqual(set(response.data[0]), {'id', 'title', 'images', 'user'})
+        self.assertEqual(response.data[0]['user']['email'], 'qwerty@mail.ru')
+        self.assertEqual(len(response.data[0]['images']), 1)
+
+    def test_full_shape_by_default(self):
+        full = self.get_list().data[0]
+        self.assertIn('connect', full)
+        self.assertIn('images', full)
+        compact = self.get_list(fields='title,status,coords').data
+        self.assertLess(len(json.dumps(compact)), len(json.dumps(self.get_list().data)) / 2)
+
+    def test_detail_and_batch(self):
+        response = self.client.get(f'/api/submitData/{self.ids[0]}/', {'fields': 'title'})
+        self.assertEqual(response.data, {'id': self.ids[0], 'title': "Перевал 0"})
+        self.assertEqual(response['ETag'], '"1"')
+
+        ids = ','.join(map(str, self.ids))
+        response = self.client.get('/api/submitData/batch/', {'ids': ids, 'fields': 'status'})
+        self.assertEqual(response.data['perevals'][2], {'id': self.ids[2], 'status': 'new'})
+
+    def test_unknown_fields_rejected(self):
+        self.assertEqual(self.get_list(fields='title,password').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_list(fields='title', expand='connect').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def _drain_bucket(path, key, count):
+    """Выполняется в дочернем процессе: забирает count токенов из общей корзины"""
+    store = BucketStore(path, 1024)
+    for _ in range(count):
+        store.consume(key, 5, 0.001)
+
+
+class ThrottlingTestCase(TestCase):
+    rates = {'write_ip': '5/min', 'write_email': '2/min', 'read_ip': '4/min', 'read_email': '3/min'}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmp_dir, 'throttle')
+        self.settings_override = override_settings(
+            THROTTLE_ENABLED=True, THROTTLE_STATE_FILE=self.state_file, THROTTLE_SLOTS=1024,
+            REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': self.rates},
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def post(self, email):
+        return self.client.post('/api/submitData/', make_payload(email=email), format='json')
+
+    def test_write_limit_per_email_and_ip(self):
+        self.assertEqual(self.post('a@mail.ru').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.post('a@mail.ru').status_code, status.HTTP_201_CREATED)
+        response = self.post('a@mail.ru')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        # Другой автор с того же IP упирается в лимит по IP (5 запросов)
+        self.assertEqual(self.post('b@mail.ru').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.post('b@mail.ru').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.post('c@mail.ru').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(PerevalAdded.objects.count(), 4)
+
+    def test_reads_limited_without_queries(self):
+        self.post('a@mail.ru')
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/submitData/', {'user__email': 'a@mail.ru'}).status_code,
+                             status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/submitData/', {'user__email': 'a@mail.ru'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(len(queries), 0)
+
+        # Запись ограничивается отдельно от чтения
+        self.assertEqual(self.post('a@mail.ru').status_code, status.HTTP_201_CREATED)
+
+    def read_as(self, forwarded_for, remote_addr='10.0.0.1'):
+        return self.client.get(
+            '/api/submitData/', HTTP_X_FORWARDED_FOR=forwarded_for, REMOTE_ADDR=remote_addr
+        ).status_code
+
+    def test_spoofed_forwarded_for_does_not_reset_bucket(self):
+        # Без доверенных прокси заголовок игнорируется: лимит по адресу соединения
+        codes = [self.read_as(f'203.0.113.{i}') for i in range(5)]
+        self.assertEqual(codes[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_forwarded_for_behind_trusted_proxy(self):
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': self.rates, 'NUM_PROXIES': 1}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            # Клиент подставляет произвольный адрес в начало, прокси дописывает настоящий в конец
+            codes = [self.read_as(f'203.0.113.{i}, 198.51.100.7') for i in range(5)]
+            self.assertEqual(codes[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+            # Другой настоящий клиент за тем же прокси получает свою корзину
+            self.assertNotEqual(self.read_as('198.51.100.8'), status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_bucket_refills(self):
+        store = BucketStore(self.state_file, 1024)
+        results = [store.consume('k', 2, 1.0, now=100.0)[0] for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        allowed, wait = store.consume('k', 2, 1.0, now=100.0)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 1.0)
+        self.assertTrue(store.consume('k', 2, 1.0, now=101.0)[0])
+        self.assertTrue(store.consume('other', 2, 1.0, now=101.0)[0])
+
+    def test_state_shared_between_processes(self):
+        process = multiprocessing.get_context('fork').Process(
+            target=_drain_bucket, args=(self.state_file, 'shared', 5)
+        )
+        process.start()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+        self.assertFalse(BucketStore(self.state_file, 1024).consume('shared', 5, 0.001)[0])
+
+    def test_metrics(self):
+        self.post('a@mail.ru')
+        self.post('a@mail.ru')
+        self.post('a@mail.ru')
+        response = self.client.get('/api/throttle/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['write_email'], {'allowed': 2, 'throttled': 1, 'rate': '2/min'})
+        self.assertEqual(response.data['write_ip']['allowed'], 3)
+        self.assertEqual(response.data['read_ip'], {'allowed': 0, 'throttled': 0, 'rate': '4/min'})
+
+
+@override_settings(
+    DATABASE_SHARDS=['default', 'shard1'], SHARD_REGIONS={'45N007E': 'default', '43N042E': 'shard1'}
+)
+class ShardingTestCase(TestCase):
+    databases = {'default', 'shard1'}
+
+    def setUp(self):
+        self.client = APIClient()
+        call_command('setup_shards', skip_migrate=True, stdout=StringIO())
+        self.alps_id = self.client.post('/api/submitData/', make_payload(), format='json').data['id']
+        self.caucasus_id = self.client.post(
+            '/api/submitData/', make_payload(title="Джантуган", latitude=43.2, longitude=42.7, height=3500),
+            format='json'
+        ).data['id']
+
+    def test_rows_routed_by_region_with_global_ids(self):
+        self.assertLess(self.alps_id, 1 << 48)
+        self.assertGreater(self.caucasus_id, 1 << 48)
+        self.assertEqual(list(PerevalAdded.objects.values_list('id', flat=True)), [self.alps_id])
+        shard = PerevalAdded.objects.using('shard1')
+        self.assertEqual(list(shard.values_list('title', flat=True)), ["Джантуган"])
+        self.assertEqual(PerevalImage.objects.using('shard1').filter(pereval_id=self.caucasus_id).count(), 1)
+        self.assertTrue(PerevalUser.objects.using('shard1').filter(email="qwerty@mail.ru").exists())
+
+    def test_detail_resolves_shard_without_fanout(self):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['shard1']) as shard:
+            response = self.client.get(f'/api/submitData/{self.caucasus_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], "Джантуган")
+        self.assertEqual(len(primary), 0)
+        self.assertGreater(len(shard), 0)
+
+        response = self.client.patch(f'/api/submitData/{self.caucasus_id}/', {'title': "Джантуган Восточный"},
+                                     format='json')
+        self.assertEqual(response.data, {'state': 1})
+        self.assertEqual(PerevalAdded.objects.using('shard1').get().title, "Джантуган Восточный")
+
+        unknown = (5 << 48) + 1
+        self.assertEqual(self.client.get(f'/api/submitData/{unknown}/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_by_email_gathers_all_shards(self):
+        response = self.client.get('/api/submitData/', {'user__email': "qwerty@mail.ru"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['title'] for item in response.data], ["Пхия", "Джантуган"])
+        self.assertEqual(response.data[1]['coords']['height'], 3500)
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/submitData/', {'user__email': "qwerty@mail.ru"},
+                                         HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_batch_groups_ids_by_shard(self):
+        ids = f'{self.caucasus_id},{self.alps_id},{self.caucasus_id + 1}'
+        response = self.client.get('/api/submitData/batch/', {'ids': ids, 'fields': 'title'})
+        self.assertEqual(response.data['perevals'], [
+            {'id': self.caucasus_id, 'title': "Джантуган"}, {'id': self.alps_id, 'title': "Пхия"}
+        ])
+        self.assertEqual(response.data['missing'], [self.caucasus_id + 1])
+
+    def test_shard_rows_in_changes_stats_tiles_and_archive(self):
+        changes = self.client.get('/api/submitData/changes/', {'user__email': "qwerty@mail.ru"}).data
+        self.assertEqual([item['id'] for item in changes['changes']], [self.alps_id, self.caucasus_id])
+
+        refresh_stats()
+        stats = get_stats()
+        self.assertEqual(stats['total'], 2)
+        self.assertEqual(stats['region'], {'43N042E': 1, '45N007E': 1})
+
+        x, y = (int(v * (1 << 17)) for v in world_position(43.2, 42.7))
+        with override_settings(MAP_CLUSTER_MAX_ZOOM=16):
+            clusters = self.client.get(f'/api/map/tiles/17/{x}/{y}/').data['clusters']
+        self.assertEqual([c['id'] for c in clusters], [self.caucasus_id])
+
+        PerevalAdded.objects.using('shard1').filter(pk=self.caucasus_id).update(
+            status='rejected', add_time=timezone.now() - timedelta(days=400)
+        )
+        self.assertEqual(archive_perevals(days=180), 1)
+        self.assertFalse(PerevalAdded.objects.using('shard1').filter(pk=self.caucasus_id).exists())
+        archived = PerevalArchive.objects.using('default').get(pk=self.caucasus_id)
+        self.assertEqual(archived.user.email, "qwerty@mail.ru")
+        self.assertEqual(archived.images.count(), 1)
+        self.assertEqual(self.client.get(f'/api/submitData/{self.caucasus_id}/').data['status'], 'rejected')
+        incremental = sorted(MapGridCell.objects.values_list('zoom', 'cell_x', 'cell_y', 'count', 'representative_id'))
+        call_command('rebuild_map_grid', stdout=StringIO())
+        self.assertEqual(incremental, sorted(
+            MapGridCell.objects.values_list('zoom', 'cell_x', 'cell_y', 'count', 'representative_id')
+        ))
+
+        changes = self.client.get('/api/submitData/changes/', {'user__email': "qwerty@mail.ru",
+                                                               'since': changes['next']}).data
+        self.assertEqual([item['id'] for item in changes['deleted']], [self.caucasus_id])
+
+    @override_settings(ASYNC_INGEST=True, POST_SUBMIT_JOBS=['detect_duplicates'])
+    def test_failed_ingest_leaves_nothing_in_shard(self):
+        self.client.post('/api/submitData/', make_payload(title="Эльбрус", latitude=43.3, longitude=42.4),
+                         format='json')
+        with patch.object(PerevalImage.objects, 'bulk_create', side_effect=OperationalError('сбой')), \
+                self.captureOnCommitCallbacks(using='shard1') as callbacks:
+            self.assertEqual(drain_batch(), (0, 1))
+        self.assertEqual(callbacks, [])
+        self.assertFalse(PerevalAdded.objects.using('shard1').filter(title="Эльбрус").exists())
+
+        PerevalSubmission.objects.update(state='queued')
+        with self.captureOnCommitCallbacks(using='shard1') as callbacks:
+            self.assertEqual(drain_batch(), (1, 0))
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(PerevalAdded.objects.using('shard1').filter(title="Эльбрус").count(), 1)
+
+    def test_check_images_covers_all_shards(self):
+        seen = []
+
+        def fake_check(batch):
+            seen.extend(image.pereval_id for image in batch)
+            return len(batch)
+
+        out = StringIO()
+        with patch('pereval.management.commands.check_images.check_images', side_effect=fake_check):
+            call_command('check_images', stdout=out)
+        self.assertEqual(seen, [self.alps_id, self.caucasus_id])
+        self.assertIn('Проверено изображений: 2', out.getvalue())
+
+    def test_region_code_matches_stats(self):
+        self.assertEqual(region_code(45.3842, 7.1525), '45N007E')
+        self.assertEqual(region_code(-0.5, -70.2), '01S071W')
+
+
+class CompressionTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(10):
+            self.client.post('/api/submitData/', make_payload(title=f"Перевал {i}"), format='json')
+        self.pereval_id = PerevalAdded.objects.order_by('id').values_list('id', flat=True).first()
+        get_compression_cache().clear()
+
+    def get_list(self, **headers):
+        return self.client.get('/api/submitData/', {'user__email': 'qwerty@mail.ru'}, **headers)
+
+    def test_gzip_listing(self):
+        plain = self.get_list()
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.get_list(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(int(response['Content-Length']), len(plain.content))
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        cached = self.get_list(HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_compressed_bytes_reused(self):
+        cache = get_compression_cache()
+        first = self.get_list(HTTP_ACCEPT_ENCODING='gzip').content
+        second = self.get_list(HTTP_ACCEPT_ENCODING='gzip').content
+        self.assertEqual(first, second)
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+        self.client.patch(f'/api/submitData/{self.pereval_id}/', {'title': "Новое название"}, format='json')
+        self.get_list(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(cache.misses, 2)
+
+    @skipUnless(compression.brotli, 'Пакет Brotli не установлен')
+    def test_brotli_preferred(self):
+        response = self.get_list(HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(response.content), self.get_list().content)
+
+    def test_small_responses_not_compressed(self):
+        response = self.client.get(f'/api/submitData/{self.pereval_id}/', {'fields': 'title'},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response.data['title'], "Перевал 0")
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip;q=0.5, identity'), 'gzip')
+        self.assertIsNone(negotiate('gzip;q=0, identity'))
+        self.assertIsNone(negotiate(''))
+        self.assertEqual(negotiate('*'), compression.available_encodings()[0])
+        self.assertEqual(negotiate('br;q=0, *'), 'gzip')
+
+
+class PrevalidationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def bad_payloads(self):
+        payloads = {}
+        payload = make_payload(latitude=91.5)
+        payloads['latitude'] = payload
+        payload = make_payload(longitude=-200)
+        payloads['longitude'] = payload
+        payload = make_payload(title="П" * 101)
+        payloads['title'] = payload
+        payload = make_payload()
+        payload['beauty_title'] = "   "
+        payloads['blank'] = payload
+        payload = make_payload()
+        del payload['user']['email']
+        payload['user']['fam'] = None
+        payloads['user'] = payload
+        payload = make_payload()
+        payload['coords'] = [45.3, 7.1]
+        payloads['coords'] = payload
+        payload = make_payload(height=1200.5)
+        payloads['height'] = payload
+        payload = make_payload()
+        payload['images'] = [{"title": "Фото", "image_url": "https://example.com/1.jpg"}, {"title": ""}]
+        payloads['image_item'] = payload
+        payload = make_payload()
+        payload['images'] = {"title": "Фото"}
+        payloads['images_type'] = payload
+        return payloads
+
+    def test_errors_match_serializer(self):
+        for name, payload in self.bad_payloads().items():
+            with self.subTest(name):
+                errors = validate_submit(payload)
+                self.assertIsNotNone(errors)
+                serializer = PerevalAddedSerializer(data=payload)
+                self.assertFalse(serializer.is_valid())
+                self.assertEqual(json.loads(json.dumps(serializer.errors)), errors)
+
+        self.assertEqual(validate_submit([1, 2]), {
+            'non_field_errors': ['Invalid data. Expected a dictionary, but got list.']
+        })
+        self.assertIsNone(validate_submit(make_payload()))
+
+    def test_rejected_before_serializer(self):
+        with patch('pereval.views.PerevalAddedSerializer', side_effect=AssertionError('serializer создан')):
+            response = self.client.post('/api/submitData/', make_payload(latitude=-95), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['status'], 400)
+        self.assertEqual(response.data['message'], 'Неверные данные')
+        self.assertIsNone(response.data['id'])
+        self.assertEqual(response.data['errors'], {
+            'coords': {'latitude': ['Ensure this value is greater than or equal to -90.']}
+        })
+        self.assertFalse(PerevalAdded.objects.exists())
+
+    @override_settings(SUBMIT_MAX_IMAGES=2)
+    def test_too_many_images(self):
+        payload = make_payload()
+        payload['images'] = payload['images'] * 3
+        response = self.client.post('/api/submitData/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'], {'images': ['Ensure this field has no more than 2 elements.']})
+
+        # Сериализатор применяет тот же лимит
+        serializer = PerevalAddedSerializer(data=payload)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('images', serializer.errors)
+
+    def test_patch_prevalidated(self):
+        pereval_id = self.client.post('/api/submitData/', make_payload(), format='json').data['id']
+        url = f'/api/submitData/{pereval_id}/'
+
+        response = self.client.patch(url, {"level": "1А"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['state'], 0)
+        self.assertIn('level', response.data['message'])
+
+        response = self.client.patch(url, {"coords": {"latitude": 100}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['message'], {
+            'coords': {'latitude': ['Ensure this value is less than or equal to 90.']}
+        })
+
+        response = self.client.patch(url, {"coords": {"latitude": 46.1}, "level": {"winter": "1Б"}}, format='json')
+        self.assertEqual(response.data, {'state': 1})
+
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ids = [
+            self.client.post('/api/submitData/', make_payload(title=f"Перевал {i}"), format='json').data['id']
+            for i in range(3)
+        ]
+        PerevalAdded.objects.filter(id__in=self.ids[:2]).update(status='accepted')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            SNAPSHOT_FILE=os.path.join(self.tmp_dir, 'accepted.snap'), SNAPSHOT_CHECK_SECONDS=0
+        )
+        self.settings_override.enable()
+        reset_snapshot()
+
+    def tearDown(self):
+        reset_snapshot()
+        self.settings_override.disable()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def url(self, pk):
+        return f'/api/submitData/{pk}/'
+
+    def test_accepted_served_without_queries(self):
+        expected = self.client.get(self.url(self.ids[0]))
+        path, count, size = build_snapshot()
+        self.assertEqual(count, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url(self.ids[0]))
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+        self.assertEqual(response['Last-Modified'], expected['Last-Modified'])
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(self.url(self.ids[0]), HTTP_IF_NONE_MATCH=expected['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 0)
+
+        response = self.client.get(self.url(self.ids[1]), {'fields': 'title,coords'})
+        self.assertEqual(response.data, {
+            'id': self.ids[1], 'title': "Перевал 1",
+            'coords': {'latitude': 45.3842, 'longitude': 7.1525, 'height': 1200}
+        })
+
+    def test_other_passes_read_from_db(self):
+        build_snapshot()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url(self.ids[2]))
+        self.assertEqual(response.data['status'], 'new')
+        self.assertGreater(len(queries), 0)
+        self.assertEqual(self.client.get(self.url(self.ids[2] + 100)).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rebuild_swaps_snapshot(self):
+        build_snapshot()
+        old = get_snapshot()
+        self.assertEqual(self.client.get(self.url(self.ids[0])).json()['title'], "Перевал 0")
+
+        PerevalAdded.objects.filter(id=self.ids[0]).touch(title="Переименован")
+        build_snapshot()
+        self.assertEqual(self.client.get(self.url(self.ids[0])).json()['title'], "Переименован")
+        self.assertIsNot(get_snapshot(), old)
+        # Запрос, получивший старый снимок до замены, дочитывает его
+        self.assertEqual(json.loads(bytes(old.lookup(self.ids[0])[2]))['title'], "Перевал 0")
+
+    def test_status_change_invalidates_snapshot(self):
+        build_snapshot()
+        self.assertIsNotNone(get_snapshot())
+
+        for status_to in ('rejected', 'accepted'):
+            pereval = PerevalAdded.objects.get(pk=self.ids[0])
+            pereval.status = status_to
+            with self.captureOnCommitCallbacks(execute=True):
+                pereval.save()
+        self.assertIsNone(get_snapshot())
+        self.assertEqual(self.client.get(self.url(self.ids[0])).data['status'], 'accepted')
+        self.assertEqual(BackgroundJob.objects.filter(name='build_snapshot', state='queued').count(), 1)
+
+        self.assertEqual(run_pending(concurrency=1), {})
+        BackgroundJob.objects.filter(name='build_snapshot').update(run_after=timezone.now())
+        self.assertEqual(run_pending(concurrency=1), {'done': 1})
+        self.assertEqual(get_snapshot().count, 2)
+
+    def test_image_change_invalidates_snapshot(self):
+        build_snapshot()
+        image = PerevalImage.objects.filter(pereval_id=self.ids[2]).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        self.assertIsNotNone(get_snapshot())
+
+        image = PerevalImage.objects.filter(pereval_id=self.ids[0]).first()
+        image.title = 'Новая подпись'
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        self.assertIsNone(get_snapshot())
+        self.assertEqual(BackgroundJob.objects.filter(name='build_snapshot', state='queued').count(), 1)
+
+        build_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertIsNone(get_snapshot())
+
+    def test_delete_invalidates_snapshot(self):
+        build_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            PerevalAdded.objects.get(pk=self.ids[2]).delete()
+        self.assertIsNotNone(get_snapshot())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PerevalAdded.objects.filter(pk=self.ids[0]).delete()
+        self.assertIsNone(get_snapshot())
+        self.assertEqual(self.client.get(self.url(self.ids[0])).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_snapshot_arrays(self):
+        build_snapshot()
+        snapshot = get_snapshot()
+        i = snapshot.find(self.ids[1])
+        self.assertEqual((snapshot.latitude[i], snapshot.longitude[i], snapshot.height[i]), (45.3842, 7.1525, 1200))
+        self.assertEqual(snapshot.status[i], 2)
+        self.assertIsNone(snapshot.find(self.ids[2]))
+
+        os.remove(settings.SNAPSHOT_FILE)
+        self.assertIsNone(get_snapshot())
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ids = []
+        for i, (height, level_summer, level_status) in enumerate([
+            (1200, '1А', 'accepted'), (1450, '1Б', 'accepted'), (2100, '1А', 'accepted'),
+            (3100, '2А', 'new'), (1300, '1А', 'rejected'),
+        ]):
+            pereval_id = self.client.post(
+                '/api/submitData/', make_payload(title=f"Перевал {i}", height=height), format='json'
+            ).data['id']
+            PerevalAdded.objects.filter(pk=pereval_id).update(status=level_status, level_summer=level_summer)
+            self.ids.append(pereval_id)
+
+    def test_filters_and_facets(self):
+        response = self.client.get('/api/catalog/', {
+            'status': 'accepted,new', 'level_summer': '1А,2А', 'height_min': 1000, 'height_max': 3000,
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.ids[2], self.ids[0]])
+        self.assertFalse(response.data['has_more'])
+        self.assertTrue(response.data['facets_exact'])
+        facets = response.data['facets']
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual(facets['status'], {'accepted': 2})
+        self.assertEqual(facets['level_summer'], {'1А': 2})
+        self.assertEqual(facets['height'], {'1000-1499': 1, '2000-2499': 1})
+
+        # Пустое значение — перевалы без категории
+        data = self.client.get('/api/catalog/', {'level_spring': '', 'status': 'rejected'}).data
+        self.assertEqual([item['id'] for item in data['results']], [self.ids[4]])
+
+    def test_keyset_pagination(self):
+        seen, after = [], None
+        with CaptureQueriesContext(connection) as queries:
+            while True:
+                params = {'limit': 2, 'facets': 0, 'fields': 'title'}
+                if after:
+                    params['after'] = after
+                data = self.client.get('/api/catalog/', params).data
+                seen += [item['id'] for item in data['results']]
+                self.assertEqual(set(data['results'][0]), {'id', 'title'})
+                after = data['next']
+                if not data['has_more']:
+                    break
+        self.assertEqual(seen, sorted(self.ids, reverse=True))
+        self.assertEqual(len(queries), 3)
+        self.assertIn('"pereval_perevaladded"."id" < ', queries[-1]['sql'])
+
+    def test_invalid_parameters(self):
+        for params in [{'status': 'done'}, {'height_min': 'high'}, {'after': '!!'}, {'limit': 0},
+                       {'fields': 'secret'}]:
+            response = self.client.get('/api/catalog/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn('error', response.data)
+
+    def test_facets_fall_back_to_sample_over_budget(self):
+        real = catalog._facet_rows
+        calls = []
+
+        def slow_exact(sql, params, alias, budget_ms):
+            calls.append(sql)
+            if len(calls) == 1:
+                raise OperationalError('canceling statement due to statement timeout')
+            return real(sql, params, alias, budget_ms)
+
+        with patch.object(catalog, '_facet_rows', side_effect=slow_exact):
+            data = self.client.get('/api/catalog/', {'status': 'accepted'}).data
+        self.assertFalse(data['facets_exact'])
+        self.assertIn('TABLESAMPLE SYSTEM', calls[1])
+        self.assertEqual(len(data['results']), 3)
+
+        with patch.object(catalog, '_facet_rows', side_effect=OperationalError('timeout')):
+            data = self.client.get('/api/catalog/').data
+        self.assertIsNone(data['facets'])
+        self.assertEqual(len(data['results']), 5)
+
+    def test_budget_does_not_leak_into_transaction(self):
+        with override_settings(CATALOG_FACET_BUDGET_MS=1234):
+            self.client.get('/api/catalog/')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('statement_timeout')")
+            self.assertEqual(cursor.fetchone()[0], '0')
+
+    def test_indexes_survive_partitioning(self):
+        convert_to_partitioned(months_ahead=0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'pereval_perevaladded' "
+                "AND indexname IN ('pereval_browse_idx', 'pereval_accepted_height_idx')"
+            )
+            indexes = dict(cursor.fetchall())
+        self.assertIn('INCLUDE', indexes['pereval_browse_idx'])
+        self.assertIn("WHERE", indexes['pereval_accepted_height_idx'])
+        data = self.client.get('/api/catalog/', {'status': 'accepted', 'height_max': 1500}).data
+        self.assertEqual([item['id'] for item in data['results']], [self.ids[1], self.ids[0]])
+
+
+class StatusEventsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ids = [
+            self.client.post('/api/submitData/', make_payload(email=email), format='json').data['id']
+            for email in ["qwerty@mail.ru", "qwerty@mail.ru", "other@mail.ru"]
+        ]
+
+    def run_stream(self, query, scenario):
+        """Вызывает ASGI-приложение как сервер; scenario(sent) публикует события и ждёт ответа"""
+        async def main():
+            sent = []
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': events.PATH, 'query_string': query,
+                     'client': ('10.0.0.1', 40000)}
+            task = asyncio.ensure_future(events.route_events(None)(scope, receive, send))
+            await scenario(sent)
+            disconnect.set()
+            await asyncio.wait_for(task, 5)
+            return sent
+
+        # Соединение теста открыто в транзакции, его нельзя закрывать как устаревшее
+        with patch.object(events, 'ensure_listener'), patch.object(events, 'close_old_connections'):
+            return async_to_sync(main)()
+
+    @staticmethod
+    async def wait_for_messages(sent, count):
+        async with asyncio.timeout(5):
+            while len(sent) < count:
+                await asyncio.sleep(0.01)
+
+    def test_stream_delivers_user_events(self):
+        async def scenario(sent):
+            await self.wait_for_messages(sent, 2)
+            self.assertEqual(events.hub.count(), 1)
+            events.hub.publish("other@mail.ru", {'id': self.ids[2], 'status': 'accepted', 'version': 2})
+            events.hub.publish("qwerty@mail.ru", {'id': self.ids[0], 'status': 'accepted', 'version': 2})
+            await self.wait_for_messages(sent, 3)
+
+        sent = self.run_stream(b'user__email=qwerty%40mail.ru', scenario)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream; charset=utf-8'), sent[0]['headers'])
+        snapshot = sent[1]['body'].decode()
+        self.assertTrue(snapshot.startswith('event: snapshot\n'))
+        self.assertEqual(
+            json.loads(snapshot.split('data: ')[1]),
+            [{'id': pk, 'status': 'new', 'version': 1} for pk in self.ids[:2]]
+        )
+        self.assertEqual(
+            sent[2]['body'].decode(),
+            f'event: status\nid: {self.ids[0]}.2\n'
+            f'data: {{"id":{self.ids[0]},"status":"accepted","version":2}}\n\n'
+        )
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(events.hub.count(), 0)
+
+    @override_settings(EVENTS_HEARTBEAT_SECONDS=0.02)
+    def test_heartbeat(self):
+        async def scenario(sent):
+            await self.wait_for_messages(sent, 3)
+
+        sent = self.run_stream(b'user__email=qwerty%40mail.ru', scenario)
+        self.assertEqual(sent[2]['body'], b': ping\n\n')
+
+    def test_missing_email(self):
+        async def scenario(sent):
+            await self.wait_for_messages(sent, 2)
+
+        sent = self.run_stream(b'', scenario)
+        self.assertEqual(sent[0]['status'], 400)
+        self.assertEqual(json.loads(sent[1]['body']), {'error': 'Не указан параметр user__email'})
+
+    @override_settings(EVENTS_MAX_STREAMS_PER_CLIENT=1)
+    def test_streams_per_client_limited(self):
+        async def scenario(sent):
+            await self.wait_for_messages(sent, 2)
+            rejected = []
+
+            async def send(message):
+                rejected.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': events.PATH,
+                     'query_string': b'user__email=other%40mail.ru', 'client': ('10.0.0.1', 40001)}
+            await events.route_events(None)(scope, None, send)
+            self.assertEqual(rejected[0]['status'], 429)
+            self.assertEqual(json.loads(rejected[1]['body']), {'error': 'Слишком много открытых потоков'})
+
+        sent = self.run_stream(b'user__email=qwerty%40mail.ru', scenario)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(events._streams, {})
+
+    def test_stream_is_throttled_by_ip(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        rates = {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'read_ip': '1/min'}
+        with override_settings(
+            THROTTLE_ENABLED=True, THROTTLE_STATE_FILE=os.path.join(tmp_dir, 'throttle'),
+            REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates},
+        ):
+            async def scenario(sent):
+                await self.wait_for_messages(sent, 2)
+
+            self.assertEqual(self.run_stream(b'user__email=qwerty%40mail.ru', scenario)[0]['status'], 200)
+            sent = self.run_stream(b'user__email=qwerty%40mail.ru', scenario)
+        self.assertEqual(sent[0]['status'], 429)
+        self.assertGreater(int(dict(sent[0]['headers'])[b'retry-after']), 0)
+
+    @override_settings(EVENTS_QUEUE_SIZE=1)
+    def test_slow_subscriber_is_dropped(self):
+        hub = events.Hub()
+        queue = hub.subscribe("qwerty@mail.ru")
+        hub.publish("qwerty@mail.ru", {'id': 1})
+        hub.publish("qwerty@mail.ru", {'id': 2})
+        self.assertEqual(hub.count(), 0)
+        self.assertIsNone(queue.get_nowait())
+
+    def test_trigger_survives_partitioning(self):
+        convert_to_partitioned(months_ahead=0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_trigger WHERE tgname = 'pereval_status_notify' "
+                "AND tgrelid = 'pereval_perevaladded'::regclass"
+            )
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class StatusListenerTestCase(TransactionTestCase):
+    databases = {'default'}
+
+    def test_notify_reaches_subscriber(self):
+        pereval_id = APIClient().post('/api/submitData/', make_payload(), format='json').data['id']
+
+        def moderate(new_status):
+            PerevalAdded.objects.filter(pk=pereval_id).touch(status=new_status)
+            connection.close()
+
+        async def main():
+            hub = events.Hub()
+            listener = events.Listener(hub, ['default'])
+            listener.start()
+            try:
+                queue = hub.subscribe("qwerty@mail.ru")
+                await asyncio.to_thread(moderate, 'pending')
+                await asyncio.to_thread(moderate, 'pending')  # статус не изменился — уведомления нет
+                await asyncio.to_thread(moderate, 'accepted')
+                return [await asyncio.wait_for(queue.get(), 5) for _ in range(2)], queue.qsize()
+            finally:
+                listener.stop()
+
+        received, left = asyncio.run(main())
+        self.assertEqual(received, [
+            {'id': pereval_id, 'status': 'pending', 'version': 2},
+            {'id': pereval_id, 'status': 'accepted', 'version': 4},
+        ])
+        self.assertEqual(left, 0)
+
+
+def _slow_leader(key, started, value):
+    """Выполняется в дочернем процессе: вычисляет результат key, удерживая блокировку"""
+    def compute():
+        started.set()
+        time.sleep(0.3)
+        return value
+    singleflight.coalesce(key, compute)
+
+
+class SingleFlightTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.override = override_settings(SINGLEFLIGHT_DIR=self.directory, SINGLEFLIGHT_TIMEOUT=5)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_concurrent_calls_share_one_computation(self):
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return {'title': "Пхия"}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(singleflight.coalesce(('detail', 1), compute)))
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        while not calls:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_later_call_recomputes(self):
+        self.assertEqual(singleflight.coalesce('key', lambda: 1), 1)
+        self.assertEqual(singleflight.coalesce('key', lambda: 2), 2)
+
+    def test_error_is_shared_and_not_cached(self):
+        release = threading.Event()
+        errors = []
+
+        def compute():
+            release.wait(5)
+            raise ValueError('нет записи')
+
+        def call():
+            try:
+                singleflight.coalesce('broken', compute)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(singleflight.coalesce('broken', lambda: 'ok'), 'ok')
+
+    def test_result_shared_across_processes(self):
+        context = multiprocessing.get_context('fork')
+        started = context.Event()
+        process = context.Process(target=_slow_leader, args=('list', started, {'ids': [1, 2]}))
+        process.start()
+        try:
+            self.assertTrue(started.wait(5))
+            waited = time.monotonic()
+            value = singleflight.coalesce('list', lambda: {'ids': 'вычислено повторно'})
+        finally:
+            process.join(5)
+        self.assertEqual(value, {'ids': [1, 2]})
+        self.assertGreater(time.monotonic() - waited, 0.1)
+        results = [name for name in os.listdir(self.directory) if name != 'locks']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(os.stat(os.path.join(self.directory, results[0])).st_mode & 0o777, 0o600)
+
+    def test_result_not_written_without_waiters(self):
+        self.assertEqual(singleflight.coalesce('alone', lambda: {'ids': [1]}), {'ids': [1]})
+        self.assertEqual(os.listdir(self.directory), ['locks'])
+
+    @patch.object(singleflight, 'LOCK_SLOTS', 1)
+    def test_threads_with_other_key_wait_for_slot(self):
+        # Один слот на все ключи: fcntl не отличает потоки одного процесса, слот держит threading.Lock
+        release = threading.Event()
+        order = []
+
+        def slow():
+            release.wait(5)
+            order.append('a')
+            return 'a'
+
+        thread = threading.Thread(target=singleflight.coalesce, args=('a', slow))
+        thread.start()
+        time.sleep(0.05)
+        other = threading.Thread(target=singleflight.coalesce, args=('b', lambda: order.append('b')))
+        other.start()
+        time.sleep(0.05)
+        self.assertEqual(order, [])
+        release.set()
+        thread.join()
+        other.join()
+        self.assertEqual(order, ['a', 'b'])
+
+    def test_pinned_request_is_not_coalesced(self):
+        release = threading.Event()
+        thread = threading.Thread(target=singleflight.coalesce, args=(('detail', 1), lambda: release.wait(5)))
+        thread.start()
+        time.sleep(0.02)
+        try:
+            with use_primary():
+                self.assertEqual(singleflight.coalesce(('detail', 1), lambda: 'после записи'), 'после записи')
+        finally:
+            release.set()
+            thread.join()
+
+    @override_settings(SINGLEFLIGHT_TIMEOUT=0.05)
+    def test_waiter_computes_after_timeout(self):
+        release = threading.Event()
+        thread = threading.Thread(target=singleflight.coalesce, args=('slow', lambda: release.wait(5)))
+        thread.start()
+        time.sleep(0.02)
+        try:
+            self.assertEqual(singleflight.coalesce('slow', lambda: 'сам'), 'сам')
+        finally:
+            release.set()
+            thread.join()
+
+    def test_detail_variants_are_not_mixed(self):
+        client = APIClient()
+        pereval_id = client.post('/api/submitData/', make_payload(), format='json').data['id']
+        full = client.get(f'/api/submitData/{pereval_id}/')
+        sparse = client.get(f'/api/submitData/{pereval_id}/', {'fields': 'title'})
+        self.assertIn('coords', full.data)
+        self.assertEqual(sparse.data, {'id': pereval_id, 'title': "Пхия"})
+        self.assertEqual(full['ETag'], '"1"')
+        self.assertEqual(full['ETag'], sparse['ETag'])
+
+
+@override_settings(LOG_ACCESS_ENABLED=True, LOG_SAMPLE_RATES={}, LOG_SLOW_MS=1000)
+class StructuredLoggingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def create_pereval(self, **kwargs):
+        return self.client.post('/api/submitData/', make_payload(**kwargs), format='json').data['id']
+
+    def test_handler_writes_batches_and_counts_dropped(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'access.log')
+        handler = BatchingHandler(stream=path, capacity=3, batch_size=100, flush_interval=60)
+        handler.setFormatter(JsonFormatter())
+        self.addCleanup(handler.close)
+        logger = logging.getLogger('pereval.tests.batching')
+        logger.addHandler(handler)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+
+        for number in range(5):
+            logger.warning('запись %s', number, extra={'fields': {'number': number}})
+        # Очередь не пишется до flush: запрос не ждёт вывода
+        self.assertEqual(os.path.getsize(path) if os.path.exists(path) else 0, 0)
+        handler.flush()
+
+        with open(path, encoding='utf-8') as stream:
+            lines = [json.loads(line) for line in stream]
+        self.assertEqual([line.get('number') for line in lines[:3]], [0, 1, 2])
+        self.assertEqual(lines[0]['message'], 'запись 0')
+        self.assertEqual(lines[3]['event'], 'log.dropped')
+        self.assertEqual(lines[3]['count'], 2)
+
+    def test_access_log_fields(self):
+        pereval_id = self.create_pereval()
+        with self.assertLogs('pereval.access', 'INFO') as logs:
+            response = self.client.get(f'/api/submitData/{pereval_id}/', HTTP_X_REQUEST_ID='req-42')
+        self.assertEqual(response['X-Request-ID'], 'req-42')
+        fields = logs.records[0].fields
+        self.assertEqual(fields['event'], 'http.request')
+        self.assertEqual(fields['request_id'], 'req-42')
+        self.assertEqual(fields['route'], 'submit-data-detail')
+        self.assertEqual(fields['status'], 200)
+        self.assertEqual(fields['pereval_id'], pereval_id)
+        self.assertGreater(fields['db_queries'], 0)
+        self.assertGreaterEqual(fields['duration_ms'], fields['db_ms'])
+        self.assertEqual(fields['sample_rate'], 1.0)
+
+    def test_access_log_submit_records_author(self):
+        with self.assertLogs('pereval.access', 'INFO') as logs:
+            response = self.client.post('/api/submitData/', make_payload(email='log@mail.ru'), format='json')
+        fields = logs.records[0].fields
+        self.assertEqual(fields['email'], 'l***@mail.ru')
+        self.assertEqual(fields['pereval_id'], response.data['id'])
+        self.assertEqual(fields['status'], 201)
+
+    def test_access_log_masks_email_filter(self):
+        with self.assertLogs('pereval.access', 'INFO') as logs:
+            self.client.get('/api/submitData/?user__email=qwerty@mail.ru')
+        self.assertEqual(logs.records[0].fields['email'], 'q***@mail.ru')
+
+    def test_sampling_skips_successes_but_keeps_errors(self):
+        pereval_id = self.create_pereval()
+        with override_settings(LOG_SAMPLE_RATES={'submit-data-detail': 0.0}):
+            with self.assertNoLogs('pereval.access', 'INFO'):
+                self.client.get(f'/api/submitData/{pereval_id}/')
+            with self.assertLogs('pereval.access', 'INFO') as logs:
+                self.client.get('/api/submitData/999999/')
+        self.assertEqual(logs.records[0].fields['status'], 404)
+        self.assertEqual(logs.records[0].fields['sample_rate'], 1.0)
+
+    def test_disabled_access_log(self):
+        with override_settings(LOG_ACCESS_ENABLED=False), self.assertNoLogs('pereval.access', 'INFO'):
+            response = self.client.get('/api/submitData/?user__email=qwerty@mail.ru')
+        self.assertNotIn('X-Request-ID', response)
+
+    def test_status_change_is_audited_after_commit(self):
+        pereval = PerevalAdded.objects.get(pk=self.create_pereval())
+        request = RequestFactory().post('/admin/')
+        request.request_id = 'admin-1'
+        request.user = type('Moderator', (), {'is_authenticated': True, 'get_username': lambda self: 'moderator'})()
+
+        with self.assertLogs('pereval.audit', 'INFO') as logs:
+            with self.captureOnCommitCallbacks(execute=True), bind_request(request):
+                pereval.status = 'accepted'
+                pereval.save()
+                # Сохранение без смены статуса в аудит не попадает
+                pereval.title = 'Новое название'
+                pereval.save()
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].fields, {
+            'event': 'pereval.status', 'id': pereval.pk, 'status_from': 'new', 'status_to': 'accepted',
+            'version': 2, 'request_id': 'admin-1', 'actor': 'moderator',
+        })
+
+    def test_patch_is_audited(self):
+        pereval_id = self.create_pereval()
+        with self.assertLogs('pereval.audit', 'INFO') as logs, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/submitData/{pereval_id}/', {'title': 'Новое', 'coords': {'height': 1300}}, format='json'
+            )
+        self.assertEqual(response.data['state'], 1)
+        fields = logs.records[0].fields
+        self.assertEqual(fields['event'], 'pereval.patch')
+        self.assertEqual(fields['id'], pereval_id)
+        self.assertEqual(fields['changes'], {
+            'title': {'old': "Пхия", 'new': 'Новое'}, 'height': {'old': 1200, 'new': 1300},
+        })
+        self.assertEqual(fields['request_id'], response['X-Request-ID'])
+
+    def test_patch_audit_masks_personal_data(self):
+        pereval_id = self.create_pereval()
+        connect = 'Связь: ivanov@mail.ru, +7 (999) 123-45-67, высота 1200-1500 м'
+        with self.assertLogs('pereval.audit', 'INFO') as logs, self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/submitData/{pereval_id}/', {
+                'connect': connect, 'images': [{'title': "Вид", 'image_url': 'https://example.com/a.jpg'}],
+            }, format='json')
+        changes = logs.records[0].fields['changes']
+        self.assertEqual(changes['connect'], {'old': '', 'new': 'Связь: i***@mail.ru, ***67, высота 1200-1500 м'})
+        self.assertEqual(changes['images']['new'], [{'title': "Вид", 'image_url': 'https://example.com/a.jpg'}])
+        self.assertEqual(len(changes['images']['old']), 1)
+        self.assertEqual(mask_pii({'phone': '89991234567', 'email': 'qwerty@mail.ru'}),
+                         {'phone': '***67', 'email': 'q***@mail.ru'})
+
+    def test_rejected_patch_is_not_audited(self):
+        pereval = PerevalAdded.objects.get(pk=self.create_pereval())
+        pereval.status = 'pending'
+        pereval.save()
+        with self.assertNoLogs('pereval.audit', 'INFO'), self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/submitData/{pereval.pk}/', {'title': 'Новое'}, format='json')
@@ -0,0 +1,203 @@
+"""
+Ограничение частоты запросов (token bucket) с общим состоянием для всех воркеров.
+
+Корзины хранятся в файле THROTTLE_STATE_FILE, отображённом в память (mmap);
+по умолчанию он лежит в /dev/shm, то есть в разделяемой памяти. Все воркеры
+gunicorn на машине видят одни и те же корзины, проверка — чтение и запись
+одной записи фиксированного размера под блокировкой диапазона байт (fcntl),
+без обращений к БД.
+
+Файл состоит из счётчиков решений (разрешено / отклонено) по областям
+и хэш-таблицы корзин: ключ попадает в группу из GROUP_SIZE ячеек; если все
+ячейки группы заняты, вытесняется корзина, к которой дольше всего не обращались
+(вытесненный клиент просто получает полную корзину).
+
+Лимиты задаются в REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] в формате DRF
+("30/min"): ёмкость корзины — число запросов, скорость пополнения — число
+запросов за период.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+SCOPES = ['write_ip', 'write_email', 'read_ip', 'read_email']
+WRITE_METHODS = ('POST', 'PATCH', 'PUT', 'DELETE')
+
+COUNTER = struct.Struct('<QQ')  # разрешено, отклонено
+SLOT = struct.Struct('<Qdd')  # хэш ключа, токены, время последнего обновления
+GROUP_SIZE = 4
+MAX_SCOPES = 16
+HEADER_SIZE = COUNTER.size * MAX_SCOPES
+
+
+def parse_rate(rate):
+    """'30/min' -> (ёмкость, токенов в секунду); None -> None"""
+    if rate is None:
+        return None
+    num, period = rate.split('/')
+    seconds = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+    return int(num), int(num) / seconds
+
+
+class BucketStore:
+    """Хэш-таблица корзин в файле, отображённом в память"""
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.groups = max(slots // GROUP_SIZE, 1)
+        self.size = HEADER_SIZE + self.groups * GROUP_SIZE * SLOT.size
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _open(self):
+        # После fork у каждого воркера должно быть своё отображение файла
+        if self.pid != os.getpid():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+            self.fd = fd
+            self.map = mmap.mmap(fd, self.size)
+            self.pid = os.getpid()
+
+    @contextmanager
+    def _locked(self, offset, length):
+        # fcntl-блокировка разделяет процессы, threading.Lock — потоки одного процесса
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, length, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, length, offset)
+
+    def consume(self, key, capacity, rate, now=None):
+        """Забирает токен из корзины key; возвращает (разрешено, секунд до следующего токена)"""
+        self._open()
+        now = time.time() if now is None else now
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        group_offset = HEADER_SIZE + (key_hash % self.groups) * GROUP_SIZE * SLOT.size
+
+        with self._locked(group_offset, GROUP_SIZE * SLOT.size):
+            slot_offset = victim = None
+            oldest = None
+            for i in range(GROUP_SIZE):
+                offset = group_offset + i * SLOT.size
+                stored_hash, tokens, updated = SLOT.unpack_from(self.map, offset)
+                if stored_hash == key_hash:
+                    slot_offset = offset
+                    break
+                if oldest is None or updated < oldest:
+                    victim, oldest = offset, updated
+
+            if slot_offset is None:
+                slot_offset, tokens, updated = victim, float(capacity), now
+            tokens = min(float(capacity), tokens + max(now - updated, 0.0) * rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            SLOT.pack_into(self.map, slot_offset, key_hash, tokens, now)
+        return allowed, 0.0 if allowed else (1.0 - tokens) / rate
+
+    def record(self, scope, allowed):
+        """Увеличивает счётчик решений области scope"""
+        self._open()
+        offset = SCOPES.index(scope) * COUNTER.size
+        with self._locked(offset, COUNTER.size):
+            allowed_count, throttled_count = COUNTER.unpack_from(self.map, offset)
+            if allowed:
+                allowed_count += 1
+            else:
+                throttled_count += 1
+            COUNTER.pack_into(self.map, offset, allowed_count, throttled_count)
+
+    def counters(self):
+        self._open()
+        return {
+            scope: dict(zip(('allowed', 'throttled'), COUNTER.unpack_from(self.map, i * COUNTER.size)))
+            for i, scope in enumerate(SCOPES)
+        }
+
+    def reset(self):
+        self._open()
+        with self._locked(0, self.size):
+            self.map[:] = bytes(self.size)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None or _store.path != settings.THROTTLE_STATE_FILE:
+        with _store_lock:
+            if _store is None or _store.path != settings.THROTTLE_STATE_FILE:
+                _store = BucketStore(settings.THROTTLE_STATE_FILE, settings.THROTTLE_SLOTS)
+    return _store
+
+
+def throttle_metrics():
+    """Счётчики решений и лимиты по областям"""
+    counters = get_store().counters()
+    rates = api_settings.DEFAULT_THROTTLE_RATES
+    return {scope: {**counters[scope], 'rate': rates.get(scope)} for scope in SCOPES}
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Базовый класс: область write_* для изменяющих запросов, read_* для чтения"""
+    kind = None
+
+    def get_ident_key(self, request):
+        """Ключ корзины в области kind; None — запрос этим лимитом не ограничивается"""
+        return None
+
+    def allow_request(self, request, view):
+        if not settings.THROTTLE_ENABLED:
+            return True
+        scope = f"{'write' if request.method in WRITE_METHODS else 'read'}_{self.kind}"
+        rate = parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(scope))
+        key = self.get_ident_key(request)
+        if rate is None or not key:
+            return True
+
+        store = get_store()
+        allowed, self.wait_seconds = store.consume(f'{scope}:{key}', *rate)
+        store.record(scope, allowed)
+        return allowed
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
+
+
+class IPThrottle(TokenBucketThrottle):
+    """
+    Лимит по IP клиента. REST_FRAMEWORK['NUM_PROXIES'] всегда задан (settings.NUM_PROXIES):
+    при 0 ключ — REMOTE_ADDR, при N — N-й адрес X-Forwarded-For с конца, добавленный
+    доверенным прокси, поэтому подменой заголовка новую корзину не получить.
+    """
+    kind = 'ip'
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+class EmailThrottle(TokenBucketThrottle):
+    """Лимит по email автора: из тела POST или из параметра user__email"""
+    kind = 'email'
+
+    def get_ident_key(self, request):
+        if request.method == 'GET':
+            email = request.query_params.get('user__email')
+        else:
+            user = request.data.get('user') if isinstance(request.data, dict) else None
+            email = user.get('email') if isinstance(user, dict) else None
+        return email.strip().lower() if isinstance(email, str) else None
@@ -1,7 +1,19 @@
 from django.urls import path
-from .views import SubmitData, PerevalRetrieveUpdateView
+from .views import (
+    SubmitData, PerevalRetrieveUpdateView, PerevalChangesView, SubmissionQueueView, SubmissionStatusView,
+    PerevalStatsView, PerevalCatalogView, MapTileView, PerevalBatchView, ThrottleMetricsView, serve_thumbnail
+)
 
 urlpatterns = [
     path('submitData/', SubmitData.as_view(), name='submit-data'),
+    path('submitData/batch/', PerevalBatchView.as_view(), name='submit-data-batch'),
+    path('submitData/changes/', PerevalChangesView.as_view(), name='submit-data-changes'),
+    path('submitData/queue/', SubmissionQueueView.as_view(), name='submit-data-queue'),
+    path('submitData/queue/<uuid:tracking_id>/', SubmissionStatusView.as_view(), name='submit-data-status'),
     path('submitData/<int:pk>/', PerevalRetrieveUpdateView.as_view(), name='submit-data-detail'),
+    path('throttle/', ThrottleMetricsView.as_view(), name='throttle-metrics'),
+    path('stats/', PerevalStatsView.as_view(), name='stats'),
+    path('catalog/', PerevalCatalogView.as_view(), name='catalog'),
+    path('map/tiles/<int:z>/<int:x>/<int:y>/', MapTileView.as_view(), name='map-tile'),
+    path('thumbnails/<str:name>', serve_thumbnail, name='thumbnail'),
 ]
\ No newline at end of file
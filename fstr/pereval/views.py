@@ -1,11 +1,62 @@
+import json
+from datetime import datetime, timezone as dt_timezone
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.db.models import Count, Max
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import get_object_or_404
-from drf_yasg.utils import swagger_auto_schema
-from drf_yasg import openapi
-from .models import PerevalAdded
-from .serializers import PerevalAddedSerializer, PerevalInfoSerializer, PerevalUpdateSerializer
+from django.views.decorators.http import require_GET
+from .catalog import browse, decode_cursor, facet_counts, parse_filters
+from .conditional import is_conditional, list_etag, not_modified, parse_if_match, set_validators, version_etag
+from django.conf import settings
+from .images import THUMBNAIL_NAME_RE, thumbnail_path
+from .ingest import enqueue, queue_metrics
+from .jobs import enqueue_post_submit
+from .logs import annotate
+from .mapgrid import encode_tile, get_tile
+from .models import PerevalAdded, PerevalArchive, PerevalSubmission
+from .prevalidation import validate_submit, validate_update
+from .serializers import (
+    PerevalAddedSerializer, PerevalInfoSerializer, PerevalUpdateSerializer, PerevalArchiveSerializer,
+    PerevalChangeSerializer
+)
+from .singleflight import coalesce
+from .snapshot import get_snapshot
+from .sharding import group_by_shard, scatter, shard_for_pk, use_shard
+from .stats import get_stats
+from .sync import InvalidCursor, fetch_changes
+from .throttling import throttle_metrics
+
+
+def sparse_fields(request):
+    """Поля из ?fields= и ?expand= (None — полный ответ); ValueError для неизвестных полей"""
+    return PerevalInfoSerializer.select_fields(request.query_params.get('fields'), request.query_params.get('expand'))
+
+
+def image_context(request):
+    """Контекст сериализатора: ?thumbnails=1 добавляет к изображениям thumbnail_url"""
+    return {'request': request, 'thumbnails': request.query_params.get('thumbnails') == '1'}
+
+
+def response_variant(request, fields):
+    """Всё, от чего кроме данных зависит тело ответа: поля и адрес сервера в ссылках на миниатюры"""
+    thumbnails = image_context(request)['thumbnails']
+    return tuple(fields or ()), request.build_absolute_uri('/') if thumbnails else None
+
+
+@require_GET
+def serve_thumbnail(request, name):
+    """Миниатюра изображения; имя файла — хэш содержимого, поэтому ответ кэшируется навсегда"""
+    if not THUMBNAIL_NAME_RE.match(name):
+        raise Http404
+    try:
+        response = FileResponse(open(thumbnail_path(name), 'rb'), content_type='image/jpeg')
+    except FileNotFoundError:
+        raise Http404
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 
 class SubmitData(APIView):
@@ -14,38 +65,6 @@ class SubmitData(APIView):
     Поддерживает методы: GET, POST.
     """
 
-    @swagger_auto_schema(
-        operation_description="Получить список перевалов по email пользователя",
-        manual_parameters=[
-            openapi.Parameter(
-                'user__email',
-                openapi.IN_QUERY,
-                description="Email пользователя для поиска его перевалов",
-                type=openapi.TYPE_STRING,
-                required=True,
-                example="user@example.com"
-            )
-        ],
-        responses={
-            200: PerevalInfoSerializer(many=True),
-            400: openapi.Response(
-                description="Не указан параметр user__email",
-                examples={
-                    'application/json': {
-                        'error': 'Не указан параметр user__email'
-                    }
-                }
-            ),
-            404: openapi.Response(
-                description="Записи не найдены",
-                examples={
-                    'application/json': {
-                        'message': 'Записи не найдены'
-                    }
-                }
-            )
-        }
-    )
     def get(self, request):
         email = request.query_params.get('user__email')
         if not email:
@@ -54,82 +73,99 @@ class SubmitData(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        try:
+            fields = sparse_fields(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         perevals = PerevalAdded.objects.filter(user__email=email)
-        if not perevals.exists():
+        # Один агрегат по индексу (user, updated_at) заменяет exists() и даёт ETag списка;
+        # при шардировании он выполняется в каждом шарде, перевалы читаются только из непустых
+        states = scatter(lambda: perevals.aggregate(count=Count('id'), last_update=Max('updated_at')))
+        count = sum(state['count'] for state in states.values())
+        if not count:
             return Response(
                 {'message': 'Записи не найдены'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        serializer = PerevalInfoSerializer(perevals, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        last_update = max(state['last_update'] for state in states.values() if state['count'])
+        etag = list_etag(count, last_update)
+        cached = not_modified(request, etag, last_update)
+        if cached is not None:
+            return cached
 
-    @swagger_auto_schema(
-        operation_description="Создать новую запись о перевале",
-        request_body=PerevalAddedSerializer,
-        responses={
-            201: openapi.Response(
-                description="Успешное создание перевала",
-                examples={
-                    'application/json': {
-                        'status': 200,
-                        'message': None,
-                        'id': 1
-                    }
-                }
-            ),
-            400: openapi.Response(
-                description="Неверные данные",
-                examples={
-                    'application/json': {
-                        'status': 400,
-                        'message': 'Неверные данные',
-                        'errors': {
-                            'title': ['Это поле обязательно.']
-                        },
-                        'id': None
-                    }
-                }
-            ),
-            500: openapi.Response(
-                description="Ошибка сервера",
-                examples={
-                    'application/json': {
-                        'status': 500,
-                        'message': 'Ошибка при сохранении: ...',
-                        'id': None
-                    }
-                }
+        perevals = PerevalInfoSerializer.setup_queryset(perevals, fields)
+        shards = [alias for alias, state in states.items() if state['count']]
+
+        def serialize():
+            data = scatter(
+                lambda: PerevalInfoSerializer(
+                    perevals.all(), many=True, fields=fields, context=image_context(request)
+                ).data,
+                shards,
             )
-        }
-    )
+            return [item for alias in shards for item in data[alias]]
+
+        # ETag в ключе: после изменения списка запрос не получит результат, посчитанный до него
+        key = ('list', email, etag, *response_variant(request, fields))
+        response = Response(coalesce(key, serialize), status=status.HTTP_200_OK)
+        return set_validators(response, etag, last_update)
+
     def post(self, request):
+        # Заведомо неверные данные отклоняются до создания вложенных сериализаторов
+        errors = validate_submit(request.data)
+        if errors:
+            return self.handle_invalid_data(errors)
+
         serializer = PerevalAddedSerializer(data=request.data)
 
         if serializer.is_valid():
+            annotate(request, email=serializer.validated_data['user']['email'])
+            if settings.ASYNC_INGEST:
+                return self.handle_queued_data(request.data)
             return self.handle_valid_data(serializer)
-        return self.handle_invalid_data(serializer)
+        return self.handle_invalid_data(serializer.errors)
+
+    def handle_queued_data(self, payload):
+        """Ставит проверенные данные в очередь; перевал сохранит drain_submissions"""
+        try:
+            submission = enqueue(payload)
+        except Exception as e:
+            return Response({
+                'status': 500,
+                'message': f'Ошибка при сохранении: {str(e)}',
+                'id': None
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({
+            'status': 202,
+            'message': 'Данные приняты в обработку',
+            'id': None,
+            'tracking_id': submission.tracking_id
+        }, status=status.HTTP_202_ACCEPTED)
 
     def handle_valid_data(self, serializer):
         try:
             pereval = serializer.save()
-            return Response({
-                'status': 200,
-                'message': None,
-                'id': pereval.id
-            }, status=status.HTTP_201_CREATED)
         except Exception as e:
             return Response({
                 'status': 500,
                 'message': f'Ошибка при сохранении: {str(e)}',
                 'id': None
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Ошибка постановки фоновых задач на ответ не влияет: перевал уже сохранён
+        enqueue_post_submit(pereval.id, using=pereval._state.db)
+        return Response({
+            'status': 200,
+            'message': None,
+            'id': pereval.id
+        }, status=status.HTTP_201_CREATED)
 
-    def handle_invalid_data(self, serializer):
+    def handle_invalid_data(self, errors):
         return Response({
             'status': 400,
             'message': 'Неверные данные',
-            'errors': serializer.errors,
+            'errors': errors,
             'id': None
         }, status=status.HTTP_400_BAD_REQUEST)
 
@@ -140,72 +176,96 @@ class PerevalRetrieveUpdateView(APIView):
     Поддерживает методы: GET, PATCH.
     """
 
-    @swagger_auto_schema(
-        operation_description="Получить информацию о перевале по ID",
-        responses={
-            200: PerevalInfoSerializer,
-            404: openapi.Response(
-                description="Перевал не найден",
-                examples={
-                    'application/json': {
-                        'detail': 'Страница не найдена.'
-                    }
-                }
-            )
-        }
-    )
+    def dispatch(self, request, *args, **kwargs):
+        # Шард записи определяется по id, без запросов к другим шардам
+        with use_shard(shard_for_pk(kwargs['pk'])):
+            return super().dispatch(request, *args, **kwargs)
+
     def get(self, request, pk):
-        pereval = get_object_or_404(PerevalAdded, pk=pk)
-        serializer = PerevalInfoSerializer(pereval)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        response = self.get_from_snapshot(request, pk)
+        if response is not None:
+            return response
 
-    @swagger_auto_schema(
-        operation_description="Редактировать перевал (только со статусом 'new')",
-        request_body=PerevalUpdateSerializer,
-        responses={
-            200: openapi.Response(
-                description="Успешное обновление",
-                examples={
-                    'application/json': {
-                        'state': 1
-                    }
-                }
-            ),
-            400: openapi.Response(
-                description="Ошибка валидации или неверный статус",
-                examples={
-                    'application/json': {
-                        'state': 0,
-                        'message': 'Запись нельзя редактировать, так как её статус не "new"'
-                    }
-                }
-            ),
-            404: openapi.Response(
-                description="Перевал не найден",
-                examples={
-                    'application/json': {
-                        'detail': 'Страница не найдена.'
-                    }
-                }
-            ),
-            500: openapi.Response(
-                description="Ошибка сервера",
-                examples={
-                    'application/json': {
-                        'state': 0,
-                        'message': 'Ошибка при сохранении: ...'
-                    }
-                }
-            )
+        if is_conditional(request):
+            # Проверяем актуальность по version/updated_at, не загружая и не сериализуя запись
+            current = PerevalAdded.objects.filter(pk=pk).values_list('version', 'updated_at').first()
+            if current is not None:
+                cached = not_modified(request, version_etag(current[0]), current[1])
+                if cached is not None:
+                    return cached
+
+        try:
+            fields = sparse_fields(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Одновременные одинаковые запросы (популярная ссылка) читают запись один раз
+        context = image_context(request)
+        result = coalesce(('detail', pk, *response_variant(request, fields)), lambda: self.load(pk, fields, context))
+        response = Response(result['data'], status=status.HTTP_200_OK)
+        if result['etag'] is None:
+            return response
+        updated_at = datetime.fromtimestamp(result['updated_at'], tz=dt_timezone.utc)
+        return set_validators(response, result['etag'], updated_at)
+
+    def load(self, pk, fields, context):
+        """Ответ GET и валидаторы кэша; архивная запись отдаётся без ETag"""
+        queryset = PerevalInfoSerializer.setup_queryset(
+            PerevalAdded.objects.all(), fields, extra_columns=('version', 'updated_at')
+        )
+        try:
+            pereval = queryset.get(pk=pk)
+        except PerevalAdded.DoesNotExist:
+            return {'data': self.get_archived(pk).data, 'etag': None}
+        return {
+            'data': PerevalInfoSerializer(pereval, fields=fields, context=context).data,
+            'etag': version_etag(pereval.version),
+            'updated_at': pereval.updated_at.timestamp(),
         }
-    )
-    def patch(self, request, pk):
-        pereval = get_object_or_404(PerevalAdded, pk=pk)
 
-        if pereval.status != 'new':
+    def get_from_snapshot(self, request, pk):
+        """Принятый перевал из снимка в памяти (см. pereval.snapshot) или None — читать из БД"""
+        snapshot = get_snapshot()
+        if snapshot is None or request.query_params.get('thumbnails') == '1':
+            return None
+        entry = snapshot.lookup(pk)
+        if entry is None:
+            return None
+        try:
+            fields = sparse_fields(request)
+        except ValueError:
+            return None
+
+        version, updated_at, content = entry
+        etag = version_etag(version)
+        if is_conditional(request):
+            cached = not_modified(request, etag, updated_at)
+            if cached is not None:
+                return cached
+        if fields is None:
+            # JSON из снимка отдаётся как есть, без разбора и сериализации
+            response = HttpResponse(content, content_type='application/json')
+        else:
+            item = json.loads(bytes(content))
+            response = Response(
+                {key: value for key, value in item.items() if key in fields}, status=status.HTTP_200_OK
+            )
+        return set_validators(response, etag, updated_at)
+
+    def get_archived(self, pk):
+        """Запись, перенесённая архиватором, по-прежнему доступна по своему id"""
+        archived = get_object_or_404(
+            PerevalArchive.objects.select_related('user').prefetch_related('images'), pk=pk
+        )
+        serializer = PerevalArchiveSerializer(archived)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def patch(self, request, pk):
+        errors = validate_update(request.data)
+        if errors:
             return Response({
                 'state': 0,
-                'message': 'Запись нельзя редактировать, так как её статус не "new"'
+                'message': errors
             }, status=status.HTTP_400_BAD_REQUEST)
 
         data = request.data.copy()
@@ -218,19 +278,279 @@ class PerevalRetrieveUpdateView(APIView):
                 'level_spring': level_data.get('spring', '')
             })
 
-        serializer = PerevalUpdateSerializer(pereval, data=data, partial=True)
+        try:
+            expected_version = parse_if_match(request.headers.get('If-Match'))
+        except ValueError:
+            return Response({
+                'state': 0,
+                'message': 'Неверный заголовок If-Match'
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-        if serializer.is_valid():
-            try:
-                serializer.save()
-                return Response({'state': 1}, status=status.HTTP_200_OK)
-            except Exception as e:
-                return Response({
-                    'state': 0,
-                    'message': f'Ошибка при сохранении: {str(e)}'
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        else:
+        serializer = PerevalUpdateSerializer(data=data, partial=True)
+
+        if not serializer.is_valid():
             return Response({
                 'state': 0,
                 'message': serializer.errors
-            }, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            updated = serializer.update_guarded(pk, expected_version)
+        except Exception as e:
+            return Response({
+                'state': 0,
+                'message': f'Ошибка при сохранении: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if not updated:
+            return self.patch_rejected(pk)
+
+        response = Response({'state': 1}, status=status.HTTP_200_OK)
+        if expected_version is not None:
+            response['ETag'] = version_etag(expected_version + 1 if serializer.changed_fields else expected_version)
+        return response
+
+    def patch_rejected(self, pk):
+        """UPDATE не изменил ни одной строки: определяем причину одним запросом"""
+        current = PerevalAdded.objects.filter(pk=pk).values('status', 'version').first()
+        if current is None:
+            raise Http404
+
+        if current['status'] != 'new':
+            return Response({
+                'state': 0,
+                'message': 'Запись нельзя редактировать, так как её статус не "new"'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        response = Response({
+            'state': 0,
+            'message': 'Запись была изменена другим пользователем, получите её заново'
+        }, status=status.HTTP_412_PRECONDITION_FAILED)
+        response['ETag'] = version_etag(current['version'])
+        return response
+
+
+
+class PerevalChangesView(APIView):
+    """
+    Инкрементальная синхронизация перевалов пользователя.
+    Поддерживает метод: GET.
+    """
+
+    def get(self, request):
+        email = request.query_params.get('user__email')
+        if not email:
+            return Response(
+                {'error': 'Не указан параметр user__email'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            limit = min(int(request.query_params.get('limit', settings.SYNC_PAGE_SIZE)), settings.SYNC_MAX_PAGE_SIZE)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response(
+                {'error': 'Неверный параметр limit'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        since = request.query_params.get('since')
+        try:
+            # Для неизвестного email выборки пусты, но курсор всё равно проверяется
+            changed, archived, cursor, has_more = fetch_changes(email, since, limit)
+        except InvalidCursor:
+            return Response(
+                {'error': 'Неверный параметр since'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'changes': PerevalChangeSerializer(changed, many=True).data,
+            'deleted': [{'id': item.id, 'archived_at': item.archived_at} for item in archived],
+            'next': cursor,
+            'has_more': has_more,
+        }, status=status.HTTP_200_OK)
+
+
+
+class SubmissionStatusView(APIView):
+    """
+    Состояние заявки, принятой в режиме ASYNC_INGEST.
+    Поддерживает метод: GET.
+    """
+
+    def get(self, request, tracking_id):
+        submission = get_object_or_404(PerevalSubmission, tracking_id=tracking_id)
+        return Response({
+            'tracking_id': submission.tracking_id,
+            'state': submission.state,
+            'id': submission.pereval_id,
+            'message': submission.error or None
+        }, status=status.HTTP_200_OK)
+
+
+class SubmissionQueueView(APIView):
+    """
+    Метрики очереди асинхронного приёма: глубина и скорость разбора.
+    Поддерживает метод: GET.
+    """
+
+    def get(self, request):
+        return Response(queue_metrics(), status=status.HTTP_200_OK)
+
+
+class ThrottleMetricsView(APIView):
+    """
+    Решения ограничителя частоты запросов: сколько запросов разрешено и отклонено по областям.
+    Поддерживает метод: GET. Сам эндпоинт не ограничивается, чтобы мониторинг видел перегрузку.
+    """
+    throttle_classes = []
+
+    def get(self, request):
+        return Response(throttle_metrics(), status=status.HTTP_200_OK)
+
+
+class PerevalStatsView(APIView):
+    """
+    Статистика перевалов по статусу, сложности, высоте и региону.
+    Поддерживает метод: GET.
+    """
+
+    def get(self, request):
+        stats = get_stats()
+        etag = list_etag(stats['total'], stats['refreshed_at'])
+        cached = not_modified(request, etag, stats['refreshed_at'])
+        if cached is not None:
+            return cached
+        response = Response(stats, status=status.HTTP_200_OK)
+        return set_validators(response, etag, stats['refreshed_at'])
+
+
+class PerevalCatalogView(APIView):
+    """
+    Каталог перевалов с фильтрами по сложности, высоте и статусу и счётчиками по измерениям.
+    Поддерживает метод: GET. Параметр facets=0 отключает подсчёт фасетов (например, для следующих страниц).
+    """
+
+    def get(self, request):
+        try:
+            limit = min(
+                int(request.query_params.get('limit', settings.CATALOG_PAGE_SIZE)), settings.CATALOG_MAX_PAGE_SIZE
+            )
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response(
+                {'error': 'Неверный параметр limit'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            fields = sparse_fields(request)
+            filters = parse_filters(request.query_params)
+            after = request.query_params.get('after')
+            after = decode_cursor(after) if after else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def serialize(perevals):
+            perevals = PerevalInfoSerializer.setup_queryset(perevals, fields)
+            return PerevalInfoSerializer(perevals, many=True, fields=fields, context=image_context(request)).data
+
+        results, cursor = browse(filters, after, limit, serialize)
+        data = {'results': results, 'next': cursor, 'has_more': cursor is not None}
+        if request.query_params.get('facets') != '0':
+            data['facets'], data['facets_exact'] = facet_counts(filters)
+        return Response(data, status=status.HTTP_200_OK)
+
+class MapTileView(APIView):
+    """
+    Кластеры перевалов для тайла карты z/x/y.
+    Поддерживает метод: GET. Параметр encoding=binary — компактный бинарный формат.
+    """
+
+    MAX_ZOOM = 22
+
+    def get(self, request, z, x, y):
+        if z > self.MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+            return Response(
+                {'error': 'Неверные координаты тайла'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        clusters = get_tile(z, x, y)
+        if request.query_params.get('encoding') == 'binary':
+            response = HttpResponse(encode_tile(z, x, y, clusters), content_type='application/octet-stream')
+        else:
+            response = Response({'zoom': z, 'x': x, 'y': y, 'clusters': clusters}, status=status.HTTP_200_OK)
+        response['Cache-Control'] = 'public, max-age=%d' % settings.MAP_TILE_CACHE_SECONDS
+        return response
+
+
+class PerevalBatchView(APIView):
+    """
+    Получение нескольких перевалов по списку id за фиксированное число запросов.
+    Поддерживает методы: GET (?ids=1,2,3), POST ({"ids": [1, 2, 3]}).
+    """
+    # POST только читает: клиент не закрепляется за основной БД (ReplicaRoutingMiddleware)
+    read_only = True
+
+    def get(self, request):
+        raw = request.query_params.get('ids', '')
+        return self.fetch(request, [part for part in raw.split(',') if part.strip()])
+
+    def post(self, request):
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list):
+            return Response(
+                {'error': 'Ожидается список ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return self.fetch(request, ids)
+
+    def fetch(self, request, raw_ids):
+        try:
+            # Порядок ответа совпадает с порядком запроса, повторы убираются
+            ids = list(dict.fromkeys(int(value) for value in raw_ids))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'id должны быть целыми числами'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not ids:
+            return Response(
+                {'error': 'Не указан параметр ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > settings.MULTI_GET_MAX_IDS:
+            return Response(
+                {'error': f'Можно запросить не больше {settings.MULTI_GET_MAX_IDS} записей'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            fields = sparse_fields(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        found = {}
+        # id сгруппированы по шардам: запросы идут только в шарды, где есть записи
+        for alias, shard_ids in group_by_shard(ids).items():
+            with use_shard(alias):
+                perevals = PerevalInfoSerializer.setup_queryset(PerevalAdded.objects.filter(id__in=shard_ids), fields)
+                serializer = PerevalInfoSerializer(perevals, many=True, fields=fields, context=image_context(request))
+                for item in serializer.data:
+                    found[item['id']] = item
+
+        # Записи, перенесённые архиватором, доступны по тем же id
+        rest = [pk for pk in ids if pk not in found]
+        if rest:
+            archived = PerevalArchive.objects.filter(id__in=rest).select_related('user').prefetch_related('images')
+            for item in PerevalArchiveSerializer(archived, many=True).data:
+                found[item['id']] = {key: item[key] for key in fields if key in item} if fields else item
+
+        return Response({
+            'perevals': [found[pk] for pk in ids if pk in found],
+            'missing': [pk for pk in ids if pk not in found]
+        }, status=status.HTTP_200_OK)